@@ -0,0 +1,185 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Make the score implementations in Code/Scores importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scores'))
+from Frequency_Isolation_Score import evaluate_frequency_isolation
+from Dynamic_Stability_Score import evaluate_dynamic_stability
+from audio_cache import AudioCache, load_audio, resample
+from evaluation import discover_jobs, ground_truth_path, output_base_path, dss_normalizer, TARGETS, ALGORITHMS
+
+# Candidate analysis rates; rates at or above a file's native rate are skipped
+RATES = [32000, 24000, 22050, 16000, 11025]
+
+# Default largest acceptable 95th-percentile drift, in score points
+TOLERANCE = 1.0
+
+SCORES = ['fis', 'dss']
+
+
+def _score(name, reference, estimate, sr, stem, analysis_sr, resampled):
+    # One FIS or DSS on signals already resampled, as the evaluation driver scores them
+    if name == 'fis':
+        return evaluate_frequency_isolation(reference, estimate, sr, analysis_sr=analysis_sr, analysis_audio=resampled)
+    return evaluate_dynamic_stability(reference, estimate, sr, instrument_type=stem, dss_normalizer=dss_normalizer, verbose=False,
+                                      analysis_sr=analysis_sr, analysis_stem=None if resampled is None else resampled[1])
+
+
+def measure_job(job, rates=RATES, scores=SCORES, audio_cache_dir=None, repeats=1):
+    """
+    Score one estimate at its native rate and at each analysis rate.
+
+    Resampling is timed separately: the evaluation driver resamples while decoding, on
+    its prefetch threads and through the audio cache, so it is mostly off the scoring path.
+
+    Parameters:
+    job (tuple): (song, target, algorithm, reference_path, estimate_path).
+    rates (list): Analysis rates in Hz.
+    scores (list): Scores to measure ('fis', 'dss').
+    audio_cache_dir (str): Optional decoded-audio cache folder.
+    repeats (int): Timing repeats; the fastest run is kept.
+
+    Returns:
+    list: One dict per score and rate with 'song', 'stem', 'algorithm', 'score', 'sr',
+    'analysis_sr', 'native', 'value', 'drift', 'native_seconds', 'seconds' (scoring the
+    resampled signals) and 'resample_seconds' (resampling the reference and the estimate).
+    """
+    audio_cache = AudioCache(audio_cache_dir) if audio_cache_dir else None
+    reference, sr = load_audio(job[3], cache=audio_cache)
+    estimate, _ = load_audio(job[4], cache=audio_cache)
+    min_len = min(len(reference), len(estimate))
+    reference, estimate = reference[:min_len], estimate[:min_len]
+
+    def timed(function):
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            value = function()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        return value, best
+
+    rows = []
+    native = {name: timed(lambda: float(_score(name, reference, estimate, sr, job[1], None, None))) for name in scores}
+    for rate in rates:
+        if rate >= sr:
+            continue
+        resampled, resample_seconds = timed(lambda: (resample(reference, sr, rate), resample(estimate, sr, rate)))
+        for name in scores:
+            value, seconds = timed(lambda: float(_score(name, reference, estimate, sr, job[1], rate, resampled)))
+            rows.append({'song': job[0], 'stem': job[1], 'algorithm': job[2], 'score': name, 'sr': sr, 'analysis_sr': rate,
+                         'native': native[name][0], 'value': value, 'drift': value - native[name][0],
+                         'native_seconds': native[name][1], 'seconds': seconds, 'resample_seconds': resample_seconds})
+    return rows
+
+
+def summarize(rows):
+    """
+    Aggregate the drift and speedup of every (stem, score, analysis rate).
+
+    Returns:
+    list: Dicts with 'stem', 'score', 'analysis_sr', 'n', 'mean_drift', 'mean_abs_drift',
+    'p95_abs_drift', 'max_abs_drift', 'speedup' (native over resampled scoring time) and
+    'speedup_with_resampling' (counting the resampling of every signal against each score).
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['stem'], row['score'], row['analysis_sr']), []).append(row)
+    summary = []
+    for (stem, score, rate), group in sorted(groups.items(), key=lambda item: (item[0][0], item[0][1], -item[0][2])):
+        drift = np.array([row['drift'] for row in group])
+        abs_drift = np.abs(drift)
+        summary.append({'stem': stem, 'score': score, 'analysis_sr': rate, 'n': len(group),
+                        'mean_drift': float(np.mean(drift)), 'mean_abs_drift': float(np.mean(abs_drift)),
+                        'p95_abs_drift': float(np.percentile(abs_drift, 95)), 'max_abs_drift': float(np.max(abs_drift)),
+                        'speedup': sum(row['native_seconds'] for row in group) / max(sum(row['seconds'] for row in group), 1e-12),
+                        'speedup_with_resampling': sum(row['native_seconds'] for row in group) / max(sum(row['seconds'] + row['resample_seconds'] for row in group), 1e-12)})
+    return summary
+
+
+def recommend(summary, tolerance=TOLERANCE):
+    """
+    Pick the lowest analysis rate of every stem and score whose drift stays within tolerance.
+
+    Parameters:
+    summary (list): Output of summarize.
+    tolerance (float): Largest acceptable 95th-percentile absolute drift, in score points.
+
+    Returns:
+    dict: {'fis': {stem: rate}, 'dss': {stem: rate}}, in the layout of
+    spectral_features.STEM_ANALYSIS_SR; stems with no acceptable rate are left out.
+    """
+    table = {score: {} for score in SCORES}
+    for row in summary:
+        if row['p95_abs_drift'] > tolerance:
+            continue
+        current = table.setdefault(row['score'], {}).get(row['stem'])
+        if current is None or row['analysis_sr'] < current:
+            table[row['score']][row['stem']] = row['analysis_sr']
+    return table
+
+
+def write_rows(rows, output_file):
+    with open(output_file, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _measure(args):
+    return measure_job(*args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure FIS/DSS drift and speedup of resampled scoring against native-rate scoring.")
+    parser.add_argument('--ground-truth', default=ground_truth_path, help="Folder of song folders holding the reference stems")
+    parser.add_argument('--estimates', default=output_base_path, help="Root of the separation outputs")
+    parser.add_argument('--output-prefix', default='analysis_rate', help="Writes <prefix>_jobs.csv and <prefix>_summary.csv")
+    parser.add_argument('--rates', nargs='+', type=int, default=RATES, help="Analysis rates to compare with the native rate")
+    parser.add_argument('--scores', nargs='+', choices=SCORES, default=SCORES)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="Largest acceptable 95th-percentile drift in score points")
+    parser.add_argument('--max-jobs', type=int, default=None, help="Measure at most this many estimates (spread over the dataset)")
+    parser.add_argument('--repeats', type=int, default=1, help="Timing repeats per score; the fastest is kept")
+    parser.add_argument('--audio-cache', default=None, help="Folder for decoded float32 audio")
+    parser.add_argument('--workers', type=int, default=1, help="Processes measuring estimates (timings are noisier with several)")
+    parser.add_argument('--targets', nargs='+', default=TARGETS, help="Stems to include")
+    parser.add_argument('--algorithms', nargs='+', default=ALGORITHMS, help="Algorithms to include")
+    args = parser.parse_args(argv)
+
+    jobs = discover_jobs(args.ground_truth, args.estimates, targets=args.targets, algorithms=args.algorithms)
+    if args.max_jobs is not None and len(jobs) > args.max_jobs:
+        jobs = [jobs[i] for i in np.linspace(0, len(jobs) - 1, args.max_jobs).astype(int)]
+    tasks = [(job, args.rates, args.scores, args.audio_cache, args.repeats) for job in jobs]
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            rows = [row for job_rows in executor.map(_measure, tasks) for row in job_rows]
+    else:
+        rows = [row for task in tasks for row in _measure(task)]
+    if not rows:
+        print("Nothing measured: no estimates found, or every file is already at or below the candidate rates.")
+        return
+
+    summary = summarize(rows)
+    write_rows(rows, f"{args.output_prefix}_jobs.csv")
+    write_rows(summary, f"{args.output_prefix}_summary.csv")
+    print(f"Measured {len(jobs)} estimates; per-estimate drift in {args.output_prefix}_jobs.csv, summary in {args.output_prefix}_summary.csv.\n")
+    print(f"{'stem':<8} {'score':<5} {'rate':>6} {'n':>4} {'mean':>8} {'p95 |d|':>8} {'max |d|':>8} {'speedup':>8} {'+resample':>9}")
+    for row in summary:
+        print(f"{row['stem']:<8} {row['score']:<5} {row['analysis_sr']:>6} {row['n']:>4} {row['mean_drift']:>+8.3f} {row['p95_abs_drift']:>8.3f} {row['max_abs_drift']:>8.3f} {row['speedup']:>7.2f}x {row['speedup_with_resampling']:>8.2f}x")
+
+    table = recommend(summary, args.tolerance)
+    print(f"\nLowest rates within {args.tolerance} points (95th percentile), for STEM_ANALYSIS_SR in Code/Scores/spectral_features.py:")
+    print("STEM_ANALYSIS_SR = {")
+    for score in SCORES:
+        print(f"    '{score}': {table.get(score, {})},")
+    print("}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+import soundfile as sf
+
+
+class AudioCache:
+    """
+    On-disk cache of decoded audio stored as float32 .npy files.
+
+    Entries are keyed by the absolute source path, its modification time and size, the
+    channel layout and, for resampled entries, the sample rate, so an edited file is
+    decoded again. Cached audio is opened with np.load(mmap_mode='r'): loads are zero-copy
+    read-only views, and worker processes reading the same file share its pages through
+    the OS page cache.
+
+    Parameters:
+    cache_dir (str): Folder holding the cached arrays.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, path, mono=True, sr=None):
+        """
+        Return the cache key of an audio file in its current state.
+        """
+        stat = os.stat(path)
+        identity = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{'mono' if mono else 'multi'}"
+        if sr is not None:
+            identity += f"|{sr}"
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def load(self, path, mono=True, sr=None):
+        """
+        Load an audio file, decoding it only if no current cache entry exists.
+
+        Parameters:
+        path (str): Audio file path.
+        mono (bool): If True, downmix to mono like librosa.load; otherwise return
+            (channels, samples).
+        sr (int): If given, resample to this rate with a polyphase filter; the resampled
+            audio gets its own entry, made from the cached native-rate audio.
+
+        Returns:
+        tuple: (audio, sr) where audio is a read-only memory-mapped float32 array.
+        """
+        native = None
+        if sr is not None:
+            native = self.load(path, mono=mono)
+            if native[1] == sr:
+                return native
+        key = self.key(path, mono, sr)
+        array_path = os.path.join(self.cache_dir, key + '.npy')
+        info_path = os.path.join(self.cache_dir, key + '.json')
+        if not os.path.exists(array_path):
+            audio, sr = decode_audio(path, mono=mono) if native is None else (resample(*native, sr), sr)
+            # Write the info first: the array appearing is what marks an entry complete
+            self._write_atomic(info_path, lambda file: file.write(json.dumps({'source': os.path.abspath(path), 'sr': sr}).encode()))
+            self._write_atomic(array_path, lambda file: np.save(file, audio))
+        with open(info_path) as file:
+            sr = json.load(file)['sr']
+        return np.load(array_path, mmap_mode='r'), sr
+
+    def _write_atomic(self, path, write):
+        # Concurrent workers may decode the same file; os.replace makes the last writer win cleanly
+        handle, temporary_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                write(file)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+
+def decode_audio(path, mono=True):
+    """
+    Decode an audio file to float32 without resampling.
+
+    Parameters:
+    path (str): Audio file path.
+    mono (bool): If True, average the channels like librosa.load; otherwise return
+        (channels, samples).
+
+    Returns:
+    tuple: (audio, sr).
+    """
+    audio, sr = sf.read(path, dtype='float32', always_2d=True)
+    if mono:
+        return np.ascontiguousarray(np.mean(audio, axis=1, dtype=np.float32)), sr
+    return np.ascontiguousarray(audio.T), sr
+
+
+def resample(audio, orig_sr, target_sr):
+    """
+    Resample decoded audio with the polyphase filter the scorers use.
+
+    Returns:
+    ndarray: float32 audio at `target_sr`.
+    """
+    # Imported here: spectral_features loads librosa, which plain decoding does not need
+    from spectral_features import resample_audio
+    return resample_audio(audio, orig_sr, target_sr)
+
+
+def load_audio(path, cache=None, mono=True, sr=None):
+    """
+    Load an audio file through `cache` when one is given.
+
+    Parameters:
+    path (str): Audio file path.
+    cache (AudioCache): Optional decoded-audio cache.
+    mono (bool): If True, downmix to mono.
+    sr (int): If given, resample to this rate (see AudioCache.load).
+
+    Returns:
+    tuple: (audio, sr).
+    """
+    if cache is not None:
+        return cache.load(path, mono=mono, sr=sr)
+    audio, native_sr = decode_audio(path, mono=mono)
+    if sr is None or sr == native_sr:
+        return audio, native_sr
+    return resample(audio, native_sr, sr), sr
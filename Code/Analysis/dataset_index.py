@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+import soundfile as sf
+
+from results_store import relative_name
+
+# Listings of folders modified this recently are not trusted: a file added within the same
+# mtime tick would otherwise go unnoticed
+MTIME_SAFETY_NS = 2 * 10 ** 9
+
+
+class DatasetIndex:
+    """
+    Persistent SQLite manifest of a MUSDB-style dataset and its separation outputs.
+
+    For every song it records the mixture and reference stems of the ground truth and the
+    stem files of each algorithm (including the Demucs model folder), with the sample
+    rate, length, channel count, mtime and size of each file. `update` re-lists a folder
+    only when its mtime changed and reads the header of a file only when its mtime or size
+    changed, so refreshing a large corpus costs one stat per folder (plus one per file with
+    `stat_files`). Lookups by song name and job planning then read the index only.
+
+    One index can hold several ground-truth folders (e.g. the train and test subsets); every
+    track is recorded under the absolute path of its ground-truth folder, and listings and
+    lookups are scoped to one such root.
+
+    Parameters:
+    path (str): SQLite file holding the index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS folders (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                entries TEXT NOT NULL
+            )""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                sr INTEGER, frames INTEGER, channels INTEGER
+            )""")
+        # Indexes written before tracks were keyed by root are rebuilt by the next update of each root
+        if self.connection.execute("SELECT pk FROM pragma_table_info('tracks') WHERE name = 'root'").fetchone() == (0,):
+            self.connection.execute("DROP TABLE tracks")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS tracks (
+                root TEXT NOT NULL,
+                song TEXT NOT NULL,
+                source TEXT NOT NULL,
+                stem TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (root, song, source, stem)
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tracks_root ON tracks (root)")
+        self.connection.commit()
+        self._listed = 0
+        self._probed = 0
+
+    def update(self, ground_truth_path, output_base_path=None, algorithms=('Demucs', 'UMX'), stat_files=True):
+        """
+        Bring the index of one ground-truth folder (and its separation outputs) up to date.
+
+        Parameters:
+        ground_truth_path (str): Folder of song folders holding mixture.wav and the reference stems.
+        output_base_path (str): Root of the separation outputs (<root>/<song>/<algorithm>/...), or None.
+        algorithms (tuple): Algorithm folders to index.
+        stat_files (bool): If True, stat every indexed file so files rewritten in place (which
+            leaves the folder mtime unchanged) are noticed. If False, only folder mtimes are checked.
+
+        Returns:
+        dict: 'songs' indexed, folders 'listed' again and files 'probed' for their audio header.
+        """
+        self._listed = 0
+        self._probed = 0
+        root = os.path.abspath(ground_truth_path)
+        tracks = []
+        for song, kind in sorted((self._entries(root) or {}).items()):
+            if kind != 'dir':
+                continue
+            song_folder = os.path.join(root, song)
+            for stem in _wav_stems(self._entries(song_folder)):
+                tracks.append((root, song, 'reference', stem, os.path.join(song_folder, f"{stem}.wav")))
+            if output_base_path is None:
+                continue
+            for algorithm in algorithms:
+                folder = estimate_folder(os.path.abspath(output_base_path), song, algorithm, self._entries)
+                if folder is None:
+                    continue
+                for stem in _wav_stems(self._entries(folder)):
+                    tracks.append((root, song, algorithm, stem, os.path.join(folder, f"{stem}.wav")))
+
+        tracks = [track for track in tracks if self._probe(track[4], stat_files)]
+        self.connection.execute("DELETE FROM tracks WHERE root = ?", (root,))
+        self.connection.executemany("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?)", tracks)
+        self.connection.execute("DELETE FROM files WHERE path NOT IN (SELECT path FROM tracks)")
+        self.connection.commit()
+        return {'songs': len({track[1] for track in tracks}), 'listed': self._listed, 'probed': self._probed}
+
+    def _entries(self, folder):
+        # Listing of a folder as {name: 'dir' | 'file'}, read again only when its mtime changed;
+        # None when the folder does not exist
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return None
+        row = self.connection.execute("SELECT mtime_ns, entries FROM folders WHERE path = ?", (folder,)).fetchone()
+        if row is not None and row[0] == mtime:
+            return json.loads(row[1])
+        entries = list_folder(folder)
+        if entries is None:
+            return None
+        trusted = time.time_ns() - mtime > MTIME_SAFETY_NS
+        self.connection.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?)", (folder, mtime if trusted else -1, json.dumps(entries)))
+        self._listed += 1
+        return entries
+
+    def _probe(self, path, stat_files):
+        # Read the audio header of a new or changed file. A file deleted or replaced while it
+        # is read is left out of this update, and the listing of its folder is invalidated so
+        # the next update lists and probes it again; returns whether the file is indexed
+        row = self.connection.execute("SELECT mtime_ns, size FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and not stat_files:
+            return True
+        try:
+            stat = os.stat(path)
+            if row is not None and tuple(row) == (stat.st_mtime_ns, stat.st_size):
+                return True
+            info = sf.info(path)
+        except (OSError, RuntimeError):
+            self.connection.execute("UPDATE folders SET mtime_ns = -1 WHERE path = ?", (os.path.dirname(path),))
+            return False
+        self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                (path, stat.st_mtime_ns, stat.st_size, info.samplerate, info.frames, info.channels))
+        self._probed += 1
+        return True
+
+    def songs(self, root=None):
+        """
+        Return the indexed song names, sorted.
+
+        Parameters:
+        root (str): Ground-truth folder to list, or None for every indexed folder.
+        """
+        if root is None:
+            return [song for song, in self.connection.execute("SELECT DISTINCT song FROM tracks ORDER BY song")]
+        return [song for song, in self.connection.execute("SELECT DISTINCT song FROM tracks WHERE root = ? ORDER BY song", (os.path.abspath(root),))]
+
+    def song(self, name, root=None):
+        """
+        Look up one song by name.
+
+        Parameters:
+        name (str): Song folder name, e.g. 'A Classic Education - NightOwl'.
+        root (str): Ground-truth folder of the song, or None to search every indexed folder
+            (the first folder holding the song, in path order, is used).
+
+        Returns:
+        dict: {'name', 'mixture', 'stems': {stem: file}, 'estimates': {algorithm: {stem: file}}}
+        where each file is a dict with 'path', 'sr', 'frames', 'channels', 'duration',
+        'mtime_ns' and 'size'; 'mixture' is None when the song has no mixture.wav.
+        Returns None if the song is not indexed.
+        """
+        if root is None:
+            root = self.connection.execute("SELECT MIN(root) FROM tracks WHERE song = ?", (name,)).fetchone()[0]
+            if root is None:
+                return None
+        rows = self.connection.execute("""
+            SELECT tracks.source, tracks.stem, tracks.path, files.mtime_ns, files.size, files.sr, files.frames, files.channels
+            FROM tracks JOIN files ON files.path = tracks.path WHERE tracks.root = ? AND tracks.song = ?""", (os.path.abspath(root), name)).fetchall()
+        if not rows:
+            return None
+        song = {'name': name, 'mixture': None, 'stems': {}, 'estimates': {}}
+        for source, stem, path, mtime_ns, size, sr, frames, channels in rows:
+            file = {'path': path, 'sr': sr, 'frames': frames, 'channels': channels, 'duration': frames / sr, 'mtime_ns': mtime_ns, 'size': size}
+            if source != 'reference':
+                song['estimates'].setdefault(source, {})[stem] = file
+            elif stem == 'mixture':
+                song['mixture'] = file
+            else:
+                song['stems'][stem] = file
+        return song
+
+    def mixtures(self, root):
+        """
+        List the mixture.wav of every song of one ground-truth folder, like
+        separation_driver.find_mixtures.
+
+        Parameters:
+        root (str): Ground-truth folder, as passed to `update`.
+
+        Returns:
+        list: (song name, mixture path) tuples.
+        """
+        return list(self.connection.execute("SELECT song, path FROM tracks WHERE root = ? AND source = 'reference' AND stem = 'mixture' ORDER BY song",
+                                            (os.path.abspath(root),)))
+
+    def jobs(self, root, targets, algorithms):
+        """
+        List every (song, stem, algorithm) combination of one ground-truth folder with both
+        a reference and an estimate, in the order of evaluation.discover_jobs.
+
+        Parameters:
+        root (str): Ground-truth folder, as passed to `update`.
+        targets (list): Stem names to include.
+        algorithms (list): Algorithm names to include.
+
+        Returns:
+        list: Jobs as (song, target, algorithm, reference_path, estimate_path) tuples.
+        """
+        rows = self.connection.execute("""
+            SELECT reference.song, reference.stem, estimate.source, reference.path, estimate.path
+            FROM tracks AS reference JOIN tracks AS estimate
+            ON estimate.root = reference.root AND estimate.song = reference.song AND estimate.stem = reference.stem AND estimate.source != 'reference'
+            WHERE reference.root = ? AND reference.source = 'reference'""", (os.path.abspath(root),))
+        target_order = {target: i for i, target in enumerate(targets)}
+        algorithm_order = {algorithm: i for i, algorithm in enumerate(algorithms)}
+        jobs = [row for row in rows if row[1] in target_order and row[2] in algorithm_order]
+        return sorted(jobs, key=lambda job: (job[0], target_order[job[1]], algorithm_order[job[2]]))
+
+    def fingerprint(self, paths, roots=None):
+        """
+        Return the same fingerprint as results_store.file_fingerprint from the indexed mtime
+        and size, without touching the files.
+        """
+        digest = hashlib.sha1()
+        for index, path in enumerate(paths):
+            mtime_ns, size = self.connection.execute("SELECT mtime_ns, size FROM files WHERE path = ?", (path,)).fetchone()
+            digest.update(f"{relative_name(path, None if roots is None else roots[index])}|{mtime_ns}|{size}".encode())
+        return digest.hexdigest()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def list_folder(folder):
+    """
+    List a folder as {name: 'dir' | 'file'}.
+
+    Parameters:
+    folder (str): Folder to list.
+
+    Returns:
+    dict: Kind of every entry by name, or None if the folder does not exist.
+    """
+    try:
+        with os.scandir(folder) as scan:
+            return {entry.name: 'dir' if entry.is_dir() else 'file' for entry in scan}
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def estimate_folder(output_base_path, song, algorithm, list_folder=list_folder):
+    """
+    Locate the folder holding the separated stems of one song for one algorithm.
+
+    Demucs writes <root>/<song>/Demucs/<model>/mixture; the first model folder in sorted
+    order is used, and files beside the model folders (e.g. .DS_Store) are ignored. UMX
+    writes <root>/<song>/UMX/mixture.
+
+    Parameters:
+    output_base_path (str): Root of the separation outputs.
+    song (str): Song folder name.
+    algorithm (str): 'Demucs' or 'UMX'.
+    list_folder (callable): Lists a folder as {name: 'dir' | 'file'}, or None if it does
+        not exist; DatasetIndex passes its cached listings.
+
+    Returns:
+    str: The estimate folder, or None if the algorithm has no output for the song.
+    """
+    base_estimate_folder = os.path.join(output_base_path, song, algorithm)
+    if algorithm == 'Demucs':
+        model_folders = sorted(name for name, kind in (list_folder(base_estimate_folder) or {}).items() if kind == 'dir')
+        if not model_folders:
+            return None
+        return os.path.join(base_estimate_folder, model_folders[0], "mixture")
+    if algorithm == 'UMX':
+        return os.path.join(base_estimate_folder, "mixture")
+    return None
+
+
+def _wav_stems(entries):
+    # Stem names of the .wav files of a listing
+    return sorted(name[:-4] for name, kind in (entries or {}).items() if kind == 'file' and name.endswith('.wav'))
@@ -1,8 +1,29 @@
 import os
-import mir_eval
-import librosa
+import sys
+import time
+import queue
+import argparse
+import multiprocessing
+from functools import partial
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
 import numpy as np
-import csv
+
+# Make the score implementations in Code/Scores importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scores'))
+from Frequency_Isolation_Score import evaluate_frequency_isolation
+from Dynamic_Stability_Score import evaluate_dynamic_stability, PUBLISHED_DSS_NORMALIZER
+from spectral_features import FeatureCache, STEM_ANALYSIS_SR, analysis_rate
+from batch_scoring import score_multichannel
+import instrumentation
+from instrumentation import span
+from results_store import ResultsStore, CSV_HEADER, file_fingerprint, parameter_hash
+from windowed_bss_eval import bss_eval_windowed
+from audio_cache import AudioCache, load_audio, resample
+from prefetch import Prefetcher, read_ahead
+from dataset_index import DatasetIndex, estimate_folder
+from work_queue import LeaseQueue, LEASE_SECONDS, in_shard, parse_shard, task_id
 
 # Define paths
 ground_truth_path = 'F:\\coding\\workspace\\stem sap\\musdb18hq\\train'
@@ -11,159 +32,709 @@ output_base_path = 'F:\\coding\\workspace\\stem sap\\sap_output'
 # Output CSV file path
 evaluation_output_file = 'F:\\coding\\workspace\\stem sap\\evaluation_results.csv'
 
+# Stability calibration used for the published results
+dss_normalizer = PUBLISHED_DSS_NORMALIZER
+
+TARGETS = ["vocals", "drums", "bass", "other"]
+ALGORITHMS = ["Demucs", "UMX"]
+
+# Rough peak memory of one job per byte of input wav (decoded audio, STFT magnitudes and BSS-eval buffers)
+MEMORY_PER_INPUT_BYTE = 12
+
+# Default number of I/O threads reading upcoming inputs ahead of the workers
+IO_THREADS = 4
+
+# Default number of rows the writer commits at once
+COMMIT_EVERY = 32
+
+# Share STFT and RMS between FIS, DSS and both algorithms of the same reference.
+# Each worker process gets its own copy.
+feature_cache = FeatureCache()
+
+
+def score_parameters(dss_normalizer=dss_normalizer, bss_mode='full', bss_window=1.0, channels='mono', analysis_sr=None):
+    """
+    Collect every parameter that affects a result row, for keying the results store.
+
+    Parameters:
+    dss_normalizer (float): Stability calibration passed to the DSS.
+    bss_mode (str): 'full' for whole-track BSS-eval or 'windowed' for fixed windows.
+    bss_window (float): Window length in seconds for the windowed mode.
+    channels (str): 'mono' to score the downmix or 'multi' to score every channel.
+    analysis_sr (int or str): FIS/DSS analysis rate in Hz, 'auto' for the per-stem rates
+        of STEM_ANALYSIS_SR, or None for the native rate.
+
+    Returns:
+    dict: Score parameters.
+    """
+    parameters = {
+        'bss_eval': 'bss_eval_sources',
+        'fft_window_size': 2048,
+        'hop_length': 512,
+        'dss_normalizer': dss_normalizer,
+    }
+    if bss_mode == 'windowed':
+        parameters['bss_eval'] = 'bss_eval_windowed'
+        parameters['bss_window'] = bss_window
+    if channels == 'multi':
+        parameters['channels'] = 'multi'
+    if analysis_sr is not None:
+        # The table itself is hashed, so editing it invalidates the stored rows
+        parameters['analysis_sr'] = STEM_ANALYSIS_SR if analysis_sr == 'auto' else analysis_sr
+    return parameters
 
-# Function to evaluate frequency isolation
-def evaluate_frequency_isolation(mix, stem, sr, fft_window_size=2048, hop_length=512, weight_fundamental=40.0, plot_spectrogram=False):
-    # Short-Time Fourier Transform for both mix and stem
-    stft_mix = librosa.stft(mix, n_fft=fft_window_size, hop_length=hop_length, window='hann')
-    stft_stem = librosa.stft(stem, n_fft=fft_window_size, hop_length=hop_length, window='hann')
-    
-    # Calculate magnitudes
-    mag_mix = np.abs(stft_mix)
-    mag_stem = np.abs(stft_stem)
-    
-    # Ensure the number of time frames matches between mix and stem
-    min_frames = min(mag_mix.shape[1], mag_stem.shape[1])
-    mag_mix = mag_mix[:, :min_frames]
-    mag_stem = mag_stem[:, :min_frames]
-    
-    # Initialize score components
-    fundamental_score = 0
-    harmonics_score = 0
-    weight_harmonics = 60.0
-    count_valid_frames = 0
-    
-    # Calculate frequency presence score
-    fundamental_freq_indices = np.array([np.flatnonzero(mag_stem[:, t] > 0)[0] if len(np.flatnonzero(mag_stem[:, t] > 0)) > 0 else 0 for t in range(mag_stem.shape[1])])
-    fundamental_freq_indices = np.clip(fundamental_freq_indices, 0, mag_mix.shape[0] - 1)
-    
-    for t, f_idx in enumerate(fundamental_freq_indices):
-        count_valid_frames += 1
-        # Check if fundamental is present in the mix
-        if mag_mix[f_idx, t] > 0:
-            fundamental_score = weight_fundamental  # Fixed 40 points if fundamental is present
-        
-        # Check all possible harmonics up to 20,000 Hz
-        harmonic_indices = [f_idx * (n + 1) for n in range(1, int(20000 / (sr / fft_window_size))) if f_idx * (n + 1) < mag_mix.shape[0]]
-        
-        for idx in harmonic_indices:
-            if mag_mix[idx, t] >= mag_stem[idx, t]:
-                harmonics_score += 1  # Add 1 if the harmonic energy in the mix is greater or equal to that in the stem
-    
-    # Normalize harmonics score to 50 points
-    max_possible_harmonics_score = count_valid_frames * len(harmonic_indices)  # All harmonics per frame
-    if max_possible_harmonics_score > 0:
-        harmonics_score = (harmonics_score / max_possible_harmonics_score) * weight_harmonics
-    
-    # Calculate frequency presence score (0 - 100)
-    frequency_presence_score = fundamental_score + harmonics_score  # 40 for fundamental, 60 for harmonics
-    
-    return frequency_presence_score
-
-# Function to evaluate dynamic stability
-def evaluate_dynamic_stability(mix, stem, sr, fft_window_size=2048, hop_length=512, plot_spectrogram=False, instrument_type=None):
-    # Calculate RMS
-    rms_stem = librosa.feature.rms(y=stem, frame_length=fft_window_size, hop_length=hop_length)[0]
-    presence_threshold = 0.1 * np.max(rms_stem)
-    active_frames = rms_stem > presence_threshold  # Boolean mask for active frames
-    
-    # Filter RMS using active frames
-    active_rms_stem = rms_stem[active_frames]
-    dss = np.mean(active_rms_stem) / (np.std(active_rms_stem) + 1e-6) if len(active_rms_stem) > 0 else 0
-    dss = (dss / 3.5) * 100
-    
-    # Spectral Flux Calculation
-    stft_stem = librosa.stft(stem, n_fft=fft_window_size, hop_length=hop_length)
-    mag_stem = np.abs(stft_stem)
-    flux_differences = np.diff(mag_stem, axis=1) ** 2
-    flux_per_frame = np.sum(flux_differences, axis=0)
-    
-    # Filter spectral flux using active frames
-    active_flux = flux_per_frame[active_frames[1:]]  # Skip the first frame due to np.diff
-    flux_max_reference = 15000
-    flux_score = (np.mean(active_flux) / flux_max_reference) * 100 if len(active_flux) > 0 else 0
-    flux_score = min(max(flux_score, 0), 30)
-    
-    # Final Scoring
-    if instrument_type == 'drums':
-        final_dynamic_score = dss + flux_score
-    elif instrument_type == 'bass':
-        final_dynamic_score = dss
-    else:
-        final_dynamic_score = dss - flux_score
-    final_dynamic_score = max(final_dynamic_score, 0)
-    
-    return final_dynamic_score
 
-# Prepare CSV file
-with open(evaluation_output_file, mode='w', newline='') as file:
-    writer = csv.writer(file)
-    writer.writerow(["Song Name", "Stem Name", "Algorithm Type", "SDR (dB)", "SIR (dB)", "SAR (dB)", "Frequency Isolation Score", "Dynamic Stability Score"])
+def parse_analysis_sr(text):
+    """
+    Parse an --analysis-sr value: a rate in Hz or 'auto'.
+    """
+    return text if text == 'auto' else int(text)
 
+
+def find_estimate_folder(output_base_path, folder_name, algorithm):
+    """
+    Locate the folder holding the separated stems of one song for one algorithm.
+
+    Parameters:
+    output_base_path (str): Root of the separation outputs.
+    folder_name (str): Song folder name.
+    algorithm (str): 'Demucs' or 'UMX'.
+
+    Returns:
+    str: The estimate folder, or None if the algorithm has no output for the song.
+    """
+    # The same rule as the dataset index, so both pick the same Demucs model folder
+    return estimate_folder(output_base_path, folder_name, algorithm)
+
+
+def discover_jobs(ground_truth_path, output_base_path, targets=TARGETS, algorithms=ALGORITHMS):
+    """
+    List every (song, stem, algorithm) combination that has both a reference and an estimate.
+
+    Parameters:
+    ground_truth_path (str): Folder of MUSDB-style song folders holding the reference stems.
+    output_base_path (str): Root of the separation outputs.
+    targets (list): Stem names to evaluate.
+    algorithms (list): Algorithm names to evaluate.
+
+    Returns:
+    list: Jobs as (song, target, algorithm, reference_path, estimate_path) tuples.
+    """
+    jobs = []
     # Iterate through each song folder in the ground truth path
-    for folder_name in os.listdir(ground_truth_path):
+    for folder_name in sorted(os.listdir(ground_truth_path)):
         song_folder = os.path.join(ground_truth_path, folder_name)
         if not os.path.isdir(song_folder):
             continue
 
-        # Iterate over each target (vocals, drums, bass, other)
-        for target in ["vocals", "drums", "bass", "other"]:
+        # Index each folder once instead of testing every stem path
+        reference_files = _list_files(song_folder)
+        estimate_folders = {algorithm: find_estimate_folder(output_base_path, folder_name, algorithm) for algorithm in algorithms}
+        estimate_files = {algorithm: _list_files(folder) for algorithm, folder in estimate_folders.items() if folder is not None}
+        for target in targets:
             # Construct the path to the reference
+            if f"{target}.wav" not in reference_files:
+                continue
             reference_path = os.path.join(song_folder, f"{target}.wav")
 
-            # Iterate over algorithms (Demucs and UMX)
-            for algorithm in ["Demucs", "UMX"]:
-                # Construct the estimate path based on the algorithm
-                base_estimate_folder = os.path.join(output_base_path, folder_name, algorithm)
-
-                if algorithm == 'Demucs':
-                    # List the base estimate folder to get the model name (e.g., "htdemucs")
-                    if os.path.exists(base_estimate_folder):
-                        model_folders = os.listdir(base_estimate_folder)
-                        if model_folders:
-                            model_folder = model_folders[0]  # Assume only one model folder exists
-                            final_estimate_folder = os.path.join(base_estimate_folder, model_folder, "mixture")
-                        else:
-                            continue
-                    else:
-                        continue
-                elif algorithm == 'UMX':
-                    # UMX always has a "mixture" folder
-                    final_estimate_folder = os.path.join(base_estimate_folder, "mixture")
+            for algorithm in algorithms:
+                if f"{target}.wav" in estimate_files.get(algorithm, ()):
+                    estimate_path = os.path.join(estimate_folders[algorithm], f"{target}.wav")
+                    jobs.append((folder_name, target, algorithm, reference_path, estimate_path))
+    return jobs
+
+
+def _list_files(folder):
+    # Names of the regular files in a folder; empty when it does not exist
+    try:
+        with os.scandir(folder) as entries:
+            return {entry.name for entry in entries if entry.is_file()}
+    except OSError:
+        return set()
+
+
+def evaluate_job(job, dss_normalizer=dss_normalizer, cache=None, bss_mode='full', bss_window=1.0, audio_cache=None, channels='mono', audio=None, max_memory=None, analysis_sr=None):
+    """
+    Compute BSS-eval metrics, FIS and DSS for one estimate.
+
+    Parameters:
+    job (tuple): (song, target, algorithm, reference_path, estimate_path).
+    dss_normalizer (float): Stability calibration passed to the DSS.
+    cache (FeatureCache): Optional cache shared between jobs of the same process.
+    bss_mode (str): 'full' for whole-track BSS-eval or 'windowed' for fixed windows,
+        in which case the row holds the median over windows.
+    bss_window (float): Window length in seconds for the windowed mode.
+    audio_cache (AudioCache): Optional decoded-audio cache, so each file is decoded once across
+        algorithms, runs and worker processes.
+    channels (str): 'mono' scores the downmix. 'multi' reads every channel and reports the
+        mean FIS/DSS over channels, computed in one batched pass (per-channel scores are
+        returned as well); BSS-eval then runs on the channel average.
+    audio (tuple): Already decoded (ref_audio, est_audio, sr), e.g. from a prefetch thread;
+        if None the files are decoded here.
+    max_memory (int): Working-memory budget of the mono FIS/DSS in bytes; if given they run
+        in low-memory mode and switch to blocks of frames when the spectrograms do not fit.
+    analysis_sr (int or str): Rate the mono FIS/DSS run at, or 'auto' for the rate of the
+        target stem in STEM_ANALYSIS_SR; BSS-eval always runs at the native rate. The
+        signals are resampled while decoding (through `audio_cache` when given).
+
+    Returns:
+    tuple: (row, windows, channel_scores) where row is one CSV row in CSV_HEADER order,
+    windows holds the per-window metrics of the windowed mode (None for 'full') and
+    channel_scores the per-channel {'fis', 'dss'} of the multichannel mode (None for 'mono').
+    """
+    folder_name, target, algorithm, reference_path, estimate_path = job
+    with instrumentation.tags(song=folder_name, stem=target, algorithm=algorithm), span('job'):
+        if audio is None:
+            audio = _decode_job(job, audio_cache, mono=channels != 'multi', analysis_rates=_analysis_rates(target, analysis_sr))
+        return _evaluate_job(job, dss_normalizer, cache, bss_mode, bss_window, channels, audio, max_memory, analysis_sr)
+
+
+def _analysis_rates(target, analysis_sr):
+    # Distinct FIS/DSS analysis rates of a stem (empty when both run at the native rate)
+    return sorted({rate for rate in (analysis_rate('fis', target, analysis_sr), analysis_rate('dss', target, analysis_sr)) if rate is not None})
+
+
+def _decode_job(job, audio_cache, mono, references=None, analysis_rates=()):
+    # Load the reference and estimated audio (native sample rate; (channels, samples) unless mono),
+    # plus both resampled to each of `analysis_rates` as {rate: (ref_audio, est_audio)}, so the
+    # resampling runs with the decoding (on the prefetch thread, from the audio cache when there is one).
+    # `references` keeps the last decoded reference, at every rate, for the following jobs of a chunk.
+    with span('job.decode') as decode_span:
+        if references is None or job[3] not in references:
+            reference = {None: load_audio(job[3], cache=audio_cache, mono=mono)}
+            if references is not None:
+                references.clear()
+                references[job[3]] = reference
+        else:
+            reference = references[job[3]]
+        ref_audio, sr = reference[None]
+        est_audio, _ = load_audio(job[4], cache=audio_cache, mono=mono)
+        # Read-only audio is hashed once by the feature cache, however many scorers and jobs share it
+        ref_audio.flags.writeable = False
+        est_audio.flags.writeable = False
+        decode_span.add_bytes(ref_audio.nbytes + est_audio.nbytes)
+        analysis = {}
+        for rate in analysis_rates:
+            if rate == sr:
+                continue
+            if rate not in reference:
+                reference[rate] = _load_resampled(job[3], ref_audio, sr, rate, audio_cache, mono)
+            analysis[rate] = reference[rate], _load_resampled(job[4], est_audio, sr, rate, audio_cache, mono)
+    return ref_audio, est_audio, sr, analysis
+
+
+def _load_resampled(path, audio, sr, rate, audio_cache, mono):
+    # From the audio cache when there is one, else resampled from the decoded audio
+    if audio_cache is not None:
+        return audio_cache.load(path, mono=mono, sr=rate)[0]
+    resampled = resample(audio, sr, rate)
+    resampled.flags.writeable = False
+    return resampled
+
+
+def _evaluate_job(job, dss_normalizer, cache, bss_mode, bss_window, channels, audio, max_memory=None, analysis_sr=None):
+    folder_name, target, algorithm, reference_path, estimate_path = job
+    multichannel = channels == 'multi'
+    ref_audio, est_audio, sr, analysis = audio
+
+    # Truncate to match length; arrays already of that length are passed on as they are,
+    # so the feature cache sees the same objects and reuses their content hashes
+    ref_audio, est_audio = _truncate(ref_audio, est_audio)
+    analysis = {rate: _truncate(*signals) for rate, signals in analysis.items()}
+
+    channel_scores = None
+    if multichannel:
+        with span('job.multichannel', nbytes=ref_audio.nbytes + est_audio.nbytes):
+            scores = score_multichannel(ref_audio, est_audio, sr, instrument_type=target, dss_normalizer=dss_normalizer)
+        channel_scores = scores['channels']
+        # BSS-eval on the channel average, comparable with the mono results
+        ref_audio = np.mean(ref_audio, axis=0, dtype=np.float32)
+        est_audio = np.mean(est_audio, axis=0, dtype=np.float32)
+
+    windows = None
+    with span('job.bss_eval', nbytes=ref_audio.nbytes + est_audio.nbytes):
+        if bss_mode == 'windowed':
+            # Windows run in this process; the dataset driver already parallelizes across jobs
+            windows = bss_eval_windowed(ref_audio, est_audio, sr, window_seconds=bss_window)
+            sdr, sir, sar = ([windows['median'][name]] for name in ('sdr', 'sir', 'sar'))
+        else:
+            # Prepare references and estimates for mir_eval (shape: (n_sources, n_samples))
+            reference_sources = np.array([ref_audio])
+            estimated_sources = np.array([est_audio])
+
+            # Perform evaluation using mir_eval (imported here: it is slow to load and only needed for this mode)
+            import mir_eval
+            sdr, sir, sar, _ = mir_eval.separation.bss_eval_sources(reference_sources, estimated_sources)
+
+    # Calculate frequency isolation and dynamic stability scores
+    if multichannel:
+        freq_isolation_score, dynamic_stability_score = scores['fis'], scores['dss']
+    else:
+        fis_sr, dss_sr = analysis_rate('fis', target, analysis_sr), analysis_rate('dss', target, analysis_sr)
+        with span('job.fis', nbytes=ref_audio.nbytes + est_audio.nbytes):
+            freq_isolation_score = evaluate_frequency_isolation(ref_audio, est_audio, sr, cache=cache, max_memory=max_memory, analysis_sr=fis_sr, analysis_audio=analysis.get(fis_sr))
+        with span('job.dss', nbytes=est_audio.nbytes):
+            dynamic_stability_score = evaluate_dynamic_stability(ref_audio, est_audio, sr, instrument_type=target, dss_normalizer=dss_normalizer, cache=cache, verbose=False, max_memory=max_memory, analysis_sr=dss_sr, analysis_stem=analysis[dss_sr][1] if dss_sr in analysis else None)
+
+    return [folder_name, target, algorithm, sdr[0], sir[0], sar[0], freq_isolation_score, dynamic_stability_score], windows, channel_scores
+
+
+def _truncate(ref_audio, est_audio):
+    # Both signals cut to the shorter length (samples on the last axis)
+    min_len = min(ref_audio.shape[-1], est_audio.shape[-1])
+    return tuple(audio if audio.shape[-1] == min_len else audio[..., :min_len] for audio in (ref_audio, est_audio))
+
+
+def estimate_job_memory(job):
+    """
+    Estimate the peak memory of one job from the size of its input files.
+
+    Parameters:
+    job (tuple): (song, target, algorithm, reference_path, estimate_path).
+
+    Returns:
+    int: Estimated peak memory in bytes.
+    """
+    return MEMORY_PER_INPUT_BYTE * (os.path.getsize(job[3]) + os.path.getsize(job[4]))
+
+
+def chunk_jobs(jobs):
+    """
+    Group jobs sharing a reference into chunks that run in one worker call.
+
+    Keeping them together lets the worker's feature cache reuse the reference STFT.
+    Jobs of a chunk run one after another, so a chunk needs the memory of its largest job.
+
+    Parameters:
+    jobs (list): Jobs in the order their results should be written.
+
+    Returns:
+    list: Chunks as (memory estimate, [(job index, job), ...]) tuples.
+    """
+    chunks = []
+    for index, job in enumerate(jobs):
+        job_memory = estimate_job_memory(job)
+        if chunks and chunks[-1][1][-1][1][3] == job[3]:
+            chunk_memory, chunk = chunks[-1]
+            chunk.append((index, job))
+            chunks[-1] = (max(chunk_memory, job_memory), chunk)
+        else:
+            chunks.append((job_memory, [(index, job)]))
+    return chunks
+
+
+def available_memory():
+    """
+    Return the physical memory currently available, falling back to 4 GiB when unknown.
+
+    Returns:
+    int: Available memory in bytes.
+    """
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 4 << 30
+
+
+def _evaluate_chunk(chunk, dss_normalizer, bss_mode, bss_window, audio_cache_dir, channels='mono', profile=None, prefetch=True, score_memory=None, analysis_sr=None):
+    # Runs in a worker process; one result per job so failures do not drop the rest of the chunk.
+    # With prefetch, the next job is decoded on an I/O thread while the current one is scored.
+    # With score_memory, the scorers run in low-memory mode within that budget.
+    # With profiling on, the spans of the chunk are returned with its results.
+    profiler = instrumentation.enable(track_allocations=profile == 'allocations') if profile else None
+    audio_cache = AudioCache(audio_cache_dir) if audio_cache_dir else None
+    references = {}
+
+    def decode(indexed_job):
+        job = indexed_job[1]
+        with instrumentation.tags(song=job[0], stem=job[1], algorithm=job[2]):
+            return _decode_job(job, audio_cache, mono=channels != 'multi', references=references, analysis_rates=_analysis_rates(job[1], analysis_sr))
+
+    results = []
+    try:
+        with Prefetcher(chunk, decode, threads=1, depth=1 if prefetch else 0) as decoded:
+            for (index, job), audio in decoded:
+                try:
+                    results.append((index, job, evaluate_job(job, dss_normalizer=dss_normalizer, cache=feature_cache, bss_mode=bss_mode, bss_window=bss_window, channels=channels, audio=audio.result(), max_memory=score_memory, analysis_sr=analysis_sr), None))
+                except Exception as e:
+                    results.append((index, job, None, str(e)))
+    finally:
+        if profiler is not None:
+            instrumentation.disable()
+    return results, profiler.events if profiler is not None else []
+
+
+def _prefetch_chunk(chunk, audio_cache_dir, mono, analysis_sr=None):
+    # Runs on an I/O thread of the driver with a (memory estimate, jobs) chunk: decode its
+    # inputs into the audio cache (resampled to the analysis rates as well), or read them into
+    # the OS page cache, so the worker does not wait on the disk. Errors are left for the worker to report.
+    audio_cache = AudioCache(audio_cache_dir) if audio_cache_dir else None
+    paths = {path: _analysis_rates(job[1], analysis_sr) for _, job in chunk[1] for path in job[3:]}
+    with span('prefetch') as prefetch_span:
+        for path, rates in paths.items():
+            try:
+                if audio_cache is not None:
+                    for rate in [None] + rates:
+                        prefetch_span.add_bytes(audio_cache.load(path, mono=mono, sr=rate)[0].nbytes)
                 else:
-                    continue
+                    prefetch_span.add_bytes(read_ahead(path))
+            except Exception:
+                pass
+
 
-                # Construct the estimate path
-                estimate_path = os.path.join(final_estimate_folder, f"{target}.wav")
+def _write_results(result_queue, store_path, params_hash, profile_queue=None, commit_every=COMMIT_EVERY, lease_queue=None):
+    # Single writer process: rows arrive already in job order and are committed in batches of
+    # `commit_every`, or as soon as no row arrived for a second, so an interrupted run keeps
+    # everything finished before the last quiet second. With a work queue, (directory, node,
+    # token), a task id follows the rows of its task and is completed once they are committed.
+    profiler = instrumentation.enable() if profile_queue is not None else None
+    work_queue = LeaseQueue(lease_queue[0], node=lease_queue[1], token=lease_queue[2]) if lease_queue is not None else None
+    with ResultsStore(store_path) as store:
+        uncommitted = 0
+        while True:
+            try:
+                item = result_queue.get(timeout=1)
+            except queue.Empty:
+                if uncommitted:
+                    with span('store.commit'):
+                        store.commit()
+                    uncommitted = 0
+                continue
+            if item is None:
+                break
+            if isinstance(item, str):
+                if uncommitted:
+                    with span('store.commit'):
+                        store.commit()
+                    uncommitted = 0
+                work_queue.complete(item)
+                continue
+            (row, windows, channel_scores), input_fingerprint = item
+            with instrumentation.tags(song=row[0], stem=row[1], algorithm=row[2]), span('store.write'):
+                if windows is not None:
+                    store.put_windows(*row[:3], params_hash, windows['start'], windows['sdr'], windows['sir'], windows['sar'], commit=False)
+                if channel_scores is not None:
+                    store.put_channels(*row[:3], params_hash, channel_scores, commit=False)
+                store.put(*row[:3], params_hash, input_fingerprint, *row[3:], commit=False)
+            uncommitted += 1
+            if uncommitted >= commit_every:
+                with span('store.commit'):
+                    store.commit()
+                uncommitted = 0
+    if profiler is not None:
+        profile_queue.put(instrumentation.disable().events)
+
+
+def plan_jobs(ground_truth_path, output_base_path, targets=TARGETS, algorithms=ALGORITHMS, hash_inputs=False, index_path=None, update_index=True, shard=None):
+    """
+    List the jobs of a dataset, or of one shard, with the input fingerprint of each.
+
+    Fingerprints name each file relative to the ground-truth or estimates folder, so every
+    node derives the same fingerprints wherever it mounts the dataset.
+
+    Parameters:
+    ground_truth_path (str): Folder of MUSDB-style song folders holding the reference stems.
+    output_base_path (str): Root of the separation outputs.
+    targets (list): Stem names to evaluate.
+    algorithms (list): Algorithm names to evaluate.
+    hash_inputs (bool): If True, fingerprint inputs by content and size instead of mtime and size.
+    index_path (str): Optional dataset index to plan from instead of listing the folders.
+    update_index (bool): If False, trust the index as it is.
+    shard (tuple): (index, count) to keep only the songs of one shard.
+
+    Returns:
+    tuple: (jobs, fingerprints), jobs as in discover_jobs and one fingerprint per job.
+    """
+    roots = (ground_truth_path, output_base_path)
+    if index_path is not None:
+        with DatasetIndex(index_path) as index:
+            if update_index:
+                index.update(ground_truth_path, output_base_path, algorithms=algorithms)
+            jobs = [job for job in index.jobs(ground_truth_path, targets, algorithms) if in_shard(job[0], shard)]
+            fingerprints = [file_fingerprint(job[3:], hash_contents=True, roots=roots) if hash_inputs else index.fingerprint(job[3:], roots=roots) for job in jobs]
+    else:
+        jobs = [job for job in discover_jobs(ground_truth_path, output_base_path, targets=targets, algorithms=algorithms) if in_shard(job[0], shard)]
+        fingerprints = [file_fingerprint(job[3:], hash_contents=hash_inputs, roots=roots) for job in jobs]
+    return jobs, fingerprints
 
-                # Check if both reference and estimate files exist
-                if not os.path.isfile(reference_path) or not os.path.isfile(estimate_path):
+
+def _evaluate_chunks(chunk_source, fingerprints, result_queue, evaluate_chunk, read_chunk, workers, io_threads, prefetch, max_memory, profiler=None, finish_chunk=None):
+    # Score (memory estimate, [(index, job)]) chunks on a process pool while I/O threads read
+    # the next `prefetch` chunks ahead. Chunks are submitted while their estimated memory fits
+    # in `max_memory`, always keeping at least one running, and their rows are forwarded to the
+    # writer in submission order. `finish_chunk(chunk, failed)` is called once every row of a
+    # chunk was forwarded. Returns the number of rows forwarded.
+    written = 0
+    pending_results = {}
+    # Job indices in submission order, each chunk followed by a (chunk,) marker with finish_chunk
+    submitted = deque()
+    chunk_failed = False
+    with ProcessPoolExecutor(max_workers=workers) as executor, Prefetcher(chunk_source, read_chunk, threads=io_threads, depth=prefetch) as prefetched:
+        in_flight = {}
+        in_flight_memory = 0
+        next_chunk = next(prefetched, None)
+        while next_chunk is not None or in_flight:
+            while next_chunk is not None and len(in_flight) < 2 * workers and (not in_flight or in_flight_memory + next_chunk[0][0] <= max_memory):
+                (chunk_memory, chunk), read = next_chunk
+                read.result()
+                # A chunk estimated above the budget on its own is scored in low-memory mode within it
+                future = executor.submit(evaluate_chunk, chunk, score_memory=max_memory if chunk_memory > max_memory else None)
+                in_flight[future] = chunk_memory
+                in_flight_memory += chunk_memory
+                submitted.extend(index for index, _ in chunk)
+                if finish_chunk is not None:
+                    submitted.append((chunk,))
+                next_chunk = next(prefetched, None)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight_memory -= in_flight.pop(future)
+                chunk_results, events = future.result()
+                if profiler is not None:
+                    profiler.add_events(events)
+                for index, job, result, error in chunk_results:
+                    pending_results[index] = result
+                    if error is None:
+                        print(f"Evaluation completed for {job[0]} - {job[1]} using {job[2]}.")
+                    else:
+                        print(f"Error during evaluation for {job[0]} - {job[1]} using {job[2]}: {error}")
+
+            while submitted and (isinstance(submitted[0], tuple) or submitted[0] in pending_results):
+                item = submitted.popleft()
+                if isinstance(item, tuple):
+                    finish_chunk(item[0], chunk_failed)
+                    chunk_failed = False
                     continue
+                result = pending_results.pop(item)
+                if result is not None:
+                    result_queue.put((result, fingerprints[item]))
+                    written += 1
+                chunk_failed = chunk_failed or result is None
+    return written
 
-                # Load the reference and estimated audio
-                ref_audio, sr = librosa.load(reference_path, sr=None)
-                est_audio, _ = librosa.load(estimate_path, sr=None)
 
-                # Truncate or pad to match length
-                min_len = min(len(ref_audio), len(est_audio))
-                ref_audio = ref_audio[:min_len]
-                est_audio = est_audio[:min_len]
+def _evaluate_queue(work_queue, tasks, missing, run_chunks, result_queue, poll_seconds):
+    # Queue mode: score the chunks of the (task id, chunk, description) tasks this node claims,
+    # keeping only the jobs in `missing`, with run_chunks (a bound _evaluate_chunks). A task is
+    # completed by the writer once its rows are committed, or released for another node if one
+    # of its jobs failed. Tasks still leased by other nodes are taken over if those nodes stop
+    # heartbeating, so this returns once every task is done. Returns the number of rows forwarded.
+    chunk_tasks = {}
 
-                # Prepare references and estimates for mir_eval (shape: (n_sources, n_samples))
-                reference_sources = np.array([ref_audio])
-                estimated_sources = np.array([est_audio])
+    def claimed_chunks():
+        for task, (chunk_memory, chunk) in work_queue.claim_each(tasks):
+            chunk = [(index, job) for index, job in chunk if index in missing]
+            if not chunk:
+                work_queue.complete(task)
+                continue
+            chunk_tasks[chunk[0][0]] = task
+            yield chunk_memory, chunk
 
-                # Perform evaluation using mir_eval
-                try:
-                    sdr, sir, sar, _ = mir_eval.separation.bss_eval_sources(reference_sources, estimated_sources)
+    def finish_chunk(chunk, failed):
+        task = chunk_tasks.pop(chunk[0][0])
+        if failed:
+            work_queue.release(task)
+        else:
+            result_queue.put(task)
 
-                    # Calculate frequency isolation and dynamic stability scores
-                    freq_isolation_score = evaluate_frequency_isolation(ref_audio, est_audio, sr)
-                    dynamic_stability_score = evaluate_dynamic_stability(ref_audio, est_audio, sr, instrument_type=target)
+    written = 0
+    with work_queue.heartbeating():
+        while True:
+            written += run_chunks(claimed_chunks(), finish_chunk=finish_chunk)
+            waiting = work_queue.unfinished(task for task, _, _ in tasks)
+            if not waiting:
+                return written
+            print(f"Waiting for {len(waiting)} tasks leased by other nodes.")
+            time.sleep(poll_seconds)
 
-                    # Write the evaluation results to the CSV file
-                    writer.writerow([folder_name, target, algorithm, sdr[0], sir[0], sar[0], freq_isolation_score, dynamic_stability_score])
 
-                    print(f"Evaluation completed for {folder_name} - {target} using {algorithm}.")
-                except Exception as e:
-                    print(f"Error during evaluation for {folder_name} - {target} using {algorithm}: {e}")
+def evaluate_dataset(ground_truth_path=ground_truth_path, output_base_path=output_base_path, output_file=evaluation_output_file, workers=None, max_memory=None, dss_normalizer=dss_normalizer, targets=TARGETS, algorithms=ALGORITHMS, store_path=None, hash_inputs=False, bss_mode='full', bss_window=1.0, audio_cache_dir=None, channels='mono', profiler=None, prefetch=None, io_threads=IO_THREADS, commit_every=COMMIT_EVERY, index_path=None, update_index=True, shard=None, queue_dir=None, lease_seconds=LEASE_SECONDS, poll_seconds=30, analysis_sr=None):
+    """
+    Evaluate every separated stem of a dataset in parallel and write the results to a CSV file.
+
+    Results are kept in a SQLite results store keyed by (song, stem, algorithm, score
+    parameter hash) together with a fingerprint of the input files. Only jobs that are
+    missing from the store or whose inputs changed are computed, so an interrupted or
+    repeated run resumes where it stopped. The CSV is exported from the store at the end.
+
+    The run is a pipeline of stages. Discovery indexes the song, algorithm and stem
+    folders once. I/O threads then read (or, with an audio cache, decode) the inputs of
+    the next `prefetch` chunks ahead of the process pool, and each worker decodes its next
+    job while scoring the current one. Jobs are submitted in chunks while their estimated
+    memory fits in `max_memory`, and a single writer process receives the rows over a
+    queue in discovery order and commits them in batches. Every stage is bounded: the
+    prefetch depth, the memory budget of chunks in flight and the writer batch size.
+
+    Parameters:
+    ground_truth_path (str): Folder of MUSDB-style song folders holding the reference stems.
+    output_base_path (str): Root of the separation outputs.
+    output_file (str): CSV file to write.
+    workers (int): Number of worker processes (defaults to the CPU count).
+    max_memory (int): Memory budget in bytes for jobs in flight (defaults to half the available memory).
+        A chunk estimated above the budget on its own is scored in low-memory mode within it.
+    dss_normalizer (float): Stability calibration passed to the DSS.
+    targets (list): Stem names to evaluate.
+    algorithms (list): Algorithm names to evaluate.
+    store_path (str): SQLite results store (defaults to the output file with a .sqlite extension).
+    hash_inputs (bool): If True, fingerprint inputs by content and size instead of mtime and size.
+    bss_mode (str): 'full' for whole-track BSS-eval or 'windowed' to report the median over
+        fixed windows; per-window metrics are kept in the results store.
+    bss_window (float): Window length in seconds for the windowed mode.
+    audio_cache_dir (str): Optional folder for decoded float32 audio shared by all workers and runs.
+    channels (str): 'mono' to score the downmix or 'multi' to score every channel in one
+        batched pass; per-channel scores are kept in the store's `channels` table.
+    profiler (instrumentation.Profiler): If given, the duration and bytes of every stage
+        (and allocations, if the profiler tracks them) are recorded in all processes and
+        collected into this profiler.
+    prefetch (int): Number of chunks read ahead of the workers (defaults to the number of
+        workers; 0 disables prefetching).
+    io_threads (int): Number of I/O threads reading ahead.
+    commit_every (int): Number of rows the writer commits at once.
+    index_path (str): Optional dataset index (see dataset_index.DatasetIndex) to plan the
+        jobs from instead of listing the folders; input fingerprints then come from the index.
+    update_index (bool): If False, trust the index as it is and do not touch the dataset
+        folders while planning.
+    shard (tuple): (index, count) to evaluate only the songs of one shard; shards are
+        assigned by song name, so independent nodes split the dataset without overlap.
+    queue_dir (str): Shared work-queue directory (see work_queue.LeaseQueue). Nodes pointed
+        at the same directory claim chunks through expiring leases, so any number of them
+        can join or leave mid-run; each writes to its own store, merged afterwards with
+        `ResultsStore.merge`.
+    lease_seconds (float): Lease length of claimed chunks in queue mode.
+    poll_seconds (float): Wait between checks for chunks leased by other nodes once this
+        node has nothing left to claim.
+    analysis_sr (int or str): FIS/DSS analysis rate in Hz, or 'auto' for the per-stem rates
+        of STEM_ANALYSIS_SR (mono scoring only); rows are keyed by it.
+
+    Returns:
+    int: Number of rows computed in this run.
+    """
+    if analysis_sr is not None and channels == 'multi':
+        raise ValueError("analysis_sr is only supported with channels='mono'")
+    workers = workers or os.cpu_count() or 1
+    prefetch = workers if prefetch is None else prefetch
+    max_memory = max_memory or available_memory() // 2
+    store_path = store_path or os.path.splitext(output_file)[0] + '.sqlite'
+    params_hash = parameter_hash(score_parameters(dss_normalizer, bss_mode=bss_mode, bss_window=bss_window, channels=channels, analysis_sr=analysis_sr))
+    if profiler is not None:
+        instrumentation.enable(profiler=profiler)
+    profile = None if profiler is None else ('allocations' if profiler.track_allocations else 'time')
+
+    # Only compute rows that are missing or were computed from different input files
+    with span('discover'):
+        all_jobs, all_fingerprints = plan_jobs(ground_truth_path, output_base_path, targets, algorithms, hash_inputs, index_path, update_index, shard)
+        with ResultsStore(store_path) as store:
+            stored_fingerprints = store.fingerprints(params_hash)
+        missing = [index for index, (job, input_fingerprint) in enumerate(zip(all_jobs, all_fingerprints)) if stored_fingerprints.get(job[:3]) != input_fingerprint]
+
+    work_queue = None
+    if queue_dir is None:
+        jobs = [all_jobs[index] for index in missing]
+        fingerprints = [all_fingerprints[index] for index in missing]
+        chunks = chunk_jobs(jobs)
+        print(f"Evaluating {len(jobs)} of {len(all_jobs)} stems in {len(chunks)} chunks on {workers} workers.")
+    else:
+        # Tasks cover all jobs so that every node derives the same task ids; jobs already in
+        # this node's store are dropped when their task is claimed
+        work_queue = LeaseQueue(queue_dir, lease_seconds=lease_seconds)
+        fingerprints = all_fingerprints
+        chunks = chunk_jobs(all_jobs)
+        tasks = [(task_id(params_hash, *(fingerprints[index] for index, _ in chunk)), (chunk_memory, chunk), f"{chunk[0][1][0]} - {chunk[0][1][1]}")
+                 for chunk_memory, chunk in chunks]
+        print(f"Evaluating up to {len(missing)} of {len(all_jobs)} stems in {len(tasks)} tasks shared through {queue_dir} as {work_queue.node}.")
+
+    result_queue = multiprocessing.Queue()
+    profile_queue = multiprocessing.Queue() if profile else None
+    writer_queue = None if work_queue is None else (queue_dir, work_queue.node, work_queue.token)
+    writer_process = multiprocessing.Process(target=_write_results, args=(result_queue, store_path, params_hash, profile_queue, commit_every, writer_queue))
+    writer_process.start()
+
+    evaluate_chunk = partial(_evaluate_chunk, dss_normalizer=dss_normalizer, bss_mode=bss_mode, bss_window=bss_window, audio_cache_dir=audio_cache_dir,
+                             channels=channels, profile=profile, prefetch=prefetch > 0, analysis_sr=analysis_sr)
+    read_chunk = partial(_prefetch_chunk, audio_cache_dir=audio_cache_dir, mono=channels != 'multi', analysis_sr=analysis_sr)
+    run_chunks = partial(_evaluate_chunks, fingerprints=fingerprints, result_queue=result_queue, evaluate_chunk=evaluate_chunk, read_chunk=read_chunk,
+                         workers=workers, io_threads=io_threads, prefetch=prefetch, max_memory=max_memory, profiler=profiler)
+    try:
+        if work_queue is None:
+            written = run_chunks(chunks)
+        else:
+            written = _evaluate_queue(work_queue, tasks, set(missing), run_chunks, result_queue, poll_seconds)
+    finally:
+        result_queue.put(None)
+        # The writer sends its spans when it stops; it may already have exited with them queued
+        while profile_queue is not None and (writer_process.is_alive() or not profile_queue.empty()):
+            try:
+                profiler.add_events(profile_queue.get(timeout=1))
+                break
+            except queue.Empty:
+                continue
+        writer_process.join()
+
+    with span('store.export_csv'), ResultsStore(store_path) as store:
+        store.export_csv(output_file, params_hash)
+    if profiler is not None:
+        instrumentation.disable()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate separated stems with BSS-eval, FIS and DSS.")
+    parser.add_argument('--ground-truth', default=ground_truth_path, help="Folder of song folders holding the reference stems")
+    parser.add_argument('--estimates', default=output_base_path, help="Root of the separation outputs")
+    parser.add_argument('--output', default=evaluation_output_file, help="CSV file to write")
+    parser.add_argument('--store', default=None, help="SQLite results store (default: output file with a .sqlite extension)")
+    parser.add_argument('--hash-inputs', action='store_true', help="Detect changed inputs by content and size instead of mtime and size")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--max-memory-gb', type=float, default=None, help="Memory budget for jobs in flight (default: half the available memory)")
+    parser.add_argument('--bss-mode', choices=['full', 'windowed'], default='full', help="Whole-track BSS-eval or the median over fixed windows")
+    parser.add_argument('--bss-window', type=float, default=1.0, help="Window length in seconds for --bss-mode windowed")
+    parser.add_argument('--audio-cache', default=None, help="Folder for decoded float32 audio reused across algorithms and runs")
+    parser.add_argument('--channels', choices=['mono', 'multi'], default='mono', help="Score the mono downmix or every channel (mean FIS/DSS over channels)")
+    parser.add_argument('--analysis-sr', type=parse_analysis_sr, default=None, help="Sample rate FIS/DSS are computed at, or 'auto' for per-stem rates (default: native rate)")
+    parser.add_argument('--prefetch', type=int, default=None, help="Chunks of inputs read ahead of the workers on I/O threads (default: number of workers, 0 disables)")
+    parser.add_argument('--io-threads', type=int, default=IO_THREADS, help="I/O threads for --prefetch")
+    parser.add_argument('--commit-every', type=int, default=COMMIT_EVERY, help="Rows committed to the results store at once")
+    parser.add_argument('--index', default=None, help="SQLite dataset index to plan jobs from, updated incrementally from folder mtimes")
+    parser.add_argument('--no-index-update', action='store_true', help="With --index, plan from the index without touching the dataset folders")
+    parser.add_argument('--shard', type=parse_shard, default=None, help="Evaluate one shard of the songs, e.g. 0/4 .. 3/4")
+    parser.add_argument('--queue', default=None, help="Shared work-queue directory; nodes using the same directory split the work through leases")
+    parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS, help="Lease length of claimed work in --queue mode")
+    parser.add_argument('--merge', nargs='+', default=None, help="Merge these results stores (e.g. one per node) into --store, export the CSV and exit")
+    parser.add_argument('--profile', default=None, help="Write a Chrome trace of every stage to this JSON file and print a timing summary")
+    parser.add_argument('--profile-allocations', action='store_true', help="With --profile, also trace memory allocations (slower)")
+    parser.add_argument('--dss-normalizer', type=float, default=dss_normalizer, help="DSS stability calibration")
+    parser.add_argument('--targets', nargs='+', default=TARGETS, help="Stems to evaluate")
+    parser.add_argument('--algorithms', nargs='+', default=ALGORITHMS, help="Algorithms to evaluate")
+    args = parser.parse_args(argv)
+
+    if args.merge:
+        store_path = args.store or os.path.splitext(args.output)[0] + '.sqlite'
+        params_hash = parameter_hash(score_parameters(args.dss_normalizer, bss_mode=args.bss_mode, bss_window=args.bss_window, channels=args.channels, analysis_sr=args.analysis_sr))
+        # Conflicting rows are resolved in favour of the one computed from the current inputs,
+        # when this node can see the dataset
+        fingerprints = None
+        if os.path.isdir(args.ground_truth):
+            jobs, job_fingerprints = plan_jobs(args.ground_truth, args.estimates, args.targets, args.algorithms, args.hash_inputs, args.index, not args.no_index_update)
+            fingerprints = {job[:3]: fingerprint for job, fingerprint in zip(jobs, job_fingerprints)}
+        with ResultsStore(store_path) as store:
+            for path in args.merge:
+                print(f"Merged {store.merge(path, fingerprints)} results from {path}.")
+            exported = store.export_csv(args.output, params_hash)
+        print(f"Exported {exported} rows to {args.output}.")
+        return
+
+    max_memory = int(args.max_memory_gb * (1 << 30)) if args.max_memory_gb else None
+    profiler = instrumentation.Profiler(track_allocations=args.profile_allocations) if args.profile else None
+    written = evaluate_dataset(args.ground_truth, args.estimates, args.output, workers=args.workers, max_memory=max_memory, dss_normalizer=args.dss_normalizer, targets=args.targets, algorithms=args.algorithms, store_path=args.store, hash_inputs=args.hash_inputs, bss_mode=args.bss_mode, bss_window=args.bss_window, audio_cache_dir=args.audio_cache, channels=args.channels, profiler=profiler, prefetch=args.prefetch, io_threads=args.io_threads, commit_every=args.commit_every, index_path=args.index, update_index=not args.no_index_update, shard=args.shard, queue_dir=args.queue, lease_seconds=args.lease_seconds, analysis_sr=args.analysis_sr)
+    print(f"Computed {written} new rows; results exported to {args.output}.")
+
+    if profiler is not None:
+        profiler.write_chrome_trace(args.profile)
+        print(f"\nTime per stage (inclusive of nested stages):\n{profiler.format_summary(by=('name',))}")
+        print(f"\nTime per algorithm and stage:\n{profiler.format_summary(by=('algorithm', 'name'), names=('job', 'job.decode', 'job.bss_eval', 'job.fis', 'job.dss'))}")
+        print(f"\nTime per song:\n{profiler.format_summary(by=('song',), names=('job',))}")
+        print(f"\nChrome trace written to {args.profile}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+import os
+import csv
+import argparse
+
+import numpy as np
+
+from results_store import ResultsStore, parameter_hash
+from evaluation import score_parameters, parse_analysis_sr, dss_normalizer, evaluation_output_file
+
+TARGET_METRICS = ['sar', 'sdr', 'sir']
+PREDICTORS = ['fis', 'dss']
+METRIC_LABELS = {'sdr': 'SDR (dB)', 'sir': 'SIR (dB)', 'sar': 'SAR (dB)', 'fis': 'Frequency Isolation Score', 'dss': 'Dynamic Stability Score'}
+# Larger groups are resampled as this many random buckets of rows, so the cost of the
+# bootstrap does not grow with the number of rows
+BOOTSTRAP_UNITS = 4096
+# Groups with fewer rows are skipped (a two-predictor fit needs at least 4)
+MIN_GROUP_SIZE = 4
+
+
+def load_results(store_path, params_hash):
+    """
+    Read one parameter set of a results store into arrays.
+
+    Parameters:
+    store_path (str): SQLite results store written by evaluation.py.
+    params_hash (str): Score parameter hash of the rows to read.
+
+    Returns:
+    dict: 'stem' and 'algorithm' string arrays and float64 arrays of every metric in
+    METRIC_LABELS, one entry per row. Rows without a finite FIS and DSS are dropped; target
+    metrics may be non-finite (e.g. an infinite SIR) and are filtered per target.
+    """
+    with ResultsStore(store_path) as store:
+        rows = store.connection.execute("SELECT stem, algorithm, sdr, sir, sar, fis, dss FROM results WHERE params_hash = ?", (params_hash,)).fetchall()
+    if not rows:
+        return {'stem': np.array([], dtype=str), 'algorithm': np.array([], dtype=str), **{name: np.array([]) for name in METRIC_LABELS}}
+    columns = list(zip(*rows))
+    values = np.array(columns[2:], dtype=np.float64)
+    finite = np.all(np.isfinite(values[3:]), axis=0)
+    results = {'stem': np.array(columns[0], dtype=str)[finite], 'algorithm': np.array(columns[1], dtype=str)[finite]}
+    results.update({name: values[i, finite] for i, name in enumerate(['sdr', 'sir', 'sar', 'fis', 'dss'])})
+    return results
+
+
+def groups(results):
+    """
+    List the row groups analysed: all rows, each stem, each algorithm and each stem and algorithm pair.
+
+    Returns:
+    list: (grouping, stem, algorithm, row mask) tuples, with 'all' for the unconstrained labels.
+    """
+    stems, algorithms = np.unique(results['stem']), np.unique(results['algorithm'])
+    n_rows = len(results['stem'])
+    listed = [('all', 'all', 'all', np.ones(n_rows, dtype=bool))]
+    listed += [('stem', stem, 'all', results['stem'] == stem) for stem in stems]
+    listed += [('algorithm', 'all', algorithm, results['algorithm'] == algorithm) for algorithm in algorithms]
+    listed += [('stem x algorithm', stem, algorithm, (results['stem'] == stem) & (results['algorithm'] == algorithm)) for stem in stems for algorithm in algorithms]
+    return listed
+
+
+def _average_ranks(values):
+    # Ranks from 1, ties sharing their average rank (scipy.stats.rankdata's default)
+    order = np.argsort(values)
+    ordered = values[order]
+    first = np.empty(len(values), dtype=bool)
+    first[:1] = True
+    np.not_equal(ordered[1:], ordered[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], len(values))
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat((starts + ends + 1) / 2, ends - starts)
+    return ranks
+
+
+def _moment_columns(values, targets):
+    # Per-row products whose (weighted) sums give every statistic, one product per row of
+    # the returned (n_columns, n_rows) array: the weight, the two predictors, their squares
+    # and product, and per target its value, square and products with both predictors.
+    # Values are centred first so the sums do not lose precision; the means are returned
+    # to shift the intercepts back.
+    means = {name: np.mean(values[name]) for name in PREDICTORS + list(targets)}
+    f, d = values['fis'] - means['fis'], values['dss'] - means['dss']
+    columns = np.empty((6 + 4 * len(targets), len(f)))
+    columns[0], columns[1], columns[2] = 1.0, f, d
+    np.multiply(f, f, out=columns[3])
+    np.multiply(d, d, out=columns[4])
+    np.multiply(f, d, out=columns[5])
+    for i, target in enumerate(targets):
+        t = columns[6 + 4 * i]
+        np.subtract(values[target], means[target], out=t)
+        np.multiply(t, t, out=columns[7 + 4 * i])
+        np.multiply(f, t, out=columns[8 + 4 * i])
+        np.multiply(d, t, out=columns[9 + 4 * i])
+    return columns, means
+
+
+def _statistics(sums, targets, means=None):
+    # Pearson correlations, simple and two-predictor OLS fits from moment sums of shape
+    # (..., n_columns); every output has shape (..., n_targets). With the centring means,
+    # intercepts are returned for the original (uncentred) values.
+    sums = np.asarray(sums, dtype=np.float64)
+    n_targets = len(targets)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = sums[..., 0:1]
+        mean_f, mean_d = sums[..., 1:2] / w, sums[..., 2:3] / w
+        var_f = sums[..., 3:4] / w - mean_f ** 2
+        var_d = sums[..., 4:5] / w - mean_d ** 2
+        cov_fd = sums[..., 5:6] / w - mean_f * mean_d
+        target_sums = sums[..., 6:].reshape(sums.shape[:-1] + (n_targets, 4))
+        mean_t = target_sums[..., 0] / w
+        var_t = target_sums[..., 1] / w - mean_t ** 2
+        cov_ft = target_sums[..., 2] / w - mean_f * mean_t
+        cov_dt = target_sums[..., 3] / w - mean_d * mean_t
+
+        if means is not None:
+            mean_f = mean_f + means['fis']
+            mean_d = mean_d + means['dss']
+            mean_t = mean_t + np.array([means[target] for target in targets])
+
+        # Two-predictor least squares from the 2 x 2 covariance of the predictors
+        determinant = var_f * var_d - cov_fd ** 2
+        coef_fis = (var_d * cov_ft - cov_fd * cov_dt) / determinant
+        coef_dss = (var_f * cov_dt - cov_fd * cov_ft) / determinant
+        return {
+            'pearson_fis': cov_ft / np.sqrt(var_f * var_t),
+            'pearson_dss': cov_dt / np.sqrt(var_d * var_t),
+            'slope_fis': cov_ft / var_f,
+            'intercept_fis': mean_t - cov_ft / var_f * mean_f,
+            'slope_dss': cov_dt / var_d,
+            'intercept_dss': mean_t - cov_dt / var_d * mean_d,
+            'coef_fis': coef_fis,
+            'coef_dss': coef_dss,
+            'intercept': mean_t - coef_fis * mean_f - coef_dss * mean_d,
+            'r2': (coef_fis * cov_ft + coef_dss * cov_dt) / var_t,
+        }
+
+
+def bootstrap_weights(n_resamples, rng, n_units=BOOTSTRAP_UNITS):
+    """
+    Draw Poisson(1) bootstrap weights, one row per resample and one column per resampled unit.
+
+    The Poisson bootstrap weighs every unit independently, which matches the multinomial
+    bootstrap for large samples and lets one weight matrix serve groups of any size.
+
+    Returns:
+    ndarray: float32 weights, shape (n_resamples, n_units).
+    """
+    return rng.poisson(1.0, size=(n_resamples, n_units)).astype(np.float32)
+
+
+def _bootstrap_sums(columns, weights, rng):
+    # Column sums of every resample as one matrix product. Rows are the resampled units when
+    # there are at most as many as weight columns; otherwise rows are dealt at random into
+    # that many equal buckets and the buckets are resampled (a cluster bootstrap of random
+    # clusters, which estimates the same variance for independent rows).
+    n_rows = columns.shape[1]
+    n_units = min(n_rows, weights.shape[1])
+    if n_units < n_rows:
+        bucket = rng.permutation(n_rows) % n_units
+        columns = np.stack([np.bincount(bucket, weights=column, minlength=n_units) for column in columns])
+    return weights[:, :n_units].astype(np.float64) @ columns.T
+
+
+def analyse_group(values, targets=TARGET_METRICS, n_resamples=2000, confidence=0.95, rng=None, weights=None):
+    """
+    Correlate FIS and DSS with each target metric and fit target ~ FIS + DSS on one group of rows.
+
+    Point estimates come from the full sample; confidence intervals are bootstrap
+    percentile intervals computed from all resamples at once. Spearman correlations
+    are Pearson correlations of the (average) ranks; resamples reuse the full-sample ranks.
+
+    Parameters:
+    values (dict): Float arrays of 'fis', 'dss' and every target for the rows of the group.
+    targets (list): Target metrics, e.g. ['sar', 'sdr', 'sir'].
+    n_resamples (int): Number of bootstrap resamples (0 disables the intervals).
+    confidence (float): Confidence level of the intervals.
+    rng (numpy.random.Generator): Random generator of the resamples.
+    weights (ndarray): Bootstrap weights from bootstrap_weights, to share them between
+        groups (drawn here if None).
+
+    Returns:
+    dict: {target: {statistic: value}} with n, Pearson and Spearman correlations and their
+    p-values, simple fits per predictor, the two-predictor fit (intercept, coefficients,
+    R^2, adjusted R^2, F statistic and its p-value) and '<statistic>_low'/'_high' bounds.
+    """
+    from scipy import stats
+    rng = rng if rng is not None else np.random.default_rng()
+    n = len(values['fis'])
+    columns, means = _moment_columns(values, targets)
+    rank_columns, _ = _moment_columns({name: _average_ranks(values[name]) for name in PREDICTORS + list(targets)}, targets)
+    estimates = _statistics(np.sum(columns, axis=1), targets, means)
+    rank_estimates = _statistics(np.sum(rank_columns, axis=1), targets)
+    estimates['spearman_fis'] = rank_estimates['pearson_fis']
+    estimates['spearman_dss'] = rank_estimates['pearson_dss']
+
+    intervals = {}
+    if n_resamples > 0:
+        weights = weights if weights is not None else bootstrap_weights(n_resamples, rng)
+        # Both moment matrices share the same weights, so they are resampled together
+        sums = _bootstrap_sums(np.concatenate([columns, rank_columns]), weights[:n_resamples], rng)
+        resampled = _statistics(sums[:, :len(columns)], targets, means)
+        rank_resampled = _statistics(sums[:, len(columns):], targets)
+        resampled['spearman_fis'] = rank_resampled['pearson_fis']
+        resampled['spearman_dss'] = rank_resampled['pearson_dss']
+        tail = (1 - confidence) / 2 * 100
+        # Degenerate resamples (e.g. a perfect fit) give infinite draws
+        with np.errstate(invalid='ignore'):
+            for name, draws in resampled.items():
+                intervals[name] = np.nanpercentile(draws, [tail, 100 - tail], axis=0)
+
+    # Correlations first, then the fits
+    order = ['pearson_fis', 'spearman_fis', 'pearson_dss', 'spearman_dss']
+    order += [name for name in estimates if name not in order]
+    summary = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i, target in enumerate(targets):
+            row = {'n': n}
+            for name in order:
+                estimate = estimates[name]
+                row[name] = float(estimate[i])
+                if name in intervals:
+                    row[f'{name}_low'], row[f'{name}_high'] = (float(bound) for bound in intervals[name][:, i])
+            # As NumPy floats, a perfect fit gives an infinite statistic (p = 0) instead of raising
+            for name in ('pearson_fis', 'pearson_dss', 'spearman_fis', 'spearman_dss'):
+                r = np.float64(row[name])
+                t = r * np.sqrt((n - 2) / (1 - r ** 2))
+                row[f'{name}_p'] = float(2 * stats.t.sf(abs(t), n - 2))
+            r2 = np.float64(row['r2'])
+            row['adjusted_r2'] = float(1 - (1 - r2) * (n - 1) / (n - 3))
+            row['f_statistic'] = float((r2 / 2) / ((1 - r2) / (n - 3)))
+            row['f_p'] = float(stats.f.sf(row['f_statistic'], 2, n - 3))
+            summary[target] = row
+    return summary
+
+
+def analyse(results, targets=TARGET_METRICS, n_resamples=2000, confidence=0.95, seed=0):
+    """
+    Run analyse_group on every group of the results.
+
+    Returns:
+    list: Summary rows (dicts) with grouping, stem, algorithm and target columns followed
+    by the statistics of analyse_group.
+    """
+    rng = np.random.default_rng(seed)
+    weights = bootstrap_weights(n_resamples, rng) if n_resamples > 0 else None
+    rows = []
+    for grouping, stem, algorithm, mask in groups(results):
+        summary = {}
+        # Targets finite on the same rows (usually all of them) are analysed in one pass
+        pending = list(targets)
+        while pending:
+            usable = mask & np.isfinite(results[pending[0]])
+            shared = [target for target in pending if np.array_equal(usable, mask & np.isfinite(results[target]))]
+            pending = [target for target in pending if target not in shared]
+            if np.sum(usable) >= MIN_GROUP_SIZE:
+                values = {name: results[name][usable] for name in PREDICTORS + shared}
+                summary.update(analyse_group(values, shared, n_resamples, confidence, rng, weights))
+        for target in targets:
+            if target in summary:
+                rows.append({'grouping': grouping, 'stem': stem, 'algorithm': algorithm, 'target': target, **summary[target]})
+    return rows
+
+
+def write_summary(rows, output_file):
+    """
+    Write the summary rows to a CSV file.
+    """
+    with open(output_file, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def plot_regressions(results, rows, output_dir, targets=TARGET_METRICS, gridsize=60):
+    """
+    Save one figure per target metric: a panel per predictor and stem (and all stems) with
+    the rows as a hexbin density, the simple least-squares line and its bootstrap interval.
+
+    Hexbins keep plotting time independent of the number of rows.
+
+    Returns:
+    list: Paths of the written images.
+    """
+    import matplotlib.pyplot as plt
+
+    fits = {(row['stem'], row['target']): row for row in rows if row['grouping'] in ('all', 'stem')}
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for target in targets:
+        panels = [stem for stem in ['all'] + list(np.unique(results['stem'])) if (stem, target) in fits]
+        if not panels:
+            continue
+        figure, axes = plt.subplots(len(PREDICTORS), len(panels), figsize=(4 * len(panels), 3.5 * len(PREDICTORS)), squeeze=False)
+        for column, stem in enumerate(panels):
+            mask = np.isfinite(results[target]) & ((results['stem'] == stem) if stem != 'all' else True)
+            fit = fits[(stem, target)]
+            for line, predictor in enumerate(PREDICTORS):
+                ax = axes[line, column]
+                x, y = results[predictor][mask], results[target][mask]
+                ax.hexbin(x, y, gridsize=gridsize, mincnt=1, bins='log', cmap='Blues')
+                grid = np.linspace(np.min(x), np.max(x), 2)
+                ax.plot(grid, fit[f'intercept_{predictor}'] + fit[f'slope_{predictor}'] * grid, color='red',
+                        label=f"r={fit[f'pearson_{predictor}']:+.2f}, rho={fit[f'spearman_{predictor}']:+.2f}")
+                if f'slope_{predictor}_low' in fit:
+                    # Band between the lines of the slope interval bounds, through the mean point
+                    mean_x, mean_y = np.mean(x), np.mean(y)
+                    low = mean_y + fit[f'slope_{predictor}_low'] * (grid - mean_x)
+                    high = mean_y + fit[f'slope_{predictor}_high'] * (grid - mean_x)
+                    ax.fill_between(grid, np.minimum(low, high), np.maximum(low, high), color='red', alpha=0.2)
+                ax.set_xlabel(METRIC_LABELS[predictor])
+                ax.set_ylabel(METRIC_LABELS[target])
+                ax.set_title(f"{stem} (n={fit['n']})")
+                ax.legend(loc='lower right', fontsize='small')
+        figure.suptitle(f"{METRIC_LABELS[target]} vs FIS and DSS")
+        figure.tight_layout()
+        path = os.path.join(output_dir, f"regression_{target}.png")
+        figure.savefig(path, dpi=120)
+        plt.close(figure)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate FIS and DSS against BSS-eval metrics with grouped correlations, OLS fits and bootstrap confidence intervals.")
+    parser.add_argument('--store', default=None, help="SQLite results store (default: evaluation output file with a .sqlite extension)")
+    parser.add_argument('--output', default='metric_validation.csv', help="Summary table to write")
+    parser.add_argument('--plots', default=None, help="Folder for the regression plots (omit to skip plotting)")
+    parser.add_argument('--targets', nargs='+', choices=TARGET_METRICS, default=TARGET_METRICS, help="Metrics explained by FIS and DSS")
+    parser.add_argument('--resamples', type=int, default=2000, help="Bootstrap resamples (0 disables the intervals)")
+    parser.add_argument('--confidence', type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the bootstrap resamples")
+    parser.add_argument('--dss-normalizer', type=float, default=dss_normalizer, help="Parameters of the evaluation run to analyse, as given to evaluation.py")
+    parser.add_argument('--bss-mode', choices=['full', 'windowed'], default='full')
+    parser.add_argument('--bss-window', type=float, default=1.0)
+    parser.add_argument('--channels', choices=['mono', 'multi'], default='mono')
+    parser.add_argument('--analysis-sr', type=parse_analysis_sr, default=None)
+    args = parser.parse_args(argv)
+
+    store_path = args.store or os.path.splitext(evaluation_output_file)[0] + '.sqlite'
+    params_hash = parameter_hash(score_parameters(args.dss_normalizer, bss_mode=args.bss_mode, bss_window=args.bss_window, channels=args.channels, analysis_sr=args.analysis_sr))
+    results = load_results(store_path, params_hash)
+    rows = analyse(results, args.targets, args.resamples, args.confidence, args.seed)
+    if not rows:
+        print(f"Fewer than {MIN_GROUP_SIZE} usable rows for these parameters in {store_path}.")
+        return
+    write_summary(rows, args.output)
+    print(f"Analysed {len(results['stem'])} rows; summary of {len(rows)} group/target combinations written to {args.output}.")
+    for row in rows:
+        if row['grouping'] == 'all':
+            interval = f" [{row['pearson_fis_low']:+.3f}, {row['pearson_fis_high']:+.3f}]" if 'pearson_fis_low' in row else ""
+            print(f"  {row['target'].upper()}: r(FIS)={row['pearson_fis']:+.3f}{interval}  r(DSS)={row['pearson_dss']:+.3f}  R^2={row['r2']:.3f}")
+    if args.plots:
+        for path in plot_regressions(results, rows, args.plots, args.targets):
+            print(f"Plot written to {path}.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+import os
+import sys
+import csv
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Make the score implementations in Code/Scores importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scores'))
+from Frequency_Isolation_Score import _fundamental_bin_indices, _harmonic_statistics
+from spectral_features import SpectralFeatures, spectral_flux
+from results_store import CSV_HEADER, file_fingerprint
+from audio_cache import AudioCache, load_audio
+from evaluation import discover_jobs, ground_truth_path, output_base_path, evaluation_output_file, TARGETS, ALGORITHMS
+
+# Parameter grids swept by default; the hand-calibrated values are included in each
+DSS_GRID = {
+    'presence_threshold': [0.02, 0.05, 0.1, 0.2, 0.3],
+    'dss_normalizer': [2.0, 2.5, 3.0, 3.5, 4.0, 5.0],
+    'flux_max_reference': [5000, 10000, 15000, 25000, 50000],
+    'flux_cap': [10, 20, 30, 50],
+}
+FIS_GRID = {
+    'weight_fundamental': [0, 20, 40, 60],
+    'weight_harmonics': [40, 60, 80, 100],
+}
+
+
+def frame_statistics(reference, estimate, sr, fft_window_size=2048, hop_length=512):
+    """
+    Compute the per-frame statistics every FIS and DSS configuration is derived from.
+
+    As in the evaluation, the reference plays the role of the mix and the estimate the
+    role of the stem.
+
+    Parameters:
+    reference (ndarray): Reference stem audio.
+    estimate (ndarray): Estimated stem audio.
+    sr (int): Sample rate of the audio.
+    fft_window_size (int): Size of the FFT window for STFT.
+    hop_length (int): Hop length for STFT.
+
+    Returns:
+    dict: 'rms' and 'flux' of the estimate (flux has one frame less), and the FIS
+    'fundamental_present', 'harmonic_passes' and 'harmonic_counts' per frame.
+    """
+    features_mix = SpectralFeatures(reference, fft_window_size, hop_length, 'hann')
+    features_stem = SpectralFeatures(estimate, fft_window_size, hop_length, 'hann')
+    mag_stem = features_stem.magnitude
+
+    min_frames = min(features_mix.magnitude.shape[1], mag_stem.shape[1])
+    fis_stem = mag_stem[:, :min_frames]
+    fundamental_present, harmonic_passes, harmonic_counts = _harmonic_statistics(features_mix.magnitude[:, :min_frames], fis_stem, _fundamental_bin_indices(fis_stem), sr, fft_window_size)
+    return {
+        'rms': np.asarray(features_stem.rms, dtype=np.float64),
+        'flux': spectral_flux(mag_stem).astype(np.float64),
+        'fundamental_present': fundamental_present,
+        'harmonic_passes': harmonic_passes,
+        'harmonic_counts': harmonic_counts,
+    }
+
+
+def load_frame_statistics(job, fft_window_size, hop_length, cache_dir=None, audio_cache_dir=None):
+    """
+    Return the frame statistics of an evaluation job, computing them only once per
+    input state and STFT resolution when `cache_dir` is given.
+
+    Parameters:
+    job (tuple): (song, target, algorithm, reference_path, estimate_path).
+    fft_window_size (int): Size of the FFT window for STFT.
+    hop_length (int): Hop length for STFT.
+    cache_dir (str): Optional folder of .npz files keyed by the input fingerprint and resolution.
+    audio_cache_dir (str): Optional decoded-audio cache folder.
+
+    Returns:
+    dict: See frame_statistics.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        key = hashlib.sha1(f"{file_fingerprint(job[3:])}|{fft_window_size}|{hop_length}".encode()).hexdigest()
+        cache_path = os.path.join(cache_dir, key + '.npz')
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                return {name: cached[name] for name in cached.files}
+
+    audio_cache = AudioCache(audio_cache_dir) if audio_cache_dir else None
+    reference, sr = load_audio(job[3], cache=audio_cache)
+    estimate, _ = load_audio(job[4], cache=audio_cache)
+    min_len = min(len(reference), len(estimate))
+    statistics = frame_statistics(reference[:min_len], estimate[:min_len], sr, fft_window_size, hop_length)
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_path = cache_path + f".{os.getpid()}.tmp.npz"
+        np.savez(temporary_path, **statistics)
+        os.replace(temporary_path, cache_path)
+    return statistics
+
+
+def _masked_mean_std(values, masks):
+    # Mean and population std of `values` over each row of a (n_configs, n_frames) mask
+    counts = np.sum(masks, axis=1)
+    safe_counts = np.maximum(counts, 1)
+    means = masks @ values / safe_counts
+    stds = np.sqrt(np.sum(masks * (values[np.newaxis, :] - means[:, np.newaxis]) ** 2, axis=1) / safe_counts)
+    return counts, means, stds
+
+
+def sweep_dss(statistics, instrument_type=None, grid=DSS_GRID):
+    """
+    Evaluate the DSS of one stem for every configuration of a grid.
+
+    The active-frame mask is built once per presence threshold; the normalizer, flux
+    reference and flux cap are then applied by broadcasting.
+
+    Parameters:
+    statistics (dict): Output of frame_statistics.
+    instrument_type (str): Type of instrument ('drums', 'bass', 'other').
+    grid (dict): Lists of presence_threshold, dss_normalizer, flux_max_reference and flux_cap.
+
+    Returns:
+    ndarray: DSS with one axis per grid parameter, in the order listed above.
+    """
+    rms, flux = statistics['rms'], statistics['flux']
+    thresholds = np.asarray(grid['presence_threshold'], dtype=np.float64)
+    active = rms[np.newaxis, :] > thresholds[:, np.newaxis] * np.max(rms)
+
+    n_active, rms_mean, rms_std = _masked_mean_std(rms, active)
+    ratio = np.where(n_active > 0, rms_mean / (rms_std + 1e-6), 0)
+    n_flux, flux_mean, _ = _masked_mean_std(flux, active[:, 1:])  # Skip the first frame due to np.diff
+
+    normalizers = np.asarray(grid['dss_normalizer'], dtype=np.float64)
+    flux_references = np.asarray(grid['flux_max_reference'], dtype=np.float64)
+    flux_caps = np.asarray(grid['flux_cap'], dtype=np.float64)
+
+    dss = ratio[:, np.newaxis, np.newaxis, np.newaxis] / normalizers[np.newaxis, :, np.newaxis, np.newaxis] * 100
+    flux_score = np.where(n_flux > 0, flux_mean, 0)[:, np.newaxis, np.newaxis, np.newaxis] / flux_references[np.newaxis, np.newaxis, :, np.newaxis] * 100
+    flux_score = np.clip(flux_score, 0, flux_caps[np.newaxis, np.newaxis, np.newaxis, :])
+
+    if instrument_type == 'drums':
+        final_dynamic_score = dss + flux_score
+    elif instrument_type == 'bass':
+        final_dynamic_score = dss + np.zeros_like(flux_score)
+    else:
+        final_dynamic_score = dss - flux_score
+    return np.maximum(final_dynamic_score, 0)
+
+
+def sweep_fis(statistics, grid=FIS_GRID):
+    """
+    Evaluate the FIS of one stem for every pair of fundamental and harmonic weights.
+
+    Parameters:
+    statistics (dict): Output of frame_statistics.
+    grid (dict): Lists of weight_fundamental and weight_harmonics.
+
+    Returns:
+    ndarray: FIS, shape (len(weight_fundamental), len(weight_harmonics)).
+    """
+    harmonic_counts = statistics['harmonic_counts']
+    passes = np.sum(statistics['harmonic_passes'])
+    # Same normalizer as the score: the number of frames times the harmonic count of the last frame
+    max_possible = len(harmonic_counts) * harmonic_counts[-1] if len(harmonic_counts) > 0 else 0
+    weight_fundamental = np.asarray(grid['weight_fundamental'], dtype=np.float64)[:, np.newaxis]
+    weight_harmonics = np.asarray(grid['weight_harmonics'], dtype=np.float64)[np.newaxis, :]
+    harmonics_score = passes / max_possible * weight_harmonics if max_possible > 0 else np.full(weight_harmonics.shape, float(passes))
+    return weight_fundamental * bool(np.any(statistics['fundamental_present'])) + harmonics_score
+
+
+def correlations(scores, target):
+    """
+    Pearson and Spearman correlation of every configuration with a target metric.
+
+    Parameters:
+    scores (ndarray): Scores with the stems on the first axis, shape (n_stems, ...).
+    target (ndarray): Metric per stem, e.g. SAR, shape (n_stems,).
+
+    Returns:
+    tuple: (pearson, spearman) arrays of shape scores.shape[1:] (NaN for constant scores).
+    """
+    def pearson(x, y):
+        x = x - np.mean(x, axis=0)
+        y = y - np.mean(y)
+        denominator = np.sqrt(np.sum(x ** 2, axis=0) * np.sum(y ** 2))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.tensordot(y, x, axes=(0, 0)) / denominator
+
+    from scipy.stats import rankdata
+    return pearson(scores, target), pearson(rankdata(scores, axis=0), rankdata(target))
+
+
+def _job_statistics(args):
+    job, fft_window_size, hop_length, cache_dir, audio_cache_dir = args
+    return load_frame_statistics(job, fft_window_size, hop_length, cache_dir, audio_cache_dir)
+
+
+def read_sar(results_csv):
+    """
+    Read SAR per (song, stem, algorithm) from an evaluation CSV.
+
+    Returns:
+    dict: {(song, stem, algorithm): SAR}.
+    """
+    sar = {}
+    with open(results_csv, newline='') as file:
+        for row in csv.DictReader(file):
+            value = float(row[CSV_HEADER[5]])
+            if np.isfinite(value):
+                sar[(row[CSV_HEADER[0]], row[CSV_HEADER[1]], row[CSV_HEADER[2]])] = value
+    return sar
+
+
+def run_sweep(jobs, sar, resolutions=((2048, 512),), dss_grid=DSS_GRID, fis_grid=FIS_GRID, cache_dir=None, audio_cache_dir=None, workers=1, by_stem=True):
+    """
+    Sweep FIS and DSS parameters over a set of evaluated stems and correlate them with SAR.
+
+    Frame statistics are computed once per stem and STFT resolution (and reused across
+    runs when `cache_dir` is set); every grid configuration is then a vectorized reduction.
+
+    Parameters:
+    jobs (list): Evaluation jobs (see evaluation.discover_jobs).
+    sar (dict): SAR per (song, stem, algorithm); jobs without SAR are skipped.
+    resolutions (tuple): (fft_window_size, hop_length) pairs to sweep.
+    dss_grid (dict): DSS parameter lists (see sweep_dss).
+    fis_grid (dict): FIS parameter lists (see sweep_fis).
+    cache_dir (str): Optional folder caching the frame statistics.
+    audio_cache_dir (str): Optional decoded-audio cache folder.
+    workers (int): Processes computing frame statistics.
+    by_stem (bool): If True, also report correlations per stem type.
+
+    Returns:
+    tuple: (dss_rows, fis_rows), lists of dicts with the parameters, 'group' ('all' or
+    the stem name), 'n', 'pearson' and 'spearman', sorted by decreasing |pearson|.
+    """
+    jobs = [job for job in jobs if job[:3] in sar]
+    target = np.array([sar[job[:3]] for job in jobs])
+    stems = np.array([job[1] for job in jobs])
+    dss_names, fis_names = list(dss_grid), list(fis_grid)
+    groups = [('all', np.ones(len(jobs), dtype=bool))]
+    if by_stem:
+        groups += [(stem, stems == stem) for stem in sorted(set(stems))]
+
+    dss_rows, fis_rows = [], []
+    for fft_window_size, hop_length in resolutions:
+        tasks = [(job, fft_window_size, hop_length, cache_dir, audio_cache_dir) for job in jobs]
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                all_statistics = list(executor.map(_job_statistics, tasks))
+        else:
+            all_statistics = [_job_statistics(task) for task in tasks]
+
+        dss = np.stack([sweep_dss(statistics, job[1], dss_grid) for job, statistics in zip(jobs, all_statistics)])
+        fis = np.stack([sweep_fis(statistics, fis_grid) for statistics in all_statistics])
+        resolution = {'fft_window_size': fft_window_size, 'hop_length': hop_length}
+
+        for scores, names, grid, rows in ((dss, dss_names, dss_grid, dss_rows), (fis, fis_names, fis_grid, fis_rows)):
+            for group, mask in groups:
+                if np.sum(mask) < 3:
+                    continue
+                pearson, spearman = correlations(scores[mask], target[mask])
+                for index in itertools.product(*(range(len(grid[name])) for name in names)):
+                    row = dict(resolution, **{name: grid[name][i] for name, i in zip(names, index)})
+                    row.update(group=group, n=int(np.sum(mask)), pearson=float(pearson[index]), spearman=float(spearman[index]))
+                    rows.append(row)
+
+    def strength(row):
+        return -abs(row['pearson']) if np.isfinite(row['pearson']) else 0
+    return sorted(dss_rows, key=strength), sorted(fis_rows, key=strength)
+
+
+def write_rows(rows, output_file):
+    with open(output_file, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _parse_resolutions(values):
+    return [tuple(int(part) for part in value.split(':')) for value in values]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep FIS and DSS parameters and correlate every configuration with SAR.")
+    parser.add_argument('--ground-truth', default=ground_truth_path, help="Folder of song folders holding the reference stems")
+    parser.add_argument('--estimates', default=output_base_path, help="Root of the separation outputs")
+    parser.add_argument('--results', default=evaluation_output_file, help="Evaluation CSV providing SAR")
+    parser.add_argument('--output-prefix', default='sweep', help="Writes <prefix>_dss.csv and <prefix>_fis.csv")
+    parser.add_argument('--resolutions', nargs='+', default=['2048:512'], help="STFT resolutions as n_fft:hop")
+    parser.add_argument('--cache', default=None, help="Folder caching the frame statistics across runs")
+    parser.add_argument('--audio-cache', default=None, help="Folder for decoded float32 audio")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Processes computing frame statistics")
+    parser.add_argument('--targets', nargs='+', default=TARGETS, help="Stems to include")
+    parser.add_argument('--algorithms', nargs='+', default=ALGORITHMS, help="Algorithms to include")
+    parser.add_argument('--top', type=int, default=10, help="Number of best configurations to print")
+    args = parser.parse_args(argv)
+
+    jobs = discover_jobs(args.ground_truth, args.estimates, targets=args.targets, algorithms=args.algorithms)
+    dss_rows, fis_rows = run_sweep(jobs, read_sar(args.results), _parse_resolutions(args.resolutions),
+                                   cache_dir=args.cache, audio_cache_dir=args.audio_cache, workers=args.workers)
+    for name, rows in (('dss', dss_rows), ('fis', fis_rows)):
+        if not rows:
+            print(f"No {name.upper()} configurations evaluated (fewer than 3 stems with SAR).")
+            continue
+        write_rows(rows, f"{args.output_prefix}_{name}.csv")
+        print(f"\nStrongest {name.upper()} correlations with SAR (all stems):")
+        for row in [row for row in rows if row['group'] == 'all'][:args.top]:
+            parameters = ", ".join(f"{key}={value}" for key, value in row.items() if key not in ('group', 'n', 'pearson', 'spearman'))
+            print(f"  r={row['pearson']:+.3f}  rho={row['spearman']:+.3f}  {parameters}")
+        print(f"All configurations written to {args.output_prefix}_{name}.csv")
+
+
+if __name__ == '__main__':
+    main()
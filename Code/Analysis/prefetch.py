@@ -0,0 +1,120 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Block size for reading files ahead into the OS page cache
+READ_AHEAD_BLOCK = 1 << 20
+
+
+class Prefetcher:
+    """
+    Run a load function over upcoming items on I/O threads while the caller consumes
+    earlier ones.
+
+    Iterating yields (item, future) pairs in input order; `future.result()` returns the
+    loaded value or raises the load error, so one bad file does not stop the stream. At
+    most `depth` items are loading or loaded but not yet taken: a new load only starts
+    when the caller takes an item, which bounds the memory held by prefetched data. With
+    depth 0 nothing is loaded ahead and each item is loaded when it is taken.
+
+    Usage: `with Prefetcher(jobs, load, threads=4, depth=8) as prefetched: for job, future in prefetched: ...`
+
+    Parameters:
+    items (iterable): Items to load, in the order they will be consumed.
+    load (callable): Called with one item on an I/O thread.
+    threads (int): Number of I/O threads.
+    depth (int): Maximum number of items loaded ahead of the consumer.
+    """
+
+    def __init__(self, items, load, threads=4, depth=8):
+        self.items = iter(items)
+        self.load = load
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads)) if depth > 0 else None
+        self.ahead = deque()
+
+    def _fill(self):
+        # Top up the loads in flight to `depth`
+        while len(self.ahead) < self.depth:
+            item = next(self.items, _DONE)
+            if item is _DONE:
+                return
+            self.ahead.append((item, self.executor.submit(self.load, item)))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.executor is None:
+            item = next(self.items)
+            return item, _completed(self.load, item)
+        self._fill()
+        if not self.ahead:
+            raise StopIteration
+        item, future = self.ahead.popleft()
+        self._fill()
+        return item, future
+
+    def close(self):
+        """
+        Cancel loads that have not started and wait for the running ones.
+        """
+        if self.executor is not None:
+            for _, future in self.ahead:
+                future.cancel()
+            self.ahead.clear()
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Done:
+    pass
+
+
+_DONE = _Done()
+
+
+class _Completed:
+    # Future-like result of a load run in the caller's thread
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def _completed(load, item):
+    try:
+        return _Completed(value=load(item))
+    except Exception as e:
+        return _Completed(error=e)
+
+
+def read_ahead(path, block_size=READ_AHEAD_BLOCK):
+    """
+    Read a file once and discard the data, so that a later read is served from the OS
+    page cache instead of a slow or remote disk.
+
+    Parameters:
+    path (str): File to read.
+    block_size (int): Read size in bytes.
+
+    Returns:
+    int: Number of bytes read.
+    """
+    total = 0
+    buffer = bytearray(block_size)
+    with open(path, 'rb', buffering=0) as file:
+        while True:
+            count = file.readinto(buffer)
+            if not count:
+                return total
+            total += count
+
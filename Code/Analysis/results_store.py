@@ -0,0 +1,284 @@
+import os
+import csv
+import json
+import sqlite3
+import hashlib
+from datetime import datetime
+
+RESULT_COLUMNS = ["sdr", "sir", "sar", "fis", "dss"]
+CSV_HEADER = ["Song Name", "Stem Name", "Algorithm Type", "SDR (dB)", "SIR (dB)", "SAR (dB)", "Frequency Isolation Score", "Dynamic Stability Score"]
+
+
+def parameter_hash(parameters):
+    """
+    Hash a dictionary of score parameters.
+
+    Parameters:
+    parameters (dict): JSON-serializable score parameters.
+
+    Returns:
+    str: Short hex digest that changes whenever any parameter changes.
+    """
+    encoded = json.dumps(parameters, sort_keys=True).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def file_fingerprint(paths, hash_contents=False, roots=None):
+    """
+    Fingerprint input files by modification time and size, or by size and content.
+
+    With `roots`, each file is named by its path relative to its dataset root, so nodes
+    mounting the same dataset at different places derive the same fingerprints (and the
+    same work-queue task ids), and their results stores merge.
+
+    Parameters:
+    paths (list): Input file paths.
+    hash_contents (bool): If True, hash the file contents instead of the modification time
+        (slower, robust to touched or copied files).
+    roots (list): Dataset root of each path (e.g. the ground-truth and estimates folders of
+        a job), or None to name files by their absolute path.
+
+    Returns:
+    str: Hex digest identifying the current state of all files.
+    """
+    digest = hashlib.sha1()
+    for index, path in enumerate(paths):
+        stat = os.stat(path)
+        name = relative_name(path, None if roots is None else roots[index])
+        if hash_contents:
+            digest.update(f"{name}|{stat.st_size}".encode())
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+        else:
+            digest.update(f"{name}|{stat.st_mtime_ns}|{stat.st_size}".encode())
+    return digest.hexdigest()
+
+
+def relative_name(path, root=None):
+    """
+    Name a file by its path relative to a dataset root, with '/' separators on every platform.
+
+    Parameters:
+    path (str): File path.
+    root (str): Dataset root, or None for the absolute path.
+
+    Returns:
+    str: The name used in input fingerprints.
+    """
+    if root is None:
+        return os.path.abspath(path)
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(root)).replace(os.sep, '/')
+
+
+class ResultsStore:
+    """
+    SQLite store of evaluation results keyed by (song, stem, algorithm, parameter hash).
+
+    Each row also records the fingerprint of the input files it was computed from,
+    so a re-run only needs to compute rows that are missing or whose inputs changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                song TEXT NOT NULL,
+                stem TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                params_hash TEXT NOT NULL,
+                input_fingerprint TEXT NOT NULL,
+                sdr REAL, sir REAL, sar REAL, fis REAL, dss REAL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (song, stem, algorithm, params_hash)
+            )""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS windows (
+                song TEXT NOT NULL,
+                stem TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                params_hash TEXT NOT NULL,
+                window_index INTEGER NOT NULL,
+                start_time REAL NOT NULL,
+                sdr REAL, sir REAL, sar REAL,
+                PRIMARY KEY (song, stem, algorithm, params_hash, window_index)
+            )""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS channels (
+                song TEXT NOT NULL,
+                stem TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                params_hash TEXT NOT NULL,
+                channel INTEGER NOT NULL,
+                fis REAL, dss REAL,
+                PRIMARY KEY (song, stem, algorithm, params_hash, channel)
+            )""")
+        self.connection.commit()
+
+    def fingerprints(self, params_hash):
+        """
+        Return the input fingerprint of every stored row for one parameter set.
+
+        Parameters:
+        params_hash (str): Score parameter hash.
+
+        Returns:
+        dict: {(song, stem, algorithm): input fingerprint}.
+        """
+        rows = self.connection.execute("SELECT song, stem, algorithm, input_fingerprint FROM results WHERE params_hash = ?", (params_hash,))
+        return {(song, stem, algorithm): fingerprint for song, stem, algorithm, fingerprint in rows}
+
+    def put(self, song, stem, algorithm, params_hash, input_fingerprint, sdr, sir, sar, fis, dss, commit=True):
+        """
+        Insert a result, replacing any stale row with the same key.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (song, stem, algorithm, params_hash, input_fingerprint, float(sdr), float(sir), float(sar), float(fis), float(dss), datetime.now().isoformat()))
+        if commit:
+            self.connection.commit()
+
+    def put_windows(self, song, stem, algorithm, params_hash, start_times, sdr, sir, sar, commit=True):
+        """
+        Store the per-window BSS-eval metrics of one result, replacing previous windows.
+        """
+        self.connection.execute(
+            "DELETE FROM windows WHERE song = ? AND stem = ? AND algorithm = ? AND params_hash = ?",
+            (song, stem, algorithm, params_hash))
+        self.connection.executemany(
+            "INSERT INTO windows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(song, stem, algorithm, params_hash, index, float(start), float(window_sdr), float(window_sir), float(window_sar))
+             for index, (start, window_sdr, window_sir, window_sar) in enumerate(zip(start_times, sdr, sir, sar))])
+        if commit:
+            self.connection.commit()
+
+    def windows(self, song, stem, algorithm, params_hash):
+        """
+        Return the per-window BSS-eval metrics of one result.
+
+        Returns:
+        list: (start_time, sdr, sir, sar) tuples in window order.
+        """
+        return self.connection.execute(
+            "SELECT start_time, sdr, sir, sar FROM windows WHERE song = ? AND stem = ? AND algorithm = ? AND params_hash = ? ORDER BY window_index",
+            (song, stem, algorithm, params_hash)).fetchall()
+
+    def put_channels(self, song, stem, algorithm, params_hash, channel_scores, commit=True):
+        """
+        Store the per-channel FIS and DSS of one result, replacing previous channels.
+
+        Parameters:
+        channel_scores (list): {'fis', 'dss'} dicts in channel order.
+        """
+        self.connection.execute(
+            "DELETE FROM channels WHERE song = ? AND stem = ? AND algorithm = ? AND params_hash = ?",
+            (song, stem, algorithm, params_hash))
+        self.connection.executemany(
+            "INSERT INTO channels VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(song, stem, algorithm, params_hash, index, float(scores['fis']), float(scores['dss']))
+             for index, scores in enumerate(channel_scores)])
+        if commit:
+            self.connection.commit()
+
+    def channels(self, song, stem, algorithm, params_hash):
+        """
+        Return the per-channel scores of one result.
+
+        Returns:
+        list: (fis, dss) tuples in channel order.
+        """
+        return self.connection.execute(
+            "SELECT fis, dss FROM channels WHERE song = ? AND stem = ? AND algorithm = ? AND params_hash = ? ORDER BY channel",
+            (song, stem, algorithm, params_hash)).fetchall()
+
+    def rows(self, params_hash=None):
+        """
+        Return stored results in song, stem, algorithm order.
+
+        Parameters:
+        params_hash (str): Only return rows computed with this parameter set.
+
+        Returns:
+        list: Rows in CSV_HEADER order.
+        """
+        query = "SELECT song, stem, algorithm, sdr, sir, sar, fis, dss FROM results"
+        arguments = ()
+        if params_hash is not None:
+            query += " WHERE params_hash = ?"
+            arguments = (params_hash,)
+        return [list(row) for row in self.connection.execute(query + " ORDER BY song, stem, algorithm", arguments)]
+
+    def export_csv(self, output_file, params_hash=None):
+        """
+        Write stored results to a CSV file in the evaluation_results.csv layout.
+
+        Returns:
+        int: Number of rows written.
+        """
+        rows = self.rows(params_hash)
+        with open(output_file, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(CSV_HEADER)
+            writer.writerows(rows)
+        return len(rows)
+
+    def merge(self, other_path, fingerprints=None):
+        """
+        Merge the results of another store, e.g. one written by another node.
+
+        Rows are keyed by (song, stem, algorithm, parameter hash), so merging never
+        duplicates a result. A result is a function of its inputs and parameters, so two
+        rows of the same key only disagree when they were computed from different inputs;
+        the clocks of the nodes are never compared. A key present in both stores keeps
+        this store's row, unless `fingerprints` shows that only the incoming row was
+        computed from the current inputs. The per-window and per-channel values always
+        follow their row.
+
+        Parameters:
+        other_path (str): SQLite results store to merge in.
+        fingerprints (dict): Optional {(song, stem, algorithm): input fingerprint} of the
+            current inputs (see file_fingerprint).
+
+        Returns:
+        int: Number of results taken from the other store.
+        """
+        key = "song, stem, algorithm, params_hash"
+        self.connection.execute("ATTACH DATABASE ? AS other", (other_path,))
+        try:
+            self.connection.execute("CREATE TEMP TABLE current_inputs (song TEXT, stem TEXT, algorithm TEXT, input_fingerprint TEXT, PRIMARY KEY (song, stem, algorithm))")
+            self.connection.executemany("INSERT INTO temp.current_inputs VALUES (?, ?, ?, ?)",
+                                        [(*job, fingerprint) for job, fingerprint in (fingerprints or {}).items()])
+            self.connection.execute(f"""
+                CREATE TEMP TABLE merged AS SELECT {key} FROM other.results AS incoming
+                WHERE NOT EXISTS (SELECT 1 FROM main.results AS current
+                    WHERE current.song = incoming.song AND current.stem = incoming.stem AND current.algorithm = incoming.algorithm
+                    AND current.params_hash = incoming.params_hash
+                    AND NOT (current.input_fingerprint != incoming.input_fingerprint AND EXISTS (
+                        SELECT 1 FROM temp.current_inputs AS inputs
+                        WHERE inputs.song = incoming.song AND inputs.stem = incoming.stem AND inputs.algorithm = incoming.algorithm
+                        AND inputs.input_fingerprint = incoming.input_fingerprint)))""")
+            for table in ('results', 'windows', 'channels'):
+                if table != 'results':
+                    self.connection.execute(f"DELETE FROM main.{table} WHERE ({key}) IN (SELECT {key} FROM temp.merged)")
+                self.connection.execute(f"INSERT OR REPLACE INTO main.{table} SELECT * FROM other.{table} WHERE ({key}) IN (SELECT {key} FROM temp.merged)")
+            merged = self.connection.execute("SELECT COUNT(*) FROM temp.merged").fetchone()[0]
+            self.connection.commit()
+        finally:
+            self.connection.execute("DROP TABLE IF EXISTS temp.merged")
+            self.connection.execute("DROP TABLE IF EXISTS temp.current_inputs")
+            self.connection.execute("DETACH DATABASE other")
+        return merged
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
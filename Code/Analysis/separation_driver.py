@@ -0,0 +1,407 @@
+import os
+import glob
+import time
+import queue
+import argparse
+import importlib
+import multiprocessing
+from datetime import datetime
+from contextlib import nullcontext
+
+from work_queue import LeaseQueue, LEASE_SECONDS, in_shard, parse_shard, task_id
+
+# Define paths
+dataset_path = 'F:\\coding\\workspace\\stem sap\\musdb18hq\\train'
+output_base_path = 'F:\\coding\\workspace\\stem sap\\sap_output'
+log_file_path = 'F:\\coding\\workspace\\stem sap\\log.txt'
+
+TARGETS = ["vocals", "drums", "bass", "other"]
+
+
+class Separator:
+    """
+    Interface of a source separation model run by the driver.
+
+    A separator is constructed and loaded once per worker process and then separates
+    many mixtures, so model weights and imports are paid for once. Subclasses set `name`
+    (the algorithm folder under each song) and implement `load` and `separate`.
+
+    Parameters:
+    threads (int): CPU threads the model may use.
+    """
+
+    name = None
+
+    def __init__(self, threads=1):
+        self.threads = threads
+
+    def load(self):
+        """
+        Import the framework and load model weights.
+        """
+
+    def separate(self, mixture_path, output_dir):
+        """
+        Separate one mixture and write one wav file per target.
+
+        Parameters:
+        mixture_path (str): Path of mixture.wav.
+        output_dir (str): Algorithm folder of the song, e.g. <output>/<song>/UMX.
+        """
+        raise NotImplementedError
+
+    def output_paths(self, output_dir):
+        """
+        Return the stem files `separate` produces for a song.
+
+        Parameters:
+        output_dir (str): Algorithm folder of the song.
+
+        Returns:
+        list: Paths of the expected stem files.
+        """
+        return [os.path.join(output_dir, "mixture", f"{target}.wav") for target in TARGETS]
+
+    def is_done(self, output_dir):
+        return all(os.path.isfile(path) for path in self.output_paths(output_dir))
+
+
+def write_stems(stem_dir, stems, sr):
+    """
+    Write one 16-bit wav file per stem, like the separation CLIs.
+
+    Parameters:
+    stem_dir (str): Folder of the stem files, created if missing.
+    stems (dict): {target: samples of shape (n_samples, n_channels)}.
+    sr (int): Sample rate of the stems.
+    """
+    import numpy as np
+    import soundfile as sf
+    os.makedirs(stem_dir, exist_ok=True)
+    for target, samples in stems.items():
+        # Clip like torchaudio does when the CLIs save 16-bit audio, instead of letting samples wrap
+        sf.write(os.path.join(stem_dir, f"{target}.wav"), np.clip(samples, -1.0, 1.0), sr, subtype='PCM_16')
+
+
+class MixtureSeparator(Separator):
+    """
+    Baseline that writes the mixture itself as the estimate of every target.
+
+    It loads no model and needs no framework, so it also serves as a fast stand-in for
+    exercising the driver.
+    """
+
+    name = 'Mixture'
+
+    def separate(self, mixture_path, output_dir):
+        import soundfile as sf
+        audio, rate = sf.read(mixture_path, dtype='float32', always_2d=True)
+        write_stems(os.path.join(output_dir, "mixture"), {target: audio for target in TARGETS}, rate)
+
+
+def _limit_torch_threads(threads):
+    import torch
+    torch.set_num_threads(threads)
+    return torch
+
+
+class UMXSeparator(Separator):
+    """
+    Open-Unmix, writing the same layout and 16-bit files as `umx --outdir <song>/UMX mixture.wav`.
+    """
+
+    name = 'UMX'
+    model_name = 'umxl'
+
+    def load(self):
+        torch = _limit_torch_threads(self.threads)
+        from openunmix import predict, utils
+        self._torch = torch
+        self._predict = predict
+        self._model = utils.load_separator(model_str_or_path=self.model_name, device='cpu', pretrained=True)
+        self._model.freeze()
+
+    def separate(self, mixture_path, output_dir):
+        import soundfile as sf
+        audio, rate = sf.read(mixture_path, dtype='float32', always_2d=True)
+        audio = self._torch.as_tensor(audio.T)
+        estimates = self._predict.separate(audio, rate=rate, separator=self._model)
+        write_stems(os.path.join(output_dir, "mixture"), {target: estimate[0].cpu().numpy().T for target, estimate in estimates.items()}, self._model.sample_rate)
+
+
+class DemucsSeparator(Separator):
+    """
+    Demucs, writing the same layout as `demucs --out <song>/Demucs mixture.wav`.
+    """
+
+    name = 'Demucs'
+    model_name = 'htdemucs'
+
+    def load(self):
+        torch = _limit_torch_threads(self.threads)
+        from demucs.pretrained import get_model
+        from demucs.apply import apply_model
+        from demucs.audio import AudioFile, save_audio
+        self._torch = torch
+        self._apply_model = apply_model
+        self._audio_file = AudioFile
+        self._save_audio = save_audio
+        self._model = get_model(self.model_name)
+        self._model.eval()
+
+    def output_paths(self, output_dir):
+        return [os.path.join(output_dir, self.model_name, "mixture", f"{target}.wav") for target in TARGETS]
+
+    def separate(self, mixture_path, output_dir):
+        wav = self._audio_file(mixture_path).read(streams=0, samplerate=self._model.samplerate, channels=self._model.audio_channels)
+        reference = wav.mean(0)
+        wav = (wav - reference.mean()) / reference.std()
+        with self._torch.no_grad():
+            sources = self._apply_model(self._model, wav[None], device='cpu', progress=False)[0]
+        sources = sources * reference.std() + reference.mean()
+        stem_dir = os.path.join(output_dir, self.model_name, "mixture")
+        os.makedirs(stem_dir, exist_ok=True)
+        for source, name in zip(sources, self._model.sources):
+            self._save_audio(source, os.path.join(stem_dir, f"{name}.wav"), samplerate=self._model.samplerate)
+
+
+SEPARATORS = {
+    'UMX': UMXSeparator,
+    'Demucs': DemucsSeparator,
+    'Mixture': MixtureSeparator,
+}
+
+
+def resolve_separator(spec):
+    """
+    Find a separator class by registered name or by 'module:Class' import path.
+
+    Parameters:
+    spec (str): 'UMX', 'Demucs', 'Mixture' or an import path such as 'my_models:FakeSeparator'.
+
+    Returns:
+    type: The separator class.
+    """
+    if spec in SEPARATORS:
+        return SEPARATORS[spec]
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _separator_worker(spec, threads, task_queue, result_queue):
+    # Long-lived worker: pay for imports and model weights once, then separate until told to stop
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
+    separator = resolve_separator(spec)(threads=threads)
+    try:
+        separator.load()
+    except Exception as e:
+        result_queue.put((spec, None, f"model load failed: {e}", 0.0))
+        # Drain the tasks of this worker so the driver still receives one result per task
+        while True:
+            task = task_queue.get()
+            if task is None:
+                return
+            result_queue.put((spec, task[0], f"model load failed: {e}", 0.0))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        mixture_file, output_dir = task
+        start = time.perf_counter()
+        try:
+            separator.separate(mixture_file, output_dir)
+            result_queue.put((spec, mixture_file, None, time.perf_counter() - start))
+        except Exception as e:
+            result_queue.put((spec, mixture_file, str(e), time.perf_counter() - start))
+
+
+def find_mixtures(dataset_path):
+    """
+    List the mixture.wav of every song folder.
+
+    Returns:
+    list: (song name, mixture path) tuples.
+    """
+    mixtures = []
+    for folder in sorted(glob.glob(os.path.join(dataset_path, '*'))):
+        mixture_file = os.path.join(folder, 'mixture.wav')
+        if os.path.isdir(folder) and os.path.isfile(mixture_file):
+            mixtures.append((os.path.basename(folder), mixture_file))
+    return mixtures
+
+
+def run_separation(dataset_path=dataset_path, output_base_path=output_base_path, separators=('UMX', 'Demucs'), threads=None, workers_per_model=1, log_file_path=None, skip_existing=True, mixtures=None, shard=None, queue_dir=None, lease_seconds=LEASE_SECONDS):
+    """
+    Separate every mixture of a dataset with persistent model workers.
+
+    Every separator gets its own long-lived worker processes that load the model once
+    and take mixtures from a queue, so all models run at the same time with their own
+    CPU thread budget. Songs whose outputs already exist are skipped.
+
+    Several nodes can share a dataset either by sharding it (`shard`, assigned by song
+    name) or through a work queue on a shared directory (`queue_dir`): each node then
+    claims a few (song, separator) tasks at a time under an expiring lease, and tasks of
+    nodes that stop are taken over once their lease expires.
+
+    Parameters:
+    dataset_path (str): Folder of song folders holding mixture.wav.
+    output_base_path (str): Root of the separation outputs (<root>/<song>/<algorithm>/...).
+    separators (tuple): Separator names or 'module:Class' paths (see resolve_separator).
+    threads (dict): CPU threads per worker of each separator (defaults to an even split of the CPUs).
+    workers_per_model (int): Worker processes per separator.
+    log_file_path (str): Optional log file, appended to.
+    skip_existing (bool): If True, skip songs whose stem files already exist.
+    mixtures (list): Optional (song name, mixture path) list instead of scanning dataset_path.
+    shard (tuple): (index, count) to separate only the songs of one shard.
+    queue_dir (str): Shared work-queue directory (see work_queue.LeaseQueue).
+    lease_seconds (float): Lease length of claimed tasks in queue mode.
+
+    Returns:
+    dict: {separator: {'done': int, 'skipped': int, 'failed': int}}.
+    """
+    mixtures = find_mixtures(dataset_path) if mixtures is None else mixtures
+    mixtures = [(folder_name, mixture_file) for folder_name, mixture_file in mixtures if in_shard(folder_name, shard)]
+    work_queue = LeaseQueue(queue_dir, lease_seconds=lease_seconds) if queue_dir else None
+    default_threads = max((os.cpu_count() or 1) // (len(separators) * workers_per_model), 1)
+    threads = {spec: (threads or {}).get(spec, default_threads) for spec in separators}
+    log_file = open(log_file_path, 'a') if log_file_path else None
+
+    def log(message):
+        print(message, flush=True)
+        if log_file is not None:
+            log_file.write(message + "\n")
+            log_file.flush()
+
+    log(f"--- Separation processing started at {datetime.now()} ---")
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    summary = {spec: {'done': 0, 'skipped': 0, 'failed': 0} for spec in separators}
+    workers = []
+    task_queues = []  # Keep every queue alive until its spawned workers have attached to it
+    feeds = {}
+    pending = 0
+
+    def feed(spec):
+        # Queue mode: keep a few claimed mixtures queued for the workers of a separator, and stop
+        # them once nothing is left to claim or to wait for on other nodes
+        nonlocal pending
+        state = feeds[spec]
+        while state['open'] and state['queued'] < 2 * workers_per_model:
+            claimed = next(state['claims'], None)
+            if claimed is None:
+                # Leases of stopped nodes expire later: claim again on the next call
+                state['claims'] = work_queue.claim_each(state['tasks'])
+                break
+            task, (mixture_file, output_dir) = claimed
+            state['leases'][mixture_file] = task
+            state['queue'].put((mixture_file, output_dir))
+            state['queued'] += 1
+            pending += 1
+        if state['open'] and state['queued'] == 0 and not work_queue.unfinished(task for task, _, _ in state['tasks']):
+            state['open'] = False
+            for _ in range(workers_per_model):
+                state['queue'].put(None)
+
+    try:
+        for spec in separators:
+            separator = resolve_separator(spec)(threads=threads[spec])
+            task_queue = context.Queue()
+            task_queues.append(task_queue)
+            queued = 0
+            tasks = []
+            for folder_name, mixture_file in mixtures:
+                output_dir = os.path.join(output_base_path, folder_name, separator.name or spec)
+                if skip_existing and separator.is_done(output_dir):
+                    summary[spec]['skipped'] += 1
+                    continue
+                os.makedirs(output_dir, exist_ok=True)
+                if work_queue is None:
+                    task_queue.put((mixture_file, output_dir))
+                else:
+                    tasks.append((task_id(spec, folder_name), (mixture_file, output_dir), f"{spec} {folder_name}"))
+                queued += 1
+            if work_queue is None:
+                pending += queued
+                for _ in range(workers_per_model):
+                    task_queue.put(None)
+                log(f"{spec}: {queued} mixtures queued, {summary[spec]['skipped']} already separated, {threads[spec]} threads per worker")
+            else:
+                feeds[spec] = {'queue': task_queue, 'tasks': tasks, 'claims': work_queue.claim_each(tasks), 'leases': {}, 'queued': 0, 'open': True}
+                feed(spec)
+                log(f"{spec}: {queued} mixtures shared through {queue_dir} as {work_queue.node}, {summary[spec]['skipped']} already separated, {threads[spec]} threads per worker")
+            for _ in range(workers_per_model):
+                process = context.Process(target=_separator_worker, args=(spec, threads[spec], task_queue, result_queue))
+                process.start()
+                workers.append(process)
+
+        with work_queue.heartbeating() if work_queue is not None else nullcontext():
+            while pending > 0 or any(state['open'] for state in feeds.values()):
+                try:
+                    spec, mixture_file, error, seconds = result_queue.get(timeout=10)
+                except queue.Empty:
+                    if not any(process.is_alive() for process in workers):
+                        log(f"  - All separator workers exited with {pending} mixtures unfinished")
+                        break
+                    for spec in feeds:
+                        feed(spec)
+                    continue
+                if mixture_file is None:
+                    log(f"  - Error with {spec}: {error}")
+                    continue
+                pending -= 1
+                if error is None:
+                    summary[spec]['done'] += 1
+                    log(f"  - {spec} separated {mixture_file} in {seconds:.1f} s")
+                else:
+                    summary[spec]['failed'] += 1
+                    log(f"  - Error with {spec} on {mixture_file}: {error}")
+                if spec in feeds:
+                    # Failed mixtures are released so that another node may retry them
+                    state = feeds[spec]
+                    state['queued'] -= 1
+                    task = state['leases'].pop(mixture_file)
+                    if error is None:
+                        work_queue.complete(task)
+                    else:
+                        work_queue.release(task)
+                    feed(spec)
+    finally:
+        for process in workers:
+            process.join()
+        log(f"--- Separation processing ended at {datetime.now()} ---")
+        if log_file is not None:
+            log_file.close()
+    return summary
+
+
+def _parse_threads(values):
+    threads = {}
+    for value in values or []:
+        spec, _, count = value.rpartition('=')
+        threads[spec] = int(count)
+    return threads
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Separate every mixture of a dataset with persistent model workers.")
+    parser.add_argument('--dataset', default=dataset_path, help="Folder of song folders holding mixture.wav")
+    parser.add_argument('--output', default=output_base_path, help="Root of the separation outputs")
+    parser.add_argument('--separators', nargs='+', default=['UMX', 'Demucs'], help="Separator names or module:Class paths")
+    parser.add_argument('--threads', nargs='*', help="CPU threads per worker, e.g. UMX=4 Demucs=12")
+    parser.add_argument('--workers-per-model', type=int, default=1, help="Worker processes per separator")
+    parser.add_argument('--log', default=log_file_path, help="Log file, appended to")
+    parser.add_argument('--force', action='store_true', help="Separate again even if outputs exist")
+    parser.add_argument('--shard', type=parse_shard, default=None, help="Separate one shard of the songs, e.g. 0/4 .. 3/4")
+    parser.add_argument('--queue', default=None, help="Shared work-queue directory; nodes using the same directory split the songs through leases")
+    parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS, help="Lease length of claimed songs in --queue mode")
+    args = parser.parse_args(argv)
+
+    run_separation(args.dataset, args.output, separators=args.separators, threads=_parse_threads(args.threads),
+                   workers_per_model=args.workers_per_model, log_file_path=args.log, skip_existing=not args.force,
+                   shard=args.shard, queue_dir=args.queue, lease_seconds=args.lease_seconds)
+
+
+if __name__ == '__main__':
+    main()
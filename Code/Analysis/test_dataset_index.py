@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+import soundfile as sf
+
+from dataset_index import DatasetIndex, estimate_folder
+
+SR = 8000
+
+
+def write_wav(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sf.write(path, np.zeros(SR, dtype=np.float32), SR)
+
+
+def test_demucs_model_folder_is_the_first_directory_in_sorted_order(tmp_path):
+    output = str(tmp_path / 'output')
+    base = os.path.join(output, 'Song', 'Demucs')
+    for model in ('mdx', 'htdemucs'):
+        write_wav(os.path.join(base, model, 'mixture', 'vocals.wav'))
+    open(os.path.join(base, '.DS_Store'), 'w').close()
+
+    assert estimate_folder(output, 'Song', 'Demucs') == os.path.join(base, 'htdemucs', 'mixture')
+    assert estimate_folder(output, 'Missing', 'Demucs') is None
+    assert estimate_folder(output, 'Song', 'UMX') == os.path.join(output, 'Song', 'UMX', 'mixture')
+
+
+def test_unreadable_file_is_skipped_and_indexed_once_readable(tmp_path):
+    ground_truth = str(tmp_path / 'gt')
+    write_wav(os.path.join(ground_truth, 'Song', 'mixture.wav'))
+    # A stem still being written: not yet a readable wav
+    vocals = os.path.join(ground_truth, 'Song', 'vocals.wav')
+    with open(vocals, 'wb') as file:
+        file.write(b'RIFF')
+
+    with DatasetIndex(str(tmp_path / 'index.sqlite')) as index:
+        index.update(ground_truth)
+        assert sorted(index.song('Song')['stems']) == []
+        assert index.song('Song')['mixture'] is not None
+
+        write_wav(vocals)
+        index.update(ground_truth, stat_files=False)
+        assert sorted(index.song('Song')['stems']) == ['vocals']
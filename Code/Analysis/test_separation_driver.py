@@ -0,0 +1,66 @@
+import os
+import types
+
+import numpy as np
+import soundfile as sf
+
+from separation_driver import Separator, TARGETS, UMXSeparator, run_separation
+
+SR = 8000
+
+
+class FailingSeparator(Separator):
+    # Stand-in whose every separation fails, loaded by the workers through its import path
+    name = 'Failing'
+
+    def separate(self, mixture_path, output_dir):
+        raise RuntimeError("separation failed")
+
+
+def write_dataset(folder, songs):
+    rng = np.random.default_rng(0)
+    for song in songs:
+        os.makedirs(os.path.join(folder, song))
+        sf.write(os.path.join(folder, song, 'mixture.wav'), (0.1 * rng.standard_normal((SR, 2))).astype(np.float32), SR)
+
+
+def test_run_separation_writes_every_stem(tmp_path):
+    dataset, output = str(tmp_path / 'dataset'), str(tmp_path / 'output')
+    write_dataset(dataset, ['Song 1', 'Song 2'])
+
+    summary = run_separation(dataset, output, separators=('Mixture',), threads={'Mixture': 1})
+    assert summary == {'Mixture': {'done': 2, 'skipped': 0, 'failed': 0}}
+    for song in ('Song 1', 'Song 2'):
+        mixture, _ = sf.read(os.path.join(dataset, song, 'mixture.wav'), dtype='float32')
+        for target in TARGETS:
+            path = os.path.join(output, song, 'Mixture', 'mixture', f"{target}.wav")
+            assert sf.info(path).subtype == 'PCM_16'
+            assert np.allclose(sf.read(path, dtype='float32')[0], mixture, atol=1 / 2 ** 15)
+
+    summary = run_separation(dataset, output, separators=('Mixture',), threads={'Mixture': 1})
+    assert summary == {'Mixture': {'done': 0, 'skipped': 2, 'failed': 0}}
+
+
+def test_run_separation_reports_failures(tmp_path):
+    dataset, output = str(tmp_path / 'dataset'), str(tmp_path / 'output')
+    write_dataset(dataset, ['Song 1', 'Song 2', 'Song 3'])
+
+    summary = run_separation(dataset, output, separators=('Mixture', 'test_separation_driver:FailingSeparator'), threads={'Mixture': 1, 'test_separation_driver:FailingSeparator': 1})
+    assert summary == {'Mixture': {'done': 3, 'skipped': 0, 'failed': 0}, 'test_separation_driver:FailingSeparator': {'done': 0, 'skipped': 0, 'failed': 3}}
+
+
+def test_umx_writes_16_bit_stems_like_the_cli(tmp_path):
+    # The model is replaced by one returning out-of-range estimates, which are clipped rather than wrapped
+    mixture_path = str(tmp_path / 'mixture.wav')
+    sf.write(mixture_path, np.zeros((SR, 2), dtype=np.float32), SR)
+    estimate = np.full((1, 2, SR), 1.5, dtype=np.float32)
+    tensor = types.SimpleNamespace(cpu=lambda: types.SimpleNamespace(numpy=lambda: estimate[0]))
+    separator = UMXSeparator()
+    separator._torch = types.SimpleNamespace(as_tensor=lambda audio: audio)
+    separator._predict = types.SimpleNamespace(separate=lambda audio, rate, separator: {target: [tensor] for target in TARGETS})
+    separator._model = types.SimpleNamespace(sample_rate=SR)
+
+    separator.separate(mixture_path, str(tmp_path / 'UMX'))
+    for path in separator.output_paths(str(tmp_path / 'UMX')):
+        assert sf.info(path).subtype == 'PCM_16'
+        assert np.all(sf.read(path)[0] > 0.99)
@@ -0,0 +1,85 @@
+import os
+import time
+import multiprocessing
+
+from work_queue import LeaseQueue, task_id
+
+N_WORKERS = 4
+
+
+def run_worker(directory, tasks, lease_seconds):
+    # One node: claim tasks until none is left unfinished, recording every run of a task
+    work_queue = LeaseQueue(directory, lease_seconds=lease_seconds)
+    with work_queue.heartbeating():
+        while True:
+            for task, item in work_queue.claim_each(tasks):
+                with open(os.path.join(directory, 'runs', task), 'a') as file:
+                    file.write(f"{work_queue.node} {item}\n")
+                time.sleep(0.01)
+                work_queue.complete(task)
+            if not work_queue.unfinished(task for task, _, _ in tasks):
+                return
+            time.sleep(0.1)
+
+
+def run_workers(directory, tasks, lease_seconds):
+    os.makedirs(os.path.join(directory, 'runs'), exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=run_worker, args=(directory, tasks, lease_seconds)) for _ in range(N_WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+
+def make_tasks(count):
+    return [(task_id('test', index), index, f"task {index}") for index in range(count)]
+
+
+def assert_done_exactly_once(directory, tasks):
+    work_queue = LeaseQueue(directory)
+    for task, item, _ in tasks:
+        assert work_queue.is_done(task)
+        with open(os.path.join(directory, 'runs', task)) as file:
+            runs = file.read().splitlines()
+        assert len(runs) == 1
+        assert runs[0].endswith(f" {item}")
+    assert os.listdir(os.path.join(directory, 'leases')) == []
+
+
+def test_workers_complete_every_task_once(tmp_path):
+    tasks = make_tasks(40)
+    run_workers(str(tmp_path), tasks, lease_seconds=30)
+    assert_done_exactly_once(str(tmp_path), tasks)
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    directory = str(tmp_path)
+    first, second = LeaseQueue(directory, lease_seconds=5), LeaseQueue(directory, lease_seconds=5)
+    task = task_id('test', 0)
+    assert first.claim(task)
+    assert not second.claim(task)
+
+    # The first node stops heartbeating: once its lease is older than lease_seconds it is taken over
+    lease_path = os.path.join(directory, 'leases', task + '.lease')
+    expired = os.stat(lease_path).st_mtime - 10
+    os.utime(lease_path, (expired, expired))
+    assert second.claim(task)
+    assert first.heartbeat() == [task]
+    assert second.heartbeat() == []
+
+    second.complete(task)
+    assert first.is_done(task) and not first.claim(task)
+
+
+def test_workers_take_over_tasks_of_a_stopped_node(tmp_path):
+    directory = str(tmp_path)
+    tasks = make_tasks(12)
+    # A node claims three tasks and stops without heartbeating or completing them
+    stopped = LeaseQueue(directory, lease_seconds=1)
+    claimed = [claim for _, claim in zip(range(3), stopped.claim_each(tasks))]
+    assert len(claimed) == 3
+
+    run_workers(directory, tasks, lease_seconds=1)
+    assert_done_exactly_once(directory, tasks)
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+from contextlib import contextmanager
+
+# Default lease length; a node that stops heartbeating for this long loses its tasks
+LEASE_SECONDS = 600
+
+
+def parse_shard(text):
+    """
+    Parse a shard specification such as '2/8' (shard 2 of 8, counting from 0).
+
+    Returns:
+    tuple: (index, count).
+    """
+    index, _, count = text.partition('/')
+    index, count = int(index), int(count)
+    if not 0 <= index < count:
+        raise ValueError(f"shard index must be in [0, {count}): {text}")
+    return index, count
+
+
+def in_shard(key, shard):
+    """
+    Return True if `key` (e.g. a song name) belongs to `shard`.
+
+    The assignment only depends on the key, so every node computes the same shards
+    whatever order it lists the dataset in.
+
+    Parameters:
+    key (str): Work unit key.
+    shard (tuple): (index, count), or None for no sharding.
+    """
+    return shard is None or int(hashlib.sha1(key.encode()).hexdigest(), 16) % shard[1] == shard[0]
+
+
+def task_id(*parts):
+    """
+    Identify a task by its parts (e.g. parameter hash, song, stem and input fingerprints),
+    so a task changes identity when its inputs or parameters change.
+    """
+    return hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:24]
+
+
+class LeaseQueue:
+    """
+    Lease-based work queue on a shared directory, for nodes that join or leave mid-run.
+
+    Every node derives the same task ids from the dataset, so no task list is published.
+    A node claims a task by creating `leases/<task>.lease` with O_EXCL, which only one
+    node can win, and keeps it by touching the file from a heartbeat thread. A lease
+    whose mtime is older than `lease_seconds` is reclaimed by renaming it away (again,
+    only one node wins the rename) and claiming the task again. Finished tasks get a
+    `done/<task>` marker. Times are compared with the shared filesystem's own clock, so
+    node clocks need not agree.
+
+    A node that lost its lease may still finish the task, so a task can occasionally run
+    twice; results are keyed, so merging the stores keeps one row per key.
+
+    Parameters:
+    directory (str): Shared queue directory.
+    lease_seconds (float): Lease length; heartbeats renew every third of it.
+    node (str): Node name recorded in leases (defaults to host name and process id).
+    token (str): Claim token; a process completing tasks for another passes its token.
+    """
+
+    def __init__(self, directory, lease_seconds=LEASE_SECONDS, node=None, token=None):
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.node = node or f"{socket.gethostname()}-{os.getpid()}"
+        self.token = token or uuid.uuid4().hex
+        self.held = {}
+        self.attempted = set()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'leases'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'done'), exist_ok=True)
+
+    def _lease_path(self, task):
+        return os.path.join(self.directory, 'leases', task + '.lease')
+
+    def _done_path(self, task):
+        return os.path.join(self.directory, 'done', task)
+
+    def filesystem_time(self):
+        """
+        Return the current time as seen by the shared filesystem.
+        """
+        clock_path = os.path.join(self.directory, f'clock-{self.token}')
+        with open(clock_path, 'w'):
+            pass
+        now = os.stat(clock_path).st_mtime
+        os.remove(clock_path)
+        return now
+
+    def is_done(self, task):
+        return os.path.exists(self._done_path(task))
+
+    def claim(self, task, description='', now=None):
+        """
+        Try to take the lease of a task.
+
+        Parameters:
+        task (str): Task id.
+        description (str): Human-readable description stored in the lease.
+        now (float): Filesystem time, to reuse one `filesystem_time()` over many claims.
+
+        Returns:
+        bool: True if this node now holds the task.
+        """
+        if self.is_done(task):
+            return False
+        lease_path = self._lease_path(task)
+        if os.path.exists(lease_path) and not self._break_expired(lease_path, now):
+            return False
+        try:
+            handle = os.open(lease_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return False
+        with os.fdopen(handle, 'w') as file:
+            json.dump({'node': self.node, 'token': self.token, 'task': task, 'description': description}, file)
+        # The task may have been completed between the first check and the claim
+        if self.is_done(task):
+            self._remove_lease(task)
+            return False
+        with self._lock:
+            self.held[task] = description
+            self.attempted.add(task)
+        return True
+
+    def _break_expired(self, lease_path, now=None):
+        # Remove an expired lease; True if the lease is gone
+        try:
+            age = (now if now is not None else self.filesystem_time()) - os.stat(lease_path).st_mtime
+        except FileNotFoundError:
+            return True
+        if age < self.lease_seconds:
+            return False
+        stale_path = f"{lease_path}.{self.token}.stale"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return True
+        os.remove(stale_path)
+        return True
+
+    def _owns(self, task):
+        try:
+            with open(self._lease_path(task)) as file:
+                return json.load(file).get('token') == self.token
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def _remove_lease(self, task):
+        try:
+            os.remove(self._lease_path(task))
+        except FileNotFoundError:
+            pass
+
+    def heartbeat(self):
+        """
+        Renew the leases of all held tasks.
+
+        Returns:
+        list: Tasks whose lease was lost (reclaimed by another node or completed elsewhere).
+        """
+        lost = []
+        with self._lock:
+            tasks = list(self.held)
+        for task in tasks:
+            if self._owns(task):
+                os.utime(self._lease_path(task))
+            else:
+                lost.append(task)
+        with self._lock:
+            for task in lost:
+                self.held.pop(task, None)
+        return lost
+
+    @contextmanager
+    def heartbeating(self):
+        """
+        Renew held leases from a background thread for the duration of a block.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                self.heartbeat()
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, task):
+        """
+        Mark a task finished and drop its lease.
+        """
+        with open(self._done_path(task), 'w') as file:
+            file.write(self.node)
+        self.release(task)
+
+    def release(self, task):
+        """
+        Drop the lease of a task without completing it, so another node may take it.
+        """
+        if self._owns(task):
+            self._remove_lease(task)
+        with self._lock:
+            self.held.pop(task, None)
+
+    def claim_each(self, tasks):
+        """
+        Claim tasks lazily, one per item taken from the returned iterator.
+
+        Parameters:
+        tasks (iterable): (task id, item, description) tuples.
+
+        Yields:
+        tuple: (task id, item) for every task this node claimed; tasks done, leased by a
+        live node or already attempted by this queue are skipped.
+        """
+        now, checked = None, 0.0
+        for task, item, description in tasks:
+            if task in self.attempted or self.is_done(task):
+                continue
+            # Refresh the filesystem time now and then rather than once per claim
+            if now is None or time.monotonic() - checked > self.lease_seconds / 10:
+                now, checked = self.filesystem_time(), time.monotonic()
+            if self.claim(task, description, now=now):
+                yield task, item
+
+    def unfinished(self, tasks):
+        """
+        Return the tasks that are neither done nor attempted by this node, i.e. tasks
+        other nodes are working on.
+        """
+        return [task for task in tasks if task not in self.attempted and not self.is_done(task)]
@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import platform
+import tempfile
+import warnings
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scores'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Analysis'))
+
+from synthetic_audio import WORKLOADS, workload
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+SUITES = {
+    'quick': {'durations': [10, 60], 'sample_rates': [44100], 'fft_sizes': [2048]},
+    'full': {'durations': [10, 60, 600, 3600], 'sample_rates': [22050, 44100, 48000], 'fft_sizes': [1024, 2048, 4096]},
+}
+SCORERS = ['fis', 'dss', 'score_song', 'stream_fis', 'stream_dss', 'preview_fis', 'preview_dss', 'evaluate_job']
+
+# Longest input (seconds) each scorer is run on: the in-memory scorers hold full
+# spectrograms and BSS-eval grows quadratically, so the hour-long inputs are left to
+# the streaming scorers
+MAX_DURATION = {'fis': 600, 'dss': 600, 'score_song': 600, 'evaluate_job': 60}
+
+
+class _Stages:
+    # Collects the wall time of named stages of one run
+    def __init__(self):
+        self.seconds = {}
+
+    def __call__(self, name):
+        return _StageTimer(self.seconds, name)
+
+
+class _StageTimer:
+    def __init__(self, seconds, name):
+        self.seconds = seconds
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.seconds[self.name] = self.seconds.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+def _peak_rss_bytes():
+    # Peak resident set size of this process, or None where it cannot be measured
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except ImportError:
+        return None
+
+
+def _run_fis(case, mix, stem, files, stages):
+    from Frequency_Isolation_Score import evaluate_frequency_isolation, _fundamental_bin_indices, _harmonic_statistics
+    from spectral_features import SpectralFeatures
+    with stages('total'):
+        evaluate_frequency_isolation(mix, stem, case['sr'], fft_window_size=case['n_fft'], hop_length=case['hop_length'])
+    with stages('stft'):
+        mag_mix = SpectralFeatures(mix, case['n_fft'], case['hop_length'], 'hann').magnitude
+        mag_stem = SpectralFeatures(stem, case['n_fft'], case['hop_length'], 'hann').magnitude
+    with stages('harmonics'):
+        _harmonic_statistics(mag_mix, mag_stem, _fundamental_bin_indices(mag_stem), case['sr'], case['n_fft'])
+
+
+def _run_dss(case, mix, stem, files, stages):
+    from Dynamic_Stability_Score import evaluate_dynamic_stability
+    from spectral_features import SpectralFeatures, spectral_flux
+    with stages('total'):
+        evaluate_dynamic_stability(mix, stem, case['sr'], fft_window_size=case['n_fft'], hop_length=case['hop_length'], instrument_type='other', verbose=False)
+    features = SpectralFeatures(stem, case['n_fft'], case['hop_length'], 'hann')
+    with stages('rms'):
+        features.rms
+    with stages('stft'):
+        magnitude = features.magnitude
+    with stages('flux'):
+        spectral_flux(magnitude)
+
+
+def _run_score_song(case, mix, stem, files, stages):
+    from batch_scoring import score_song
+    # Four stems against one mix, the shape of a MUSDB song
+    stems = {name: stem * np.float32(gain) for name, gain in zip(['vocals', 'drums', 'bass', 'other'], [1.0, 0.5, 0.25, 0.125])}
+    with stages('total'):
+        score_song(mix, stems, case['sr'], fft_window_size=case['n_fft'], hop_length=case['hop_length'])
+
+
+def _run_stream_fis(case, mix, stem, files, stages):
+    from streaming_scores import stream_frequency_isolation
+    with stages('total'):
+        stream_frequency_isolation(files['mix'], files['stem'], fft_window_size=case['n_fft'], hop_length=case['hop_length'])
+
+
+def _run_stream_dss(case, mix, stem, files, stages):
+    from streaming_scores import stream_dynamic_stability
+    with stages('total'):
+        stream_dynamic_stability(files['stem'], fft_window_size=case['n_fft'], hop_length=case['hop_length'], instrument_type='other')
+
+
+def _run_preview_fis(case, mix, stem, files, stages):
+    from preview_scores import preview_frequency_isolation
+    with stages('total'):
+        preview_frequency_isolation(mix, stem, case['sr'], fft_window_size=case['n_fft'], hop_length=case['hop_length'])
+
+
+def _run_preview_dss(case, mix, stem, files, stages):
+    from preview_scores import preview_dynamic_stability
+    with stages('total'):
+        preview_dynamic_stability(mix, stem, case['sr'], fft_window_size=case['n_fft'], hop_length=case['hop_length'], instrument_type='other')
+
+
+def _run_evaluate_job(case, mix, stem, files, stages):
+    import mir_eval
+    from evaluation import evaluate_job
+    from audio_cache import decode_audio
+    job = ('Synthetic', 'other', 'Benchmark', files['stem'], files['estimate'])
+    with stages('total'):
+        evaluate_job(job)
+    with stages('decode'):
+        reference, _ = decode_audio(files['stem'])
+        estimate, _ = decode_audio(files['estimate'])
+    with stages('bss_eval'):
+        mir_eval.separation.bss_eval_sources(reference[np.newaxis], estimate[np.newaxis])
+
+
+RUNNERS = {
+    'fis': _run_fis,
+    'dss': _run_dss,
+    'score_song': _run_score_song,
+    'stream_fis': _run_stream_fis,
+    'stream_dss': _run_stream_dss,
+    'preview_fis': _run_preview_fis,
+    'preview_dss': _run_preview_dss,
+    'evaluate_job': _run_evaluate_job,
+}
+
+
+def case_id(case):
+    return f"{case['scorer']}/{case['workload']}/{case['duration']:g}s/{case['sr']}Hz/fft{case['n_fft']}"
+
+
+def build_cases(scorers, workloads, durations, sample_rates, fft_sizes):
+    """
+    List every benchmark case of a grid, leaving out inputs too long for a scorer.
+
+    Returns:
+    list: Case dicts with scorer, workload, duration, sr, n_fft and hop_length (n_fft / 4).
+    """
+    cases = []
+    for scorer in scorers:
+        for name in workloads:
+            for duration in durations:
+                if duration > MAX_DURATION.get(scorer, np.inf):
+                    continue
+                for sr in sample_rates:
+                    for n_fft in fft_sizes:
+                        cases.append({'scorer': scorer, 'workload': name, 'duration': duration, 'sr': sr, 'n_fft': n_fft, 'hop_length': n_fft // 4})
+    return cases
+
+
+def _write_inputs(workdir, case, mix, stem):
+    # The streaming scorers and the evaluation job read their inputs from files
+    if case['scorer'] not in ('stream_fis', 'stream_dss', 'evaluate_job'):
+        return {}
+    import soundfile as sf
+    os.makedirs(workdir, exist_ok=True)
+    files = {name: os.path.join(workdir, f"{name}.wav") for name in ('mix', 'stem', 'estimate')}
+    sf.write(files['mix'], mix, case['sr'], subtype='FLOAT')
+    sf.write(files['stem'], stem, case['sr'], subtype='FLOAT')
+    # An estimate with some leakage of the rest of the mix
+    sf.write(files['estimate'], stem + np.float32(0.1) * (mix - stem), case['sr'], subtype='FLOAT')
+    return files
+
+
+def _measure_case(case, repeats, result_queue):
+    # Runs in a fresh process so the peak RSS belongs to this case alone
+    warnings.filterwarnings('ignore', category=FutureWarning)
+    runner = RUNNERS[case['scorer']]
+    with tempfile.TemporaryDirectory() as workdir:
+        # Untimed run on one second of audio, so imports and first-call setup are not measured
+        warmup = dict(case, duration=1)
+        warmup_mix, warmup_stem = workload(case['workload'], 1, case['sr'])
+        runner(warmup, warmup_mix, warmup_stem, _write_inputs(os.path.join(workdir, 'warmup'), warmup, warmup_mix, warmup_stem), _Stages())
+
+        mix, stem = workload(case['workload'], case['duration'], case['sr'])
+        files = _write_inputs(workdir, case, mix, stem)
+        input_rss = _peak_rss_bytes()
+
+        runs = []
+        for _ in range(repeats):
+            stages = _Stages()
+            runner(case, mix, stem, files, stages)
+            runs.append(stages.seconds)
+
+    n_frames = 1 + len(stem) // case['hop_length']
+    wall = min(run['total'] for run in runs)
+    peak_rss = _peak_rss_bytes()
+    result_queue.put({
+        'wall_s': wall,
+        'wall_median_s': float(np.median([run['total'] for run in runs])),
+        'stages_s': {name: min(run[name] for run in runs) for name in runs[0] if name != 'total'},
+        'frames': n_frames,
+        'frames_per_s': n_frames / wall if wall > 0 else None,
+        'realtime_factor': case['duration'] / wall if wall > 0 else None,
+        'input_rss_mb': input_rss / 2 ** 20 if input_rss is not None else None,
+        'peak_rss_mb': peak_rss / 2 ** 20 if peak_rss is not None else None,
+    })
+
+
+def run_case(case, repeats=3):
+    """
+    Benchmark one case in a fresh process.
+
+    The scorer is run `repeats` times on the same deterministic input; the wall time is
+    the fastest run and the stage times are the fastest of each stage.
+
+    Parameters:
+    case (dict): A case from build_cases.
+    repeats (int): Number of timed runs.
+
+    Returns:
+    dict: Case parameters with wall_s, wall_median_s, stages_s, frames, frames_per_s,
+    realtime_factor, input_rss_mb and peak_rss_mb, or an 'error' entry.
+    """
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=_measure_case, args=(case, repeats, result_queue))
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = result_queue.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                break
+    process.join()
+    if result is None:
+        result = {'error': f"benchmark process exited with code {process.exitcode}"}
+    return dict(case, **result)
+
+
+def machine_info():
+    import librosa
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'librosa': librosa.__version__,
+    }
+
+
+def run_benchmarks(cases, repeats=3, verbose=True):
+    """
+    Run a list of cases and collect the results.
+
+    Returns:
+    dict: {'created', 'machine', 'repeats', 'results': {case id: result}}.
+    """
+    results = {}
+    for i, case in enumerate(cases):
+        result = run_case(case, repeats)
+        results[case_id(case)] = result
+        if verbose:
+            if 'error' in result:
+                print(f"[{i + 1}/{len(cases)}] {case_id(case)}: {result['error']}", flush=True)
+            else:
+                print(f"[{i + 1}/{len(cases)}] {case_id(case)}: {result['wall_s']:.3f} s, "
+                      f"{result['frames_per_s']:.0f} frames/s, peak {result['peak_rss_mb']:.0f} MB", flush=True)
+    return {'created': datetime.now().isoformat(timespec='seconds'), 'machine': machine_info(), 'repeats': repeats, 'results': results}
+
+
+def compare_results(current, baseline, threshold=0.2, metrics=('wall_s', 'peak_rss_mb')):
+    """
+    Find cases that got slower or bigger than the baseline.
+
+    Parameters:
+    current (dict): Output of run_benchmarks.
+    baseline (dict): A stored output of run_benchmarks.
+    threshold (float): Allowed relative increase, e.g. 0.2 for 20 %.
+    metrics (tuple): Result fields to compare.
+
+    Returns:
+    list: (case id, metric, baseline value, current value, ratio) for every regression.
+    """
+    regressions = []
+    for key, result in current['results'].items():
+        reference = baseline['results'].get(key)
+        if reference is None or 'error' in result or 'error' in reference:
+            continue
+        for metric in metrics:
+            old, new = reference.get(metric), result.get(metric)
+            if old and new is not None and new > old * (1 + threshold):
+                regressions.append((key, metric, old, new, new / old))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the FIS/DSS scorers on deterministic synthetic audio.")
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick', help="Predefined grid of durations, sample rates and FFT sizes")
+    parser.add_argument('--scorers', nargs='+', choices=SCORERS, default=SCORERS)
+    parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=WORKLOADS)
+    parser.add_argument('--durations', nargs='+', type=float, help="Input lengths in seconds (overrides the suite)")
+    parser.add_argument('--sample-rates', nargs='+', type=int, help="Sample rates (overrides the suite)")
+    parser.add_argument('--fft-sizes', nargs='+', type=int, help="FFT window sizes (overrides the suite)")
+    parser.add_argument('--repeats', type=int, default=3, help="Timed runs per case; the fastest is reported")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file for the results")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="Stored results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Allowed relative slowdown or memory growth")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    suite = SUITES[args.suite]
+    cases = build_cases(args.scorers, args.workloads, args.durations or suite['durations'],
+                        args.sample_rates or suite['sample_rates'], args.fft_sizes or suite['fft_sizes'])
+    results = run_benchmarks(cases, args.repeats)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not os.path.isfile(args.baseline):
+        print(f"No comparison made: no baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    compared = [key for key, result in results['results'].items()
+                if 'error' not in result and 'error' not in baseline['results'].get(key, {'error': None})]
+    if not compared:
+        print(f"No comparison made: none of these cases ran in {args.baseline}")
+        return 0
+    if baseline.get('machine') != results['machine']:
+        # Timings only compare on the same machine and library versions
+        print(f"Note: the baseline was recorded on a different machine or environment: {baseline.get('machine')}")
+    regressions = compare_results(results, baseline, args.threshold)
+    for key, metric, old, new, ratio in regressions:
+        print(f"REGRESSION {key} {metric}: {old:.3f} -> {new:.3f} ({ratio:.2f}x)")
+    print(f"{len(regressions)} regressions above {args.threshold:.0%} in {len(compared)} of {len(results['results'])} cases compared against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import zlib
+
+import numpy as np
+
+WORKLOADS = ["harmonic", "transient", "noise", "musdb"]
+
+
+def _rng(*key):
+    # Deterministic seed per workload, duration and sample rate
+    return np.random.default_rng(zlib.crc32(repr(key).encode()))
+
+
+def harmonic_tone(duration, sr, n_harmonics=8, seed=0):
+    """
+    Generate a melody of harmonic tones with a new fundamental every half second.
+
+    Parameters:
+    duration (float): Length in seconds.
+    sr (int): Sample rate.
+    n_harmonics (int): Number of partials per note.
+    seed (int): Variation of the melody.
+
+    Returns:
+    ndarray: float32 mono signal.
+    """
+    rng = _rng('harmonic', duration, sr, seed)
+    n_samples = int(duration * sr)
+    note_length = sr // 2
+    n_notes = -(-n_samples // note_length)
+    f0 = np.repeat(110.0 * 2 ** (rng.integers(0, 24, n_notes) / 12), note_length)[:n_samples]
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    signal = np.zeros(n_samples, dtype=np.float32)
+    for k in range(1, n_harmonics + 1):
+        signal += (np.sin(k * phase) / k).astype(np.float32)
+    envelope = np.tile(np.minimum(1.0, np.linspace(0, 8, note_length)), n_notes)[:n_samples]
+    signal *= envelope.astype(np.float32)
+    signal += 0.001 * rng.standard_normal(n_samples).astype(np.float32)
+    return 0.3 * signal / np.max(np.abs(signal))
+
+
+def drum_transients(duration, sr, bpm=120, seed=0):
+    """
+    Generate drum-like hits: a pitched kick sweep and decaying noise bursts on every beat.
+
+    Returns:
+    ndarray: float32 mono signal.
+    """
+    rng = _rng('transient', duration, sr, seed)
+    n_samples = int(duration * sr)
+    beat = int(sr * 60 / bpm)
+    hit_length = min(beat, int(0.25 * sr))
+    t = np.arange(hit_length) / sr
+    kick = np.sin(2 * np.pi * (150 * t - 200 * t ** 2)) * np.exp(-t * 30)
+    signal = np.zeros(n_samples, dtype=np.float32)
+    for i, start in enumerate(range(0, n_samples, beat)):
+        length = min(hit_length, n_samples - start)
+        snare = rng.standard_normal(hit_length) * np.exp(-t * 60) * (0.5 if i % 2 else 0.1)
+        signal[start:start + length] += (kick + snare)[:length].astype(np.float32)
+    return 0.3 * signal / np.max(np.abs(signal))
+
+
+def colored_noise(duration, sr, seed=0):
+    """
+    Generate pink-like noise (1/f spectrum).
+
+    Returns:
+    ndarray: float32 mono signal.
+    """
+    rng = _rng('noise', duration, sr, seed)
+    n_samples = int(duration * sr)
+    spectrum = np.fft.rfft(rng.standard_normal(n_samples))
+    spectrum /= np.sqrt(np.maximum(np.arange(len(spectrum)), 1))
+    signal = np.fft.irfft(spectrum, n_samples).astype(np.float32)
+    return 0.1 * signal / np.max(np.abs(signal))
+
+
+def musdb_like(duration, sr, stereo=True):
+    """
+    Generate a MUSDB-shaped song: four stems and their mixture.
+
+    Parameters:
+    duration (float): Length in seconds.
+    sr (int): Sample rate.
+    stereo (bool): If True, stems are (2, n_samples) with slightly different channels.
+
+    Returns:
+    tuple: (mix, stems) where stems is {'vocals', 'drums', 'bass', 'other'}.
+    """
+    stems = {
+        'vocals': harmonic_tone(duration, sr, n_harmonics=12, seed=1),
+        'drums': drum_transients(duration, sr),
+        'bass': harmonic_tone(duration, sr, n_harmonics=4, seed=2) * np.float32(0.8),
+        'other': harmonic_tone(duration, sr, seed=3) * np.float32(0.5) + colored_noise(duration, sr),
+    }
+    if stereo:
+        stems = {name: np.stack([stem, np.roll(stem, 7)]) for name, stem in stems.items()}
+    mix = sum(stems.values())
+    return mix, stems
+
+
+def workload(name, duration, sr):
+    """
+    Return a (mix, stem) pair for a named workload.
+
+    'harmonic', 'transient' and 'noise' score that signal as the stem inside a mix of all
+    three; 'musdb' scores the vocals of a MUSDB-shaped mono song.
+
+    Returns:
+    tuple: (mix, stem) float32 mono signals.
+    """
+    if name == 'musdb':
+        mix, stems = musdb_like(duration, sr, stereo=False)
+        return mix, stems['vocals']
+    signals = {
+        'harmonic': harmonic_tone(duration, sr),
+        'transient': drum_transients(duration, sr),
+        'noise': colored_noise(duration, sr),
+    }
+    return sum(signals.values()), signals[name]
@@ -1,8 +1,16 @@
 import numpy as np
-import librosa
-import matplotlib.pyplot as plt
 
-def evaluate_dynamic_stability(mix, stem, sr, fft_window_size=2048, hop_length=512, plot_spectrogram=False, instrument_type=None):
+from spectral_features import get_spectral_features, stft_shape, frames_per_block, spectral_blocks, spectral_flux, resample_audio, scale_frames, BLOCK_FRAMES
+from instrumentation import span
+
+# Working memory per time-frequency cell of a block: complex64 STFT, float32 magnitude,
+# the squared frame differences and the squared samples of the RMS frames
+DSS_BYTES_PER_CELL = 24
+
+# Stability calibration used for the published results, the default of the evaluation driver
+PUBLISHED_DSS_NORMALIZER = 3.5
+
+def evaluate_dynamic_stability(mix, stem, sr, fft_window_size=2048, hop_length=512, plot_spectrogram=False, instrument_type=None, dss_normalizer=3.0, cache=None, verbose=True, max_memory=None, analysis_sr=None, analysis_stem=None):
 
     """
     Evaluate the dynamic stability of a stem based on RMS and spectral flux.
@@ -15,27 +23,63 @@ def evaluate_dynamic_stability(mix, stem, sr, fft_window_size=2048, hop_length=5
     hop_length (int): Hop length for STFT.
     plot_spectrogram (bool): If True, plot spectrogram of the stem.
     instrument_type (str): Type of instrument ('drums', 'bass', 'other').
+    dss_normalizer (float): RMS mean/std ratio that maps to a stability score of 100.
+    cache (FeatureCache): Optional cache so STFT and RMS are shared with other scorers and calls.
+    verbose (bool): If True, print the intermediate scores.
+    max_memory (int): Working-memory budget in bytes. If given, the stem is scored in
+        float32 with its STFT computed block by block, and RMS and flux are reduced block
+        by block (bypassing the cache) when the whole spectrogram does not fit in the budget.
+    analysis_sr (int): If given, score at this sample rate: the stem is resampled (through
+        the cache), the FFT window and hop are scaled to keep their durations, and the flux
+        is rescaled to the magnitudes of the original window length.
+    analysis_stem (ndarray): The stem already resampled to `analysis_sr`, to skip the resampling.
 
     Returns:
     float: The dynamic stability score normalized between 0 and 100.
     """
     
+    # STFT magnitudes grow with the window length, so the flux of a shorter window is scaled back
+    flux_scale = None
+    if analysis_sr is not None and analysis_sr != sr:
+        stem = resample_audio(stem, sr, analysis_sr, cache) if analysis_stem is None else analysis_stem
+        analysis_window, hop_length = scale_frames(fft_window_size, hop_length, sr, analysis_sr)
+        flux_scale = (fft_window_size / analysis_window) ** 2
+        fft_window_size = analysis_window
+        sr = analysis_sr
+
+    block_frames = None
+    features_stem = None
+    flux_per_frame = None
+    if max_memory is not None:
+        stem = np.asarray(stem, dtype=np.float32)
+        n_bins, n_frames = stft_shape(len(stem), fft_window_size, hop_length)
+        frames = frames_per_block(n_bins, max_memory, DSS_BYTES_PER_CELL)
+        if frames < n_frames:
+            rms_stem, flux_per_frame = _blocked_rms_and_flux(stem, fft_window_size, hop_length, frames, n_frames)
+        block_frames = BLOCK_FRAMES
+    
     # Calculate RMS
-    rms_stem = librosa.feature.rms(y=stem, frame_length=fft_window_size, hop_length=hop_length)[0]
+    if flux_per_frame is None:
+        features_stem = get_spectral_features(stem, fft_window_size, hop_length, window='hann', cache=cache, block_frames=block_frames)
+        rms_stem = features_stem.rms
     presence_threshold = 0.1 * np.max(rms_stem)
     active_frames = rms_stem > presence_threshold  # Boolean mask for active frames
     
     # Filter RMS using active frames
     active_rms_stem = rms_stem[active_frames]
     dss = np.mean(active_rms_stem) / (np.std(active_rms_stem) + 1e-6) if len(active_rms_stem) > 0 else 0
-    dss = (dss / 3) * 100
-    print(f"Dynamic Stability Score: {dss}")
-    # Spectral Flux Calculation
-    stft_stem = librosa.stft(stem, n_fft=fft_window_size, hop_length=hop_length)
-    mag_stem = np.abs(stft_stem)
-    flux_differences = np.diff(mag_stem, axis=1) ** 2
-    flux_per_frame = np.sum(flux_differences, axis=0)
+    dss = (dss / dss_normalizer) * 100
+    if verbose:
+        print(f"Dynamic Stability Score: {dss}")
+    # Spectral Flux Calculation, reduced block by block without the full difference matrix
+    if flux_per_frame is None:
+        mag_stem = features_stem.magnitude
+        with span('dss.flux', nbytes=mag_stem.nbytes):
+            flux_per_frame = spectral_flux(mag_stem)
     
+    if flux_scale is not None:
+        flux_per_frame = flux_per_frame * np.float32(flux_scale)
+
 # Filter spectral flux using active frames
     active_flux = flux_per_frame[active_frames[1:]]  # Skip the first frame due to np.diff
     flux_max_reference = 15000
@@ -43,7 +87,8 @@ def evaluate_dynamic_stability(mix, stem, sr, fft_window_size=2048, hop_length=5
     flux_score = min(max(flux_score, 0), 30)
      
 
-    print(f"Flux Score: {flux_score}")
+    if verbose:
+        print(f"Flux Score: {flux_score}")
     # Final Scoring
     if instrument_type == 'drums':
         final_dynamic_score = dss + flux_score
@@ -55,11 +100,64 @@ def evaluate_dynamic_stability(mix, stem, sr, fft_window_size=2048, hop_length=5
     
     # Optional Plot
     if plot_spectrogram:
+        # Plotting libraries are only imported when a plot is requested; drawing from
+        # a log-frequency pyramid renders about one cell per pixel
+        import matplotlib.pyplot as plt
+        from spectrogram_pyramid import SpectrogramPyramid
+        if features_stem is None:
+            features_stem = get_spectral_features(stem, fft_window_size, hop_length, window='hann', block_frames=block_frames)
+        mag_stem = features_stem.magnitude
         plt.figure(figsize=(14, 6))
-        librosa.display.specshow(librosa.amplitude_to_db(mag_stem, ref=np.max), sr=sr, hop_length=hop_length, x_axis='time', y_axis='log')
+        image = SpectrogramPyramid.from_magnitude(mag_stem, sr, fft_window_size, hop_length).plot()
         plt.title('Stem Spectrogram')
-        plt.colorbar(format='%+2.0f dB')
+        plt.colorbar(image, format='%+2.0f dB')
         plt.tight_layout()
         plt.show()
     
-    return final_dynamic_score
\ No newline at end of file
+    return final_dynamic_score
+
+
+def _blocked_rms_and_flux(stem, fft_window_size, hop_length, block_frames, n_frames):
+    # Frame RMS and spectral flux of the whole signal from blocks of frames; only the last
+    # magnitude column of a block is kept for the flux across the block boundary
+    rms_stem = np.empty(n_frames, dtype=np.float32)
+    flux_per_frame = np.empty(n_frames - 1, dtype=np.float32)
+    previous = None
+    for start, mag_stem, block_rms in spectral_blocks(stem, fft_window_size, hop_length, 'hann', block_frames, rms=True):
+        count = mag_stem.shape[1]
+        rms_stem[start:start + count] = block_rms
+        with span('dss.flux', nbytes=mag_stem.nbytes):
+            flux = spectral_flux(mag_stem, previous)
+        flux_per_frame[max(start - 1, 0):start + count - 1] = flux
+        previous = mag_stem[:, -1].copy()
+    return rms_stem, flux_per_frame
+
+
+def dynamic_score_from_statistics(n_active, active_rms_mean, active_rms_std, active_flux_mean, instrument_type=None, dss_normalizer=3.0):
+    """
+    Combine accumulated active-frame statistics into the dynamic stability score.
+
+    Parameters:
+    n_active (int): Number of active frames.
+    active_rms_mean (float): Mean RMS of the active frames.
+    active_rms_std (float): Population standard deviation of the active-frame RMS.
+    active_flux_mean (float): Mean spectral flux of the active frames, or None if there is none.
+    instrument_type (str): Type of instrument ('drums', 'bass', 'other').
+    dss_normalizer (float): RMS mean/std ratio that maps to a stability score of 100.
+
+    Returns:
+    float: The dynamic stability score.
+    """
+    dss = active_rms_mean / (active_rms_std + 1e-6) if n_active > 0 else 0
+    dss = (dss / dss_normalizer) * 100
+    flux_max_reference = 15000
+    flux_score = (active_flux_mean / flux_max_reference) * 100 if active_flux_mean is not None else 0
+    flux_score = min(max(flux_score, 0), 30)
+
+    if instrument_type == 'drums':
+        final_dynamic_score = dss + flux_score
+    elif instrument_type == 'bass':
+        final_dynamic_score = dss
+    else:
+        final_dynamic_score = dss - flux_score
+    return max(final_dynamic_score, 0)
@@ -1,10 +1,11 @@
 import numpy as np
-import librosa
-import matplotlib.pyplot as plt
 
+from spectral_features import get_spectral_features, stft_shape, frames_per_block, spectral_blocks, resample_audio, scale_frames, BLOCK_FRAMES
+from instrumentation import span
 
 
-def evaluate_frequency_isolation(mix, stem, sr, fft_window_size=2048, hop_length=512, weight_fundamental=40.0, plot_spectrogram=False):
+
+def evaluate_frequency_isolation(mix, stem, sr, fft_window_size=2048, hop_length=512, weight_fundamental=40.0, plot_spectrogram=False, cache=None, max_memory=None, analysis_sr=None, analysis_audio=None):
     """
     Evaluate the isolation of a stem by checking the presence of its fundamental frequency and harmonics in the mix, and incorporate spectral flux for artifact detection.
     
@@ -16,48 +17,57 @@ def evaluate_frequency_isolation(mix, stem, sr, fft_window_size=2048, hop_length
     hop_length (int): Hop length for STFT. 
     weight_fundamental (float): Weight for the fundamental frequency.
     plot_spectrogram (bool): If True, plot spectrograms of mix and stem.
+    cache (FeatureCache): Optional cache so STFTs are shared with other scorers and calls.
+    max_memory (int): Working-memory budget in bytes. If given, the signals are scored in
+        float32 with STFTs computed block by block, and in blocks of frames (bypassing the
+        cache) when the whole spectrograms do not fit in the budget.
+    analysis_sr (int): If given, score at this sample rate: both signals are resampled
+        (through the cache) and the FFT window and hop are scaled to keep their durations.
+    analysis_audio (tuple): (mix, stem) already resampled to `analysis_sr`, e.g. read from an
+        audio cache, to skip the resampling.
     
     Returns:
     float: The isolation score normalized between 0 and 100.
     """
-    # Short-Time Fourier Transform for both mix and stem
-    stft_mix = librosa.stft(mix, n_fft=fft_window_size, hop_length=hop_length, window='hann')
-    stft_stem = librosa.stft(stem, n_fft=fft_window_size, hop_length=hop_length, window='hann')
-    
-    # Calculate magnitudes
-    mag_mix = np.abs(stft_mix)
-    mag_stem = np.abs(stft_stem)
+    if analysis_sr is not None and analysis_sr != sr:
+        if analysis_audio is None:
+            analysis_audio = resample_audio(mix, sr, analysis_sr, cache), resample_audio(stem, sr, analysis_sr, cache)
+        mix, stem = analysis_audio
+        fft_window_size, hop_length = scale_frames(fft_window_size, hop_length, sr, analysis_sr)
+        sr = analysis_sr
+
+    block_frames = None
+    if max_memory is not None:
+        mix = np.asarray(mix, dtype=np.float32)
+        stem = np.asarray(stem, dtype=np.float32)
+        n_bins, n_frames = stft_shape(min(len(mix), len(stem)), fft_window_size, hop_length)
+        frames = frames_per_block(n_bins, max_memory, FIS_BYTES_PER_CELL)
+        if frames < n_frames and not plot_spectrogram:
+            return _blocked_frequency_isolation(mix, stem, sr, fft_window_size, hop_length, weight_fundamental, frames, n_frames)
+        block_frames = BLOCK_FRAMES
+
+    # Short-Time Fourier Transform magnitudes for both mix and stem
+    mag_mix = get_spectral_features(mix, fft_window_size, hop_length, window='hann', cache=cache, block_frames=block_frames).magnitude
+    mag_stem = get_spectral_features(stem, fft_window_size, hop_length, window='hann', cache=cache, block_frames=block_frames).magnitude
     
     # Ensure the number of time frames matches between mix and stem
     min_frames = min(mag_mix.shape[1], mag_stem.shape[1])
     mag_mix = mag_mix[:, :min_frames]
     mag_stem = mag_stem[:, :min_frames]
     
-    # Initialize score components
-    fundamental_score = 0
-    harmonics_score = 0
-    weight_harmonics = 60.0
-    count_valid_frames = 0
-    
     # Calculate frequency presence score
-    fundamental_freq_indices = np.array([np.flatnonzero(mag_stem[:, t] > 0)[0] if len(np.flatnonzero(mag_stem[:, t] > 0)) > 0 else 0 for t in range(mag_stem.shape[1])])
-    fundamental_freq_indices = np.clip(fundamental_freq_indices, 0, mag_mix.shape[0] - 1)
+    with span('fis.harmonics', nbytes=mag_mix.nbytes + mag_stem.nbytes):
+        fundamental_freq_indices = _fundamental_bin_indices(mag_stem)
+        fundamental_present, harmonic_passes, harmonic_counts = _harmonic_statistics(mag_mix, mag_stem, fundamental_freq_indices, sr, fft_window_size)
     
-    for t, f_idx in enumerate(fundamental_freq_indices):
-        count_valid_frames += 1
-        # Check if fundamental is present in the mix
-        if mag_mix[f_idx, t] > 0:
-            fundamental_score = weight_fundamental  # Fixed 40 points if fundamental is present
-        
-        # Check all possible harmonics up to 20,000 Hz
-        harmonic_indices = [f_idx * (n + 1) for n in range(1, int(20000 / (sr / fft_window_size))) if f_idx * (n + 1) < mag_mix.shape[0]]
-        
-        for idx in harmonic_indices:
-            if mag_mix[idx, t] >= mag_stem[idx, t]:
-                harmonics_score += 1  # Add 1 if the harmonic energy in the mix is greater or equal to that in the stem
+    # Fixed 40 points if the fundamental is present in the mix in any frame
+    fundamental_score = weight_fundamental if np.any(fundamental_present) else 0
+    harmonics_score = np.sum(harmonic_passes)
+    weight_harmonics = 60.0
     
-    # Normalize harmonics score to 50 points
-    max_possible_harmonics_score = count_valid_frames * len(harmonic_indices)  # All harmonics per frame
+    # Normalize harmonics score to 60 points
+    # The normalizer uses the harmonic count of the last frame, as the original per-frame loop did
+    max_possible_harmonics_score = len(harmonic_counts) * harmonic_counts[-1] if len(harmonic_counts) > 0 else 0
     if max_possible_harmonics_score > 0:
         harmonics_score = (harmonics_score / max_possible_harmonics_score) * weight_harmonics
     
@@ -67,16 +77,148 @@ def evaluate_frequency_isolation(mix, stem, sr, fft_window_size=2048, hop_length
     
     # Plot spectrogram if needed
     if plot_spectrogram:
+        # Plotting libraries are only imported when a plot is requested; drawing from
+        # log-frequency pyramids renders about one cell per pixel
+        import matplotlib.pyplot as plt
+        from spectrogram_pyramid import SpectrogramPyramid
         plt.figure(figsize=(14, 6))
         plt.subplot(2, 1, 1)
-        librosa.display.specshow(librosa.amplitude_to_db(mag_mix, ref=np.max), sr=sr, hop_length=hop_length, x_axis='time', y_axis='log')
+        image = SpectrogramPyramid.from_magnitude(mag_mix, sr, fft_window_size, hop_length).plot()
         plt.title('Mix Spectrogram')
-        plt.colorbar(format='%+2.0f dB')
+        plt.colorbar(image, format='%+2.0f dB')
         plt.subplot(2, 1, 2)
-        librosa.display.specshow(librosa.amplitude_to_db(mag_stem, ref=np.max), sr=sr, hop_length=hop_length, x_axis='time', y_axis='log')
+        image = SpectrogramPyramid.from_magnitude(mag_stem, sr, fft_window_size, hop_length).plot()
         plt.title('Stem Spectrogram')
-        plt.colorbar(format='%+2.0f dB')
+        plt.colorbar(image, format='%+2.0f dB')
         plt.tight_layout()
         plt.show()
     
     return frequency_presence_score
+
+
+# Upper bound on the number of harmonic grid elements built at once
+HARMONIC_BLOCK_ELEMENTS = 2 ** 22
+
+# Working memory per time-frequency cell of a block: complex64 STFT and float32 magnitude
+# of mix and stem, the mix >= stem mask and the harmonic index grid
+FIS_BYTES_PER_CELL = 48
+
+
+def _blocked_frequency_isolation(mix, stem, sr, fft_window_size, hop_length, weight_fundamental, block_frames, n_frames):
+    # Accumulate the harmonic statistics over blocks of frames of both signals
+    fundamental_present = False
+    harmonic_passes = 0
+    harmonic_counts = np.zeros(0, dtype=np.int64)
+    mix_blocks = spectral_blocks(mix, fft_window_size, hop_length, 'hann', block_frames, n_frames)
+    stem_blocks = spectral_blocks(stem, fft_window_size, hop_length, 'hann', block_frames, n_frames)
+    for (_, mag_mix, _), (_, mag_stem, _) in zip(mix_blocks, stem_blocks):
+        with span('fis.harmonics', nbytes=mag_mix.nbytes + mag_stem.nbytes):
+            present, passes, harmonic_counts = _harmonic_statistics(mag_mix, mag_stem, _fundamental_bin_indices(mag_stem), sr, fft_window_size)
+        fundamental_present = fundamental_present or bool(np.any(present))
+        harmonic_passes += int(np.sum(passes))
+    last_harmonic_count = harmonic_counts[-1] if len(harmonic_counts) > 0 else 0
+    return isolation_score_from_statistics(fundamental_present, harmonic_passes, n_frames, last_harmonic_count, weight_fundamental)
+
+
+def _fundamental_bin_indices(mag_stem):
+    """
+    Find the fundamental bin of every frame as the lowest bin with non-zero stem energy.
+
+    Parameters:
+    mag_stem (ndarray): Stem magnitude spectrogram, shape (..., n_bins, n_frames).
+
+    Returns:
+    ndarray: Fundamental bin index per frame, shape (..., n_frames) (0 for silent frames).
+    """
+    # argmax over a boolean mask returns the first True bin, or 0 when the frame is silent
+    return np.argmax(mag_stem > 0, axis=-2)
+
+
+def _harmonic_statistics(mag_mix, mag_stem, fundamental_freq_indices, sr, fft_window_size, max_frequency=20000):
+    """
+    Compare the mix and the stem at every harmonic of each frame's fundamental bin.
+
+    Harmonics are the integer multiples 2, 3, ... of the fundamental bin up to `max_frequency`
+    that fall inside the spectrum. The harmonic index grid is built by broadcasting and the
+    mix >= stem check is done as one masked reduction per block of frames.
+
+    Several stems can be checked against the same mix at once by stacking them along
+    leading axes of `mag_stem`; the mix is broadcast against them, so it can also carry
+    the same leading axes (e.g. one mix channel per stem channel).
+
+    Parameters:
+    mag_mix (ndarray): Mix magnitude spectrogram, shape (..., n_bins, n_frames) broadcastable to `mag_stem`.
+    mag_stem (ndarray): Stem magnitude spectrogram, shape (..., n_bins, n_frames).
+    fundamental_freq_indices (ndarray): Fundamental bin index per frame, shape (..., n_frames).
+    sr (int): Sample rate of the audio.
+    fft_window_size (int): Size of the FFT window for STFT.
+    max_frequency (float): Highest frequency in Hz considered when generating harmonics.
+
+    Returns:
+    tuple: (fundamental_present, harmonic_passes, harmonic_counts) per frame, where
+    fundamental_present is a boolean array, harmonic_passes counts the harmonics whose mix
+    energy is greater than or equal to the stem energy and harmonic_counts is the number of
+    harmonics checked. All three have shape (..., n_frames).
+    """
+    n_bins, n_frames = mag_stem.shape[-2:]
+    batch_shape = mag_stem.shape[:-2]
+    f_idx = np.minimum(np.maximum(fundamental_freq_indices, 0), n_bins - 1)
+    max_multiple = int(max_frequency / (sr / fft_window_size))
+    multiples = np.arange(2, max_multiple + 1)
+
+    mix_at_fundamental = np.take_along_axis(np.broadcast_to(mag_mix, mag_stem.shape), f_idx[..., np.newaxis, :], axis=-2)
+    fundamental_present = mix_at_fundamental[..., 0, :] > 0
+
+    # Flatten stacked stems into one long frame axis: (n_bins, n_stems * n_frames)
+    mix_dominates = np.moveaxis(mag_mix >= mag_stem, -2, 0).reshape(n_bins, -1)
+    f_idx = f_idx.reshape(-1)
+    frames = np.arange(len(f_idx))
+
+    # Every harmonic of a DC fundamental is bin 0 itself
+    is_dc = f_idx == 0
+    harmonic_counts = np.zeros(len(frames), dtype=np.int64)
+    harmonic_counts[is_dc] = len(multiples)
+    harmonic_counts[~is_dc] = np.maximum(np.minimum(max_multiple, (n_bins - 1) // f_idx[~is_dc]) - 1, 0)
+
+    harmonic_passes = np.zeros(len(frames), dtype=np.int64)
+    harmonic_passes[is_dc] = len(multiples) * mix_dominates[0, is_dc]
+
+    pitched_frames = frames[~is_dc]
+    if len(pitched_frames) > 0 and len(multiples) > 0:
+        # Only the multiples that can land inside the spectrum for the lowest fundamental are needed
+        n_rows = max(min(len(multiples), (n_bins - 1) // int(np.min(f_idx[pitched_frames])) - 1), 0)
+        grid_multiples = multiples[:n_rows, np.newaxis]
+        block_size = max(HARMONIC_BLOCK_ELEMENTS // max(n_rows, 1), 1)
+        for start in range(0, len(pitched_frames), block_size):
+            block = pitched_frames[start:start + block_size]
+            harmonic_grid = grid_multiples * f_idx[block]
+            in_range = harmonic_grid < n_bins
+            harmonic_grid = np.where(in_range, harmonic_grid, 0)
+            passes = mix_dominates[harmonic_grid, block] & in_range
+            harmonic_passes[block] = np.sum(passes, axis=0)
+
+    output_shape = batch_shape + (n_frames,)
+    return fundamental_present, harmonic_passes.reshape(output_shape), harmonic_counts.reshape(output_shape)
+
+
+def isolation_score_from_statistics(fundamental_present, harmonic_passes, n_frames, last_harmonic_count, weight_fundamental=40.0):
+    """
+    Combine accumulated harmonic statistics into the frequency isolation score.
+
+    Parameters:
+    fundamental_present (bool): Whether the fundamental was present in the mix in any frame.
+    harmonic_passes (int): Total number of harmonics where the mix energy was >= the stem energy.
+    n_frames (int): Number of frames.
+    last_harmonic_count (int): Number of harmonics checked in the last frame.
+    weight_fundamental (float): Weight for the fundamental frequency.
+
+    Returns:
+    float: The frequency isolation score.
+    """
+    fundamental_score = weight_fundamental if fundamental_present else 0
+    harmonics_score = harmonic_passes
+    weight_harmonics = 60.0
+    max_possible_harmonics_score = n_frames * last_harmonic_count
+    if max_possible_harmonics_score > 0:
+        harmonics_score = (harmonics_score / max_possible_harmonics_score) * weight_harmonics
+    return fundamental_score + harmonics_score
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+class _NullSpan:
+    # Shared no-op span returned while profiling is disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_bytes(self, nbytes):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+_profiler = None
+_local = threading.local()
+
+
+def _context_tags():
+    return getattr(_local, 'tags', {})
+
+
+def _span_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+class _Span:
+    def __init__(self, profiler, name, nbytes, tags):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = nbytes
+        self.tags = dict(_context_tags(), **tags)
+
+    def add_bytes(self, nbytes):
+        """Add to the number of bytes processed by this span."""
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        stack = _span_stack()
+        if self.profiler.track_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak counter is reset for this span; hand the parent what it reached so far
+            if stack:
+                stack[-1].peak_memory = max(stack[-1].peak_memory, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+            self.peak_memory = current
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        stack = _span_stack()
+        stack.pop()
+        event = {'name': self.name, 'start_ns': self.start, 'duration_ns': end - self.start,
+                 'pid': os.getpid(), 'tid': threading.get_ident(), 'bytes': self.nbytes, 'tags': self.tags}
+        if self.profiler.track_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak_memory = max(self.peak_memory, peak)
+            if stack:
+                stack[-1].peak_memory = max(stack[-1].peak_memory, self.peak_memory)
+            event['allocated_bytes'] = self.peak_memory - self.start_memory
+            event['retained_bytes'] = current - self.start_memory
+        self.profiler.events.append(event)
+        return False
+
+
+class Profiler:
+    """
+    Collects timed spans of the scoring and evaluation stages.
+
+    Every span records its duration, the bytes of input it processed and, when
+    `track_allocations` is set, the peak memory allocated inside it (numpy arrays
+    included, through tracemalloc). Spans carry the tags of the enclosing `tags(...)`
+    blocks, so totals can be summed per song, stem or algorithm. Durations are inclusive:
+    a span contains the time of the spans nested in it.
+
+    Parameters:
+    track_allocations (bool): If True, trace allocations with tracemalloc (slows numpy-heavy code noticeably).
+    """
+
+    def __init__(self, track_allocations=False):
+        self.track_allocations = track_allocations
+        self.events = []
+
+    def span(self, name, nbytes=0, **tags):
+        return _Span(self, name, nbytes, tags)
+
+    def add_events(self, events):
+        """
+        Merge spans recorded by another process, e.g. a worker of the evaluation pool.
+        """
+        self.events.extend(events)
+
+    def summary(self, by=('name',), names=None):
+        """
+        Sum the spans per group.
+
+        Parameters:
+        by (tuple): Event fields or tag names to group by, e.g. ('algorithm', 'name').
+        names (tuple): Only include spans with these names, e.g. ('job',) for per-job totals.
+
+        Returns:
+        list: One dict per group with the group fields, 'count', 'seconds', 'bytes',
+        'mb_per_s' and, when allocations are tracked, 'allocated_bytes' (largest peak of a span).
+        """
+        groups = {}
+        for event in self.events:
+            if names is not None and event['name'] not in names:
+                continue
+            key = tuple(event['tags'].get(field, event.get(field)) for field in by)
+            group = groups.setdefault(key, {'count': 0, 'seconds': 0.0, 'bytes': 0, 'allocated_bytes': None})
+            group['count'] += 1
+            group['seconds'] += event['duration_ns'] / 1e9
+            group['bytes'] += event['bytes']
+            if 'allocated_bytes' in event:
+                group['allocated_bytes'] = max(group['allocated_bytes'] or 0, event['allocated_bytes'])
+        rows = []
+        for key, group in sorted(groups.items(), key=lambda item: -item[1]['seconds']):
+            row = dict(zip(by, key))
+            row.update(group)
+            row['mb_per_s'] = group['bytes'] / 2 ** 20 / group['seconds'] if group['bytes'] and group['seconds'] > 0 else None
+            rows.append(row)
+        return rows
+
+    def format_summary(self, by=('name',), names=None):
+        """
+        Return the summary as a plain-text table.
+        """
+        rows = self.summary(by, names)
+        header = list(by) + ['count', 'seconds', 'MB', 'MB/s', 'alloc MB']
+        lines = [[str(row[field]) for field in by] + [
+            str(row['count']),
+            f"{row['seconds']:.3f}",
+            f"{row['bytes'] / 2 ** 20:.1f}",
+            f"{row['mb_per_s']:.1f}" if row['mb_per_s'] is not None else '-',
+            f"{row['allocated_bytes'] / 2 ** 20:.1f}" if row['allocated_bytes'] is not None else '-',
+        ] for row in rows]
+        widths = [max(len(cell) for cell in column) for column in zip(header, *lines)]
+        return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(line, widths)) for line in [header] + lines)
+
+    def write_chrome_trace(self, path):
+        """
+        Write the spans as a Chrome trace (open in chrome://tracing or Perfetto).
+
+        Parameters:
+        path (str): Output JSON file.
+        """
+        origin = min((event['start_ns'] for event in self.events), default=0)
+        trace_events = []
+        for event in self.events:
+            args = dict(event['tags'], bytes=event['bytes'])
+            if 'allocated_bytes' in event:
+                args.update(allocated_bytes=event['allocated_bytes'], retained_bytes=event['retained_bytes'])
+            trace_events.append({'name': event['name'], 'cat': event['name'].split('.')[0], 'ph': 'X',
+                                 'ts': (event['start_ns'] - origin) / 1000, 'dur': event['duration_ns'] / 1000,
+                                 'pid': event['pid'], 'tid': event['tid'], 'args': args})
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, file)
+
+
+def span(name, nbytes=0, **tags):
+    """
+    Time a stage of the pipeline when profiling is enabled.
+
+    Usage: `with span('fis.harmonics', nbytes=mag.nbytes): ...`. While profiling is
+    disabled this returns a shared no-op context manager, so instrumented code only pays
+    for one function call.
+
+    Parameters:
+    name (str): Stage name, dotted by component ('stft', 'fis.harmonics', 'job.bss_eval').
+    nbytes (int): Bytes of input processed by the stage.
+    **tags: Extra tags such as song or algorithm.
+
+    Returns:
+    context manager: The span; `add_bytes` can be called on it inside the block.
+    """
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.span(name, nbytes, **tags)
+
+
+@contextmanager
+def tags(**values):
+    """
+    Attach tags (song, stem, algorithm, ...) to every span opened inside the block.
+    """
+    previous = _context_tags()
+    _local.tags = dict(previous, **values)
+    try:
+        yield
+    finally:
+        _local.tags = previous
+
+
+def enable(track_allocations=False, profiler=None):
+    """
+    Start recording spans in this process.
+
+    Parameters:
+    track_allocations (bool): If True, also trace memory allocations.
+    profiler (Profiler): Existing profiler to record into instead of a new one.
+
+    Returns:
+    Profiler: The active profiler.
+    """
+    global _profiler
+    _profiler = profiler if profiler is not None else Profiler(track_allocations)
+    if _profiler.track_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _profiler
+
+
+def disable():
+    """
+    Stop recording spans.
+
+    Returns:
+    Profiler: The profiler that was active, or None.
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None and profiler.track_allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return profiler
+
+
+def active_profiler():
+    """
+    Return the profiler recording in this process, or None when profiling is disabled.
+    """
+    return _profiler
+
+
+@contextmanager
+def profiling(track_allocations=False):
+    """
+    Record spans for the duration of a block: `with profiling() as profiler: ...`.
+    """
+    profiler = enable(track_allocations)
+    try:
+        yield profiler
+    finally:
+        disable()
@@ -0,0 +1,325 @@
+import time
+import threading
+from collections import deque
+
+import numpy as np
+import librosa
+
+from Frequency_Isolation_Score import _fundamental_bin_indices, _harmonic_statistics, isolation_score_from_statistics
+from Dynamic_Stability_Score import dynamic_score_from_statistics
+from spectral_features import spectral_flux
+from streaming_scores import FrameBuffer, FrameRing, _frame_rms, _frame_magnitudes
+
+
+# Per-frame statistics kept for the window, one column each. The first five are summed over
+# the active frames of the DSS (frame count, RMS, squared RMS, flux, frames with a flux), the
+# rest over all frames for the FIS (fundamental present, harmonic passes, frames with a mix)
+_N_ACTIVE_STATISTICS = 5
+_N_STATISTICS = 8
+
+
+class _RingBuffer:
+    # Fixed-size history of per-frame rows, stored in arrival order modulo the size
+    def __init__(self, size, width):
+        self.data = np.zeros((size, width))
+        self.size = size
+        self.count = 0
+
+    def extend(self, rows):
+        # Append rows and return the ones they push out of the window, or None when the new
+        # rows replace the whole window
+        if len(rows) >= self.size:
+            self.data[:] = np.roll(rows[-self.size:], self.count + len(rows), axis=0)
+            self.count += len(rows)
+            return None
+        slots = (self.count + np.arange(len(rows))) % self.size
+        evicted = self.data[slots[len(rows) - max(self.count + len(rows) - self.size, 0):]]
+        self.data[slots] = rows
+        self.count += len(rows)
+        return evicted
+
+    def window(self):
+        # Rows currently in the window, in storage order
+        return self.data[:min(self.count, self.size)]
+
+
+class OnlineQualityMonitor:
+    """
+    Rolling DSS and FIS of a stem while it is being separated.
+
+    Audio blocks are pushed as they arrive (from an audio callback or a queue). Each push
+    frames the new samples, computes per-frame RMS, spectral flux and, when the mix is
+    pushed too, the harmonic checks of the FIS, and returns the scores over the last
+    `window_seconds` of audio. Only the per-frame statistics of that window are kept, and
+    the sums the scores are made of are updated as frames enter and leave the window, so
+    the cost of a push does not grow with the window length. The active-frame sums are
+    rebuilt from the window when its maximum RMS changes, which happens about every half
+    window for steady audio.
+
+    Processing time of every push is recorded so latency percentiles and the speed
+    relative to real time can be monitored.
+
+    Parameters:
+    sr (int): Sample rate of the audio.
+    window_seconds (float): Length of the rolling window the scores are computed over.
+    fft_window_size (int): Size of the FFT window for STFT.
+    hop_length (int): Hop length for STFT.
+    instrument_type (str): Type of instrument ('drums', 'bass', 'other').
+    dss_normalizer (float): RMS mean/std ratio that maps to a stability score of 100.
+    weight_fundamental (float): Weight for the fundamental frequency.
+    latency_history (int): Number of most recent pushes kept for latency statistics.
+    max_pending_frames (int): Frames the stem may run ahead of the mix (or the mix of the
+        stem) once the mix is pushed; the blocks passed to one push must stay within it.
+    """
+
+    def __init__(self, sr, window_seconds=5.0, fft_window_size=2048, hop_length=512, instrument_type=None, dss_normalizer=3.0, weight_fundamental=40.0, latency_history=10000, max_pending_frames=1024):
+        self.sr = sr
+        self.fft_window_size = fft_window_size
+        self.hop_length = hop_length
+        self.instrument_type = instrument_type
+        self.dss_normalizer = dss_normalizer
+        self.weight_fundamental = weight_fundamental
+        self.n_frames = 0
+        self.n_samples = 0
+        self.processing_seconds = 0.0
+        self.latest = None
+
+        window_frames = max(int(round(window_seconds * sr / hop_length)), 2)
+        self._statistics = _RingBuffer(window_frames, _N_STATISTICS)
+        self._totals = np.zeros(_N_STATISTICS)
+        self._last_harmonic_count = 0
+        self._has_mix = False
+        self._finished = False
+
+        # (frame number, RMS) of the frames that can still become the window maximum
+        self._max_candidates = deque()
+        self._threshold = None
+        self._frames_since_rebuild = 0
+
+        self._stem_framer = FrameBuffer(fft_window_size, hop_length)
+        self._mix_framer = FrameBuffer(fft_window_size, hop_length)
+        self._pending_stem = FrameRing(fft_window_size, max_pending_frames)
+        self._pending_mix = FrameRing(fft_window_size, max_pending_frames)
+        self._window = librosa.filters.get_window('hann', fft_window_size, fftbins=True).astype(np.float32)
+        self._previous_magnitude = None
+        self._latencies = deque(maxlen=latency_history)
+        self._frame_latencies = deque(maxlen=latency_history)
+
+    def push(self, stem_block, mix_block=None):
+        """
+        Consume the next block of mono stem samples (and the matching mix samples for FIS).
+
+        Once the mix has been pushed, stem frames wait for the matching mix frames; a
+        ValueError is raised when either stream runs more than `max_pending_frames` ahead.
+
+        Parameters:
+        stem_block (ndarray): Stem samples.
+        mix_block (ndarray): Mix samples, or None to only track DSS.
+
+        Returns:
+        dict: Latest rolling scores (see `scores`), or None before the first complete frame.
+        """
+        if self._finished:
+            raise ValueError("samples passed after the end of the stream")
+        start = time.perf_counter()
+        self.n_samples += len(stem_block)
+        stem_frames = self._stem_framer.push(stem_block)
+        if mix_block is not None:
+            self._has_mix = True
+        if self._has_mix:
+            self._pending_stem.push(stem_frames)
+            if mix_block is not None:
+                self._pending_mix.push(self._mix_framer.push(mix_block))
+            n_frames = self._process_pending()
+        else:
+            n_frames = len(stem_frames)
+            if n_frames > 0:
+                self._process(stem_frames, None)
+        if n_frames > 0:
+            self.latest = self.scores()
+
+        elapsed = time.perf_counter() - start
+        self.processing_seconds += elapsed
+        self._latencies.append(elapsed)
+        if n_frames > 0:
+            self._frame_latencies.append(elapsed / n_frames)
+        return self.latest
+
+    def flush(self):
+        """
+        Pad the end of the stream and process the frames still buffered.
+
+        Stem frames without a matching mix frame count towards the DSS only, so with a
+        window covering the whole stream the scores equal those of
+        evaluate_dynamic_stability and evaluate_frequency_isolation. No samples can be
+        pushed afterwards.
+
+        Returns:
+        dict: Final rolling scores (see `scores`), or None if no frame was seen.
+        """
+        if self._finished:
+            return self.latest
+        start = time.perf_counter()
+        self._finished = True
+        if self._has_mix:
+            self._pending_stem.push(self._stem_framer.flush())
+            self._pending_mix.push(self._mix_framer.flush())
+            self._process_pending()
+            stem_frames = self._pending_stem.pop(len(self._pending_stem))
+            self._pending_mix.clear()
+        else:
+            stem_frames = self._stem_framer.flush()
+        if len(stem_frames) > 0:
+            self._process(stem_frames, None)
+        self.latest = self.scores()
+        self.processing_seconds += time.perf_counter() - start
+        return self.latest
+
+    def scores(self):
+        """
+        Compute the scores over the current rolling window.
+
+        Returns:
+        dict: 'time' (end of the window in seconds), 'frames' (frames in the window),
+        'dss' and 'fis' (None until the mix has been pushed).
+        """
+        if self._statistics.count == 0:
+            return None
+        n_active, rms_sum, rms_square_sum, flux_sum, n_flux, n_present, harmonic_passes, n_scored = self._totals
+        rms_mean = rms_sum / n_active if n_active > 0 else 0.0
+        rms_std = np.sqrt(max(rms_square_sum / n_active - rms_mean ** 2, 0.0)) if n_active > 0 else 0.0
+        flux_mean = flux_sum / n_flux if n_flux > 0 else None
+        dss = dynamic_score_from_statistics(int(n_active), rms_mean, rms_std, flux_mean, self.instrument_type, self.dss_normalizer)
+        fis = None
+        if self._has_mix:
+            fis = isolation_score_from_statistics(n_present > 0, int(harmonic_passes), int(n_scored),
+                                                  self._last_harmonic_count, self.weight_fundamental)
+        return {'time': self.n_frames * self.hop_length / self.sr, 'frames': len(self._statistics.window()), 'dss': dss, 'fis': fis}
+
+    def latency_percentiles(self, percentiles=(50, 90, 99, 100)):
+        """
+        Processing latency of recent pushes.
+
+        Parameters:
+        percentiles (tuple): Percentiles to report.
+
+        Returns:
+        dict: {'push_ms': {p: ms}, 'frame_ms': {p: ms}} for whole pushes and per frame.
+        """
+        result = {}
+        for name, latencies in (('push_ms', self._latencies), ('frame_ms', self._frame_latencies)):
+            values = np.array(latencies) * 1000
+            result[name] = {p: float(np.percentile(values, p)) if len(values) > 0 else np.nan for p in percentiles}
+        return result
+
+    @property
+    def realtime_factor(self):
+        """float: Seconds of audio processed per second of computation."""
+        return (self.n_samples / self.sr) / self.processing_seconds if self.processing_seconds > 0 else np.inf
+
+    def _process_pending(self):
+        # Score the stem frames that have their mix frame
+        n_frames = min(len(self._pending_stem), len(self._pending_mix))
+        if n_frames > 0:
+            self._process(self._pending_stem.pop(n_frames), self._pending_mix.pop(n_frames))
+        return n_frames
+
+    def _process(self, stem_frames, mix_frames):
+        n_frames = len(stem_frames)
+        rms = _frame_rms(stem_frames)
+        if mix_frames is None:
+            mag_stem = _frame_magnitudes(stem_frames, self._window)
+        else:
+            # One FFT call for both streams
+            magnitudes = _frame_magnitudes(np.concatenate([stem_frames, mix_frames]), self._window)
+            mag_stem, mag_mix = magnitudes[:, :n_frames], magnitudes[:, n_frames:]
+
+        # Flux of each frame against the previous one, carried across pushes
+        if self._previous_magnitude is not None:
+            flux = spectral_flux(mag_stem, previous=self._previous_magnitude[:, 0])
+        else:
+            flux = np.concatenate([[np.nan], spectral_flux(mag_stem)])
+        self._previous_magnitude = mag_stem[:, -1:]
+
+        rows = np.zeros((n_frames, _N_STATISTICS))
+        rows[:, 0] = 1
+        rows[:, 1] = rms
+        rows[:, 2] = rows[:, 1] ** 2
+        # The first frame of the stream has no flux
+        has_flux = ~np.isnan(flux)
+        rows[has_flux, 3] = flux[has_flux]
+        rows[:, 4] = has_flux
+        if mix_frames is not None:
+            fundamental_freq_indices = _fundamental_bin_indices(mag_stem)
+            fundamental_present, harmonic_passes, harmonic_counts = _harmonic_statistics(mag_mix, mag_stem, fundamental_freq_indices, self.sr, self.fft_window_size)
+            rows[:, 5] = fundamental_present
+            rows[:, 6] = harmonic_passes
+            rows[:, 7] = 1
+            self._last_harmonic_count = int(harmonic_counts[-1])
+        self._update_window(rows)
+        self.n_frames += n_frames
+
+    def _update_window(self, rows):
+        # Window maximum from a deque of decreasing RMS values, then the running totals: the
+        # rows entering the window are added and the evicted ones subtracted, and the totals
+        # are rebuilt when the active-frame threshold moves and once per window length so
+        # the rounding of the running updates cannot build up
+        first = self.n_frames
+        for index, value in enumerate(rows[:, 1].tolist(), start=first):
+            while self._max_candidates and self._max_candidates[-1][1] <= value:
+                self._max_candidates.pop()
+            self._max_candidates.append((index, value))
+        oldest = first + len(rows) - self._statistics.size
+        while self._max_candidates[0][0] < oldest:
+            self._max_candidates.popleft()
+        # Same float32 threshold as evaluate_dynamic_stability
+        threshold = 0.1 * np.float32(self._max_candidates[0][1])
+
+        evicted = self._statistics.extend(rows)
+        self._frames_since_rebuild += len(rows)
+        if evicted is None or threshold != self._threshold or self._frames_since_rebuild >= self._statistics.size:
+            self._threshold = threshold
+            self._frames_since_rebuild = 0
+            window = self._statistics.window()
+            self._totals = self._window_totals(window, np.ones(len(window)))
+        else:
+            self._totals += self._window_totals(np.concatenate([rows, evicted]), np.repeat([1.0, -1.0], [len(rows), len(evicted)]))
+
+    def _window_totals(self, rows, signs):
+        # Signed column sums of per-frame rows, the DSS columns over the frames above the threshold
+        active_signs = signs * (rows[:, 1] > self._threshold)
+        return np.concatenate([active_signs @ rows[:, :_N_ACTIVE_STATISTICS], signs @ rows[:, _N_ACTIVE_STATISTICS:]])
+
+
+def monitor_queue(block_queue, monitor, on_scores=None):
+    """
+    Feed a monitor from a queue in a background thread.
+
+    Items are stem blocks or (stem_block, mix_block) tuples; None flushes the monitor and
+    stops the thread.
+
+    Parameters:
+    block_queue (queue.Queue): Queue filled by the separator or an audio callback.
+    monitor (OnlineQualityMonitor): Monitor to feed.
+    on_scores (callable): Called with the scores dict after every push that produced frames.
+
+    Returns:
+    threading.Thread: The started consumer thread.
+    """
+    def consume():
+        while True:
+            item = block_queue.get()
+            n_frames = monitor.n_frames
+            if item is None:
+                scores = monitor.flush()
+            else:
+                stem_block, mix_block = item if isinstance(item, tuple) else (item, None)
+                scores = monitor.push(stem_block, mix_block)
+            if on_scores is not None and monitor.n_frames > n_frames:
+                on_scores(scores)
+            if item is None:
+                break
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    return thread
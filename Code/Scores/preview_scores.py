@@ -0,0 +1,271 @@
+import time
+from statistics import NormalDist
+
+import numpy as np
+import librosa
+
+from Frequency_Isolation_Score import _fundamental_bin_indices, _harmonic_statistics, isolation_score_from_statistics
+from Dynamic_Stability_Score import dynamic_score_from_statistics
+from streaming_scores import _frame_magnitudes
+
+# Number of energy strata the active frames are divided into; inactive frames form one more
+ENERGY_STRATA = 4
+
+# Frames transformed at once, bounding the memory of large samples
+MEASURE_BLOCK_FRAMES = 2048
+
+# Frames of the first round when a time budget is set, used to measure the cost per frame
+PILOT_FRAMES = 128
+
+
+def frame_rms(y, frame_length=2048, hop_length=512):
+    """
+    Frame RMS of a signal from running sums of squares.
+
+    Same framing as librosa.feature.rms (centered, zero padded) at the cost of one pass
+    over the samples instead of one per overlapping frame, so the active-frame mask is exact even when only a sample of the
+    frames is transformed.
+
+    Parameters:
+    y (ndarray): Mono signal.
+    frame_length (int): Frame length (the FFT window size).
+    hop_length (int): Hop length.
+
+    Returns:
+    ndarray: RMS per frame, shape (1 + len(y) // hop_length,).
+    """
+    return _padded_frame_rms(_pad(y, frame_length), frame_length, hop_length, 1 + len(y) // hop_length)
+
+
+def _pad(y, fft_window_size):
+    # Centered zero padding of librosa.stft and librosa.feature.rms
+    return np.pad(np.asarray(y, dtype=np.float32), fft_window_size // 2)
+
+
+def _padded_frame_rms(padded, frame_length, hop_length, n_frames):
+    if frame_length % hop_length == 0:
+        # Frames are whole numbers of hop-sized blocks: sum the block powers once, then
+        # add up k consecutive blocks per frame
+        k = frame_length // hop_length
+        blocks = padded[:(n_frames + k - 1) * hop_length]
+        blocks = np.concatenate([blocks, np.zeros((n_frames + k - 1) * hop_length - len(blocks), dtype=blocks.dtype)]).reshape(-1, hop_length)
+        cumulative = np.concatenate([[0.0], np.cumsum(np.einsum('ij,ij->i', blocks, blocks), dtype=np.float64)])
+        power = (cumulative[k:k + n_frames] - cumulative[:n_frames]) / frame_length
+    else:
+        cumulative = np.concatenate([[0.0], np.cumsum(padded.astype(np.float64) ** 2)])
+        starts = np.arange(n_frames) * hop_length
+        power = (cumulative[starts + frame_length] - cumulative[starts]) / frame_length
+    return np.sqrt(np.maximum(power, 0))
+
+
+class _StratifiedSampler:
+    # Draws frames without replacement from every stratum in proportion to its size
+    def __init__(self, strata, rng):
+        self.strata = [rng.permutation(stratum) for stratum in strata if len(stratum) > 0]
+        self.taken = [0] * len(self.strata)
+        self.total = sum(len(stratum) for stratum in self.strata)
+
+    def draw(self, n):
+        fraction = min((sum(self.taken) + n) / self.total, 1.0)
+        batch = []
+        for index, stratum in enumerate(self.strata):
+            # At least two frames per stratum, so every stratum has a variance estimate
+            target = min(len(stratum), max(int(np.ceil(fraction * len(stratum))), 2))
+            batch.append(stratum[self.taken[index]:target])
+            self.taken[index] = max(target, self.taken[index])
+        return np.concatenate(batch) if batch else np.empty(0, dtype=np.int64)
+
+    @property
+    def exhausted(self):
+        return all(taken >= len(stratum) for taken, stratum in zip(self.taken, self.strata))
+
+
+def _stratified_mean(values_by_frame, strata):
+    # Stratified estimate of the mean over all frames of the strata, with its standard error;
+    # values_by_frame holds NaN for frames that were not sampled
+    total = sum(len(stratum) for stratum in strata)
+    mean, variance = 0.0, 0.0
+    for stratum in strata:
+        values = values_by_frame[stratum]
+        values = values[~np.isnan(values)]
+        weight = len(stratum) / total
+        mean += weight * np.mean(values)
+        if len(values) > 1:
+            # Finite population correction: a fully sampled stratum contributes no error
+            variance += weight ** 2 * np.var(values, ddof=1) / len(values) * (1 - len(values) / len(stratum))
+    return mean, np.sqrt(variance)
+
+
+def _energy_strata(rms, frames, active):
+    # Inactive frames form one stratum; active frames are split into energy quantiles
+    strata = [frames[~active[frames]]]
+    active_frames = frames[active[frames]]
+    if len(active_frames) > 0:
+        edges = np.quantile(rms[active_frames], np.linspace(0, 1, ENERGY_STRATA + 1)[1:-1])
+        bins = np.searchsorted(edges, rms[active_frames], side='right')
+        strata += [active_frames[bins == b] for b in range(ENERGY_STRATA)]
+    return [stratum for stratum in strata if len(stratum) > 0]
+
+
+def _padded_frames(padded, frames, fft_window_size, hop_length):
+    # The frames librosa.stft would see at the given frame indices of a padded signal
+    return np.stack([padded[frame * hop_length:frame * hop_length + fft_window_size] for frame in frames]) if len(frames) > 0 else np.empty((0, fft_window_size), dtype=np.float32)
+
+
+def _run_adaptive(sampler, measure, estimate, sample_fraction, target_error, time_budget):
+    # Grow the sample until the interval is narrow enough, the time budget is spent or every frame is scored
+    start = time.perf_counter()
+    n_next = max(int(sample_fraction * sampler.total), 1)
+    if time_budget is not None:
+        n_next = min(n_next, PILOT_FRAMES)
+    while True:
+        batch = sampler.draw(n_next)
+        batch_start = time.perf_counter()
+        for block_start in range(0, len(batch), MEASURE_BLOCK_FRAMES):
+            measure(batch[block_start:block_start + MEASURE_BLOCK_FRAMES])
+        seconds_per_frame = (time.perf_counter() - batch_start) / max(len(batch), 1)
+        result = estimate()
+        if sampler.exhausted or (target_error is None and time_budget is None):
+            return result
+        if target_error is not None and (result['high'] - result['low']) / 2 <= target_error:
+            return result
+        if target_error is None and sum(sampler.taken) >= sample_fraction * sampler.total:
+            # A time budget alone only stops early; it never grows the sample beyond sample_fraction
+            return result
+        n_next = max(sum(sampler.taken), 1)
+        if time_budget is not None:
+            remaining = time_budget - (time.perf_counter() - start)
+            n_next = min(n_next, int(remaining / max(seconds_per_frame, 1e-9)))
+            if n_next <= 0:
+                return result
+
+
+def preview_dynamic_stability(mix, stem, sr, fft_window_size=2048, hop_length=512, instrument_type=None, dss_normalizer=3.0,
+                              sample_fraction=0.05, target_error=None, time_budget=None, confidence=0.95, seed=0):
+    """
+    Approximate Dynamic Stability Score from a stratified sample of frames.
+
+    The frame RMS, and with it the active-frame mask and the RMS part of the score, is
+    computed exactly in one cheap pass. Only the spectral flux needs an STFT; it is
+    estimated from a sample of active frames stratified by energy, which gives the
+    estimate a confidence interval.
+
+    By default `sample_fraction` of the frames is scored in one round. With `target_error`
+    (score points, half-width of the interval) the sample is doubled until the interval is
+    narrow enough. `time_budget` (seconds of sampling, after the RMS pass) starts with a
+    small pilot round and stops growing the sample before the budget would be exceeded.
+
+    Parameters:
+    mix (ndarray): The mixed audio signal (unused, as in evaluate_dynamic_stability).
+    stem (ndarray): The isolated stem audio signal.
+    sr (int): Sample rate of the audio.
+    fft_window_size (int): Size of the FFT window for STFT.
+    hop_length (int): Hop length for STFT.
+    instrument_type (str): Type of instrument ('drums', 'bass', 'other').
+    dss_normalizer (float): RMS mean/std ratio that maps to a stability score of 100.
+    sample_fraction (float): Fraction of the frames scored in the first round.
+    target_error (float): Grow the sample until the interval half-width is at most this many points.
+    time_budget (float): Seconds the sampling may take; without target_error the sample
+        grows up to sample_fraction within the budget.
+    confidence (float): Confidence level of the interval.
+    seed (int): Seed of the frame sample.
+
+    Returns:
+    dict: 'score', 'low', 'high', 'frames_scored' and 'frames_total'.
+    """
+    padded_stem = _pad(stem, fft_window_size)
+    rms = _padded_frame_rms(padded_stem, fft_window_size, hop_length, 1 + len(stem) // hop_length)
+    active = rms > 0.1 * np.max(rms)
+    active_rms = rms[active]
+    window = librosa.filters.get_window('hann', fft_window_size, fftbins=True).astype(np.float32)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    # Flux of frame t needs the spectra of frames t - 1 and t; the first frame has no flux
+    flux_frames = np.flatnonzero(active[1:]) + 1
+    strata = _energy_strata(rms, flux_frames, active)
+    sampler = _StratifiedSampler(strata, np.random.default_rng(seed))
+    flux = np.full(len(rms), np.nan)
+
+    def measure(frames):
+        magnitudes = _frame_magnitudes(_padded_frames(padded_stem, np.concatenate([frames - 1, frames]), fft_window_size, hop_length), window)
+        flux[frames] = np.sum((magnitudes[:, len(frames):] - magnitudes[:, :len(frames)]) ** 2, axis=0)
+
+    def estimate():
+        if sum(sampler.taken) == 0:
+            score = dynamic_score_from_statistics(len(active_rms), np.mean(active_rms), np.std(active_rms), None, instrument_type, dss_normalizer)
+            return {'score': score, 'low': score, 'high': score, 'frames_scored': 0, 'frames_total': len(rms)}
+        mean, error = _stratified_mean(flux, strata)
+        # The score is monotonic in the mean flux, so the interval maps through it
+        bounds = [dynamic_score_from_statistics(len(active_rms), np.mean(active_rms), np.std(active_rms), max(value, 0), instrument_type, dss_normalizer)
+                  for value in (mean - z * error, mean, mean + z * error)]
+        return {'score': bounds[1], 'low': min(bounds), 'high': max(bounds), 'frames_scored': sum(sampler.taken), 'frames_total': len(rms)}
+
+    if sampler.total == 0:
+        return estimate()
+    return _run_adaptive(sampler, measure, estimate, sample_fraction, target_error, time_budget)
+
+
+def preview_frequency_isolation(mix, stem, sr, fft_window_size=2048, hop_length=512, weight_fundamental=40.0,
+                                sample_fraction=0.05, target_error=None, time_budget=None, confidence=0.95, seed=0):
+    """
+    Approximate Frequency Isolation Score from a stratified sample of frames.
+
+    The harmonic check is run on a sample of frames stratified by stem energy (inactive
+    frames and energy quantiles of the active frames), and the total number of passing
+    harmonics is estimated with a confidence interval. The last frame, whose harmonic
+    count normalizes the score, is always computed exactly. The fundamental points are
+    awarded once any sampled frame has its fundamental in the mix; if none has, the upper
+    bound includes them.
+
+    Sampling stops as in preview_dynamic_stability.
+
+    Parameters:
+    mix (ndarray): The mixed audio signal.
+    stem (ndarray): The isolated stem audio signal.
+    sr (int): Sample rate of the audio.
+    fft_window_size (int): Size of the FFT window for STFT.
+    hop_length (int): Hop length for STFT.
+    weight_fundamental (float): Weight for the fundamental frequency.
+    sample_fraction (float): Fraction of the frames scored in the first round.
+    target_error (float): Grow the sample until the interval half-width is at most this many points.
+    time_budget (float): Seconds the sampling may take; without target_error the sample
+        grows up to sample_fraction within the budget.
+    confidence (float): Confidence level of the interval.
+    seed (int): Seed of the frame sample.
+
+    Returns:
+    dict: 'score', 'low', 'high', 'frames_scored' and 'frames_total'.
+    """
+    n_frames = min(1 + len(mix) // hop_length, 1 + len(stem) // hop_length)
+    padded_mix, padded_stem = _pad(mix, fft_window_size), _pad(stem, fft_window_size)
+    rms = _padded_frame_rms(padded_stem, fft_window_size, hop_length, n_frames)
+    active = rms > 0.1 * np.max(rms)
+    window = librosa.filters.get_window('hann', fft_window_size, fftbins=True).astype(np.float32)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    def harmonic_check(frames):
+        mag_mix = _frame_magnitudes(_padded_frames(padded_mix, frames, fft_window_size, hop_length), window)
+        mag_stem = _frame_magnitudes(_padded_frames(padded_stem, frames, fft_window_size, hop_length), window)
+        return _harmonic_statistics(mag_mix, mag_stem, _fundamental_bin_indices(mag_stem), sr, fft_window_size)
+
+    _, _, last_counts = harmonic_check(np.array([n_frames - 1]))
+    last_harmonic_count = int(last_counts[-1])
+
+    strata = _energy_strata(rms, np.arange(n_frames), active)
+    sampler = _StratifiedSampler(strata, np.random.default_rng(seed))
+    passes = np.full(n_frames, np.nan)
+    fundamental_found = [False]
+
+    def measure(frames):
+        fundamental_present, harmonic_passes, _ = harmonic_check(frames)
+        fundamental_found[0] |= bool(np.any(fundamental_present))
+        passes[frames] = harmonic_passes
+
+    def estimate():
+        mean, error = _stratified_mean(passes, strata)
+        bounds = [isolation_score_from_statistics(fundamental_found[0], max(value, 0) * n_frames, n_frames, last_harmonic_count, weight_fundamental)
+                  for value in (mean - z * error, mean, mean + z * error)]
+        high = max(bounds) if fundamental_found[0] else max(bounds) + weight_fundamental
+        return {'score': bounds[1], 'low': min(bounds), 'high': high, 'frames_scored': sum(sampler.taken), 'frames_total': n_frames}
+
+    return _run_adaptive(sampler, measure, estimate, sample_fraction, target_error, time_budget)
@@ -0,0 +1,282 @@
+import os
+import sys
+import time
+import json
+import secrets
+import argparse
+import threading
+from collections import OrderedDict
+from multiprocessing.connection import Listener, Client, AuthenticationError
+
+# Only the standard library is imported at module level, so the client starts in milliseconds;
+# the server imports numpy, librosa and the scorers once when it starts
+DEFAULT_ADDRESS = ('localhost', 47831)
+KEY_FILE = os.path.join(os.path.expanduser('~'), '.stem_sap_daemon_key')
+
+
+class ScoringDaemon:
+    """
+    Long-lived local scoring server that keeps libraries, decoded audio and STFTs warm.
+
+    Clients send requests over a multiprocessing connection (localhost TCP, or a Unix
+    socket / Windows named pipe path) authenticated with a random key written to
+    `key_file`, readable only by the current user. Every connection is served on its own
+    thread, so a client that keeps its connection open does not hold up the others; score
+    requests share the caches and are computed one at a time. Decoded files are kept in an LRU keyed by path, mtime and size, and STFT/RMS features
+    in a FeatureCache, so repeated requests for the same reference skip both.
+
+    Requests are dicts with a 'command':
+    - 'score': 'mix' and 'stem' file paths, optional 'scores' (('fis', 'dss')),
+      'instrument_type', 'dss_normalizer' (the evaluation driver's calibration by default),
+      'weight_fundamental', 'fft', 'hop' and 'analysis_sr' (resampled signals are kept
+      in the feature cache as well).
+    - 'ping': daemon status.
+    - 'shutdown': stop serving.
+    A request that fails, including one that is not a dict or cannot be unpickled, is
+    answered with {'error': message}; a client that disconnects only ends its connection.
+
+    Parameters:
+    address (tuple or str): (host, port) or a socket / pipe path.
+    key_file (str): File the authentication key is written to.
+    cache_bytes (int): Memory budget of the feature cache.
+    audio_cache_bytes (int): Memory budget of the decoded-audio LRU.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, key_file=KEY_FILE, cache_bytes=1 << 30, audio_cache_bytes=512 << 20):
+        self.address = address
+        self.key_file = key_file
+        self.cache_bytes = cache_bytes
+        self.audio_cache_bytes = audio_cache_bytes
+        self.audio = OrderedDict()
+        self.requests = 0
+        self.started = time.time()
+        self.running = False
+        self._cache_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+
+    def load(self):
+        """
+        Import the scorers and run them once on a short signal, so the first request does
+        not pay for imports, FFT planning or JIT compilation.
+        """
+        import numpy as np
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Analysis'))
+        from audio_cache import decode_audio
+        from spectral_features import FeatureCache
+        from Frequency_Isolation_Score import evaluate_frequency_isolation
+        from Dynamic_Stability_Score import evaluate_dynamic_stability, PUBLISHED_DSS_NORMALIZER
+        self._dss_normalizer = PUBLISHED_DSS_NORMALIZER
+        self._decode_audio = decode_audio
+        self._evaluate_frequency_isolation = evaluate_frequency_isolation
+        self._evaluate_dynamic_stability = evaluate_dynamic_stability
+        self.feature_cache = FeatureCache(max_bytes=self.cache_bytes)
+
+        y = np.sin(np.linspace(0, 2000 * np.pi, 22050)).astype(np.float32)
+        evaluate_frequency_isolation(y, y, 22050)
+        evaluate_dynamic_stability(y, y, 22050, verbose=False)
+
+    def serve(self):
+        """
+        Accept connections until a 'shutdown' request arrives.
+        """
+        self.load()
+        authkey = _write_key(self.key_file)
+        self.running = True
+        with Listener(self.address, authkey=authkey) as listener:
+            print(f"Scoring daemon (pid {os.getpid()}) listening on {_format_address(listener.address)}.", flush=True)
+            while self.running:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, OSError, EOFError):
+                    continue
+                if not self.running:
+                    connection.close()
+                    break
+                threading.Thread(target=self._serve_connection, args=(connection, listener.address, authkey), daemon=True).start()
+
+    def _serve_connection(self, connection, address, authkey):
+        # Answer the requests of one client until it disconnects; a client may send several
+        # requests over one connection
+        with connection:
+            while self.running:
+                try:
+                    response = self.handle(connection.recv())
+                except (EOFError, OSError):
+                    break
+                except Exception as e:
+                    # The message arrived but could not be unpickled
+                    response = {'error': f"{type(e).__name__}: {e}"}
+                try:
+                    connection.send(response)
+                except (EOFError, OSError):
+                    break
+        if not self.running:
+            # Wake the accept loop so it sees the shutdown
+            try:
+                Client(address, authkey=authkey).close()
+            except (OSError, EOFError, AuthenticationError):
+                pass
+
+    def handle(self, message):
+        """
+        Answer one request.
+
+        Returns:
+        dict: The result, or {'error': message} if the request failed.
+        """
+        with self._count_lock:
+            self.requests += 1
+        if not isinstance(message, dict):
+            return {'error': f"requests are dicts with a 'command', not {type(message).__name__}"}
+        command = message.get('command')
+        try:
+            if command == 'score':
+                with self._cache_lock:
+                    return self.score(**{key: value for key, value in message.items() if key != 'command'})
+            if command == 'ping':
+                return {'pid': os.getpid(), 'uptime': time.time() - self.started, 'requests': self.requests,
+                        'cached_files': len(self.audio), 'cached_features': len(self.feature_cache)}
+            if command == 'shutdown':
+                self.running = False
+                return {'stopped': True}
+            return {'error': f"unknown command {command!r}"}
+        except Exception as e:
+            return {'error': f"{type(e).__name__}: {e}"}
+
+    def score(self, mix, stem, scores=('fis', 'dss'), instrument_type=None, dss_normalizer=None, weight_fundamental=40.0, fft=2048, hop=512, analysis_sr=None):
+        """
+        Score one stem file against its mix (or reference) file.
+
+        A `dss_normalizer` of None uses PUBLISHED_DSS_NORMALIZER, so the daemon scores
+        like the evaluation driver.
+
+        Returns:
+        dict: The requested 'fis' and 'dss' and the server-side 'seconds'.
+        """
+        start = time.perf_counter()
+        dss_normalizer = self._dss_normalizer if dss_normalizer is None else dss_normalizer
+        mix_audio, sr = self._load_audio(mix)
+        stem_audio, stem_sr = self._load_audio(stem)
+        if sr != stem_sr:
+            raise ValueError(f"sample rates differ: {sr} Hz and {stem_sr} Hz")
+        length = min(len(mix_audio), len(stem_audio))
+        mix_audio, stem_audio = (audio if len(audio) == length else audio[:length] for audio in (mix_audio, stem_audio))
+
+        result = {}
+        if 'fis' in scores:
+            result['fis'] = float(self._evaluate_frequency_isolation(mix_audio, stem_audio, sr, fft_window_size=fft, hop_length=hop, weight_fundamental=weight_fundamental, cache=self.feature_cache, analysis_sr=analysis_sr))
+        if 'dss' in scores:
+            result['dss'] = float(self._evaluate_dynamic_stability(mix_audio, stem_audio, sr, fft_window_size=fft, hop_length=hop, instrument_type=instrument_type, dss_normalizer=dss_normalizer, cache=self.feature_cache, verbose=False, analysis_sr=analysis_sr))
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    def _load_audio(self, path):
+        # Decoded mono audio from the LRU, decoded again when the file changed
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        if key in self.audio:
+            self.audio.move_to_end(key)
+            return self.audio[key]
+        entry = self._decode_audio(path, mono=True)
+        # Read-only, so the feature cache hashes each file's audio once
+        entry[0].flags.writeable = False
+        self.audio[key] = entry
+        total = sum(audio.nbytes for audio, _ in self.audio.values())
+        while total > self.audio_cache_bytes and len(self.audio) > 1:
+            total -= self.audio.popitem(last=False)[1][0].nbytes
+        return entry
+
+
+def _write_key(key_file):
+    # Fresh random key, readable by the current user only
+    authkey = secrets.token_bytes(32)
+    handle = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(handle, 'wb') as file:
+        file.write(authkey)
+    return authkey
+
+
+def _format_address(address):
+    return f"{address[0]}:{address[1]}" if isinstance(address, tuple) else address
+
+
+def parse_address(text):
+    """
+    Parse 'host:port' into a TCP address; anything else is a Unix socket or pipe path.
+    """
+    host, _, port = text.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return text
+
+
+def request(message, address=DEFAULT_ADDRESS, key_file=KEY_FILE):
+    """
+    Send one request to a running daemon.
+
+    Parameters:
+    message (dict): Request, e.g. {'command': 'score', 'mix': 'mix.wav', 'stem': 'vocals.wav'}.
+    address (tuple or str): Daemon address.
+    key_file (str): Authentication key written by the daemon.
+
+    Returns:
+    dict: The daemon's response.
+    """
+    with open(key_file, 'rb') as file:
+        authkey = file.read()
+    with Client(address, authkey=authkey) as connection:
+        connection.send(message)
+        return connection.recv()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warm FIS/DSS scoring daemon and its client.")
+    parser.add_argument('--address', default=_format_address(DEFAULT_ADDRESS), help="host:port, or a Unix socket / named pipe path")
+    parser.add_argument('--key-file', default=KEY_FILE, help="Authentication key written by the daemon")
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help="Run the daemon in the foreground")
+    serve.add_argument('--cache-mb', type=int, default=1024, help="Memory budget of the STFT feature cache")
+    serve.add_argument('--audio-cache-mb', type=int, default=512, help="Memory budget of the decoded-audio cache")
+    score = commands.add_parser('score', help="Score a stem file against its mix or reference file")
+    score.add_argument('mix')
+    score.add_argument('stem')
+    score.add_argument('--scores', nargs='+', choices=['fis', 'dss'], default=['fis', 'dss'])
+    score.add_argument('--instrument-type', default=None, help="Stem name, e.g. bass or drums, for the DSS")
+    score.add_argument('--dss-normalizer', type=float, default=None, help="DSS stability calibration (default: the evaluation driver's)")
+    score.add_argument('--weight-fundamental', type=float, default=40.0)
+    score.add_argument('--fft', type=int, default=2048)
+    score.add_argument('--hop', type=int, default=512)
+    score.add_argument('--analysis-sr', type=int, default=None, help="Sample rate to score at (default: native rate)")
+    score.add_argument('--json', action='store_true', help="Print the response as JSON")
+    commands.add_parser('ping', help="Show the daemon status")
+    commands.add_parser('stop', help="Stop the daemon")
+    args = parser.parse_args(argv)
+    address = parse_address(args.address)
+
+    if args.command == 'serve':
+        ScoringDaemon(address, args.key_file, cache_bytes=args.cache_mb << 20, audio_cache_bytes=args.audio_cache_mb << 20).serve()
+        return
+
+    if args.command == 'score':
+        message = {'command': 'score', 'mix': os.path.abspath(args.mix), 'stem': os.path.abspath(args.stem), 'scores': args.scores,
+                   'instrument_type': args.instrument_type, 'dss_normalizer': args.dss_normalizer,
+                   'weight_fundamental': args.weight_fundamental, 'fft': args.fft, 'hop': args.hop, 'analysis_sr': args.analysis_sr}
+    else:
+        message = {'command': 'shutdown' if args.command == 'stop' else 'ping'}
+    try:
+        response = request(message, address, args.key_file)
+    except (OSError, EOFError, AuthenticationError) as e:
+        sys.exit(f"No scoring daemon at {args.address} ({e}); start one with `python scoring_daemon.py serve`.")
+
+    if 'error' in response:
+        sys.exit(f"Error: {response['error']}")
+    if args.command != 'score' or args.json:
+        print(json.dumps(response, indent=None if args.command == 'score' else 2))
+        return
+    for name in args.scores:
+        print(f"{name.upper()}: {response[name]:.4f}")
+    print(f"({response['seconds'] * 1000:.0f} ms in the daemon)")
+
+
+if __name__ == '__main__':
+    main()
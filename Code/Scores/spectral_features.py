@@ -0,0 +1,411 @@
+import math
+import weakref
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import librosa
+
+from instrumentation import span
+
+
+def audio_content_hash(y):
+    """
+    Hash the content of an audio array.
+
+    Parameters:
+    y (ndarray): Audio signal.
+
+    Returns:
+    str: Hex digest identifying the samples, dtype and shape of the signal.
+    """
+    y = np.ascontiguousarray(y)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((y.dtype.str, y.shape)).encode())
+    digest.update(y.view(np.uint8).reshape(-1))
+    return digest.hexdigest()
+
+
+class SpectralFeatures:
+    """
+    STFT magnitude and frame RMS of one signal, each computed at most once.
+
+    Both features are computed lazily on first access. The signal itself is released
+    once both features exist, so a cached entry only holds the derived arrays; until
+    then it is counted in `nbytes`.
+    The returned arrays are read-only because they are shared between scorers.
+
+    With `block_frames`, both features are computed `block_frames` frames at a time into
+    float32 arrays, so neither the complex STFT nor the framed signal ever exists whole.
+    """
+
+    def __init__(self, y, n_fft=2048, hop_length=512, window='hann', block_frames=None):
+        self.y = y
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.window = window
+        self.block_frames = block_frames
+        self._magnitude = None
+        self._rms = None
+
+    @property
+    def magnitude(self):
+        """ndarray: STFT magnitude, shape (n_bins, n_frames)."""
+        if self._magnitude is None:
+            with span('stft', nbytes=self.y.nbytes):
+                if self.block_frames is None:
+                    self._magnitude = np.abs(librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.hop_length, window=self.window))
+                else:
+                    self._magnitude = np.empty(stft_shape(len(self.y), self.n_fft, self.hop_length), dtype=np.float32, order='F')
+                    for start, block, _ in spectral_blocks(self.y, self.n_fft, self.hop_length, self.window, self.block_frames):
+                        self._magnitude[:, start:start + block.shape[1]] = block
+            self._magnitude.flags.writeable = False
+            self._release_signal()
+        return self._magnitude
+
+    @property
+    def rms(self):
+        """ndarray: Frame RMS of the signal, shape (n_frames,)."""
+        if self._rms is None:
+            with span('rms', nbytes=self.y.nbytes):
+                if self.block_frames is None:
+                    self._rms = librosa.feature.rms(y=self.y, frame_length=self.n_fft, hop_length=self.hop_length)[0]
+                else:
+                    n_frames = stft_shape(len(self.y), self.n_fft, self.hop_length)[1]
+                    self._rms = np.empty(n_frames, dtype=np.float32)
+                    for start in range(0, n_frames, self.block_frames):
+                        count = min(self.block_frames, n_frames - start)
+                        segment = _block_samples(self.y, start, count, self.n_fft, self.hop_length)
+                        self._rms[start:start + count] = librosa.feature.rms(y=segment, frame_length=self.n_fft, hop_length=self.hop_length, center=False)[0]
+            self._rms.flags.writeable = False
+            self._release_signal()
+        return self._rms
+
+    @property
+    def nbytes(self):
+        """int: Memory held by the computed features and, until it is released, the signal."""
+        held = [self._magnitude, self._rms, self.y]
+        return sum(a.nbytes for a in held if a is not None)
+
+    def _release_signal(self):
+        if self._magnitude is not None and self._rms is not None:
+            self.y = None
+
+
+class FeatureCache:
+    """
+    LRU cache of SpectralFeatures keyed by audio content hash and (n_fft, hop_length, window).
+
+    The memory bound is enforced on every lookup against the features computed so far
+    (and the signals held to compute the missing ones), so the cache may briefly exceed
+    `max_bytes` by the features of the entry in use.
+
+    Read-only signals are hashed once: their digest is remembered for as long as the
+    array object lives, so passing the same array to several scorers or for several
+    estimates costs one hash. Writeable signals are hashed on every lookup, since they
+    may have been modified in place.
+    """
+
+    def __init__(self, max_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._resampled = OrderedDict()
+        self._hashes = {}
+
+    def get(self, y, n_fft=2048, hop_length=512, window='hann', block_frames=None):
+        """
+        Return the features of a signal, reusing a cached entry when the same content was seen before.
+
+        Parameters:
+        y (ndarray): Audio signal.
+        n_fft (int): Size of the FFT window for STFT and RMS frames.
+        hop_length (int): Hop length for STFT and RMS frames.
+        window (str): Window function for STFT.
+        block_frames (int): Compute a new entry's magnitude this many frames at a time.
+
+        Returns:
+        SpectralFeatures: Features of the signal.
+        """
+        key = (self.content_hash(y), n_fft, hop_length, window)
+        features = self._entries.get(key)
+        if features is None:
+            self.misses += 1
+            features = SpectralFeatures(y, n_fft=n_fft, hop_length=hop_length, window=window, block_frames=block_frames)
+            self._entries[key] = features
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        self._evict(keep=key)
+        return features
+
+    def resampled(self, y, orig_sr, target_sr):
+        """
+        Return a signal resampled to `target_sr`, resampling each content only once.
+
+        Parameters:
+        y (ndarray): Audio signal.
+        orig_sr (int): Sample rate of `y`.
+        target_sr (int): Sample rate to resample to.
+
+        Returns:
+        ndarray: Read-only resampled signal.
+        """
+        key = (self.content_hash(y), orig_sr, target_sr)
+        resampled = self._resampled.get(key)
+        if resampled is None:
+            resampled = _resample_poly(y, orig_sr, target_sr)
+            resampled.flags.writeable = False
+            self._resampled[key] = resampled
+            self._evict(keep=key)
+        else:
+            self._resampled.move_to_end(key)
+        return resampled
+
+    def content_hash(self, y):
+        """
+        Return audio_content_hash(y), reusing the digest of a read-only array seen before.
+        """
+        if not isinstance(y, np.ndarray) or y.flags.writeable:
+            return audio_content_hash(y)
+        entry = self._hashes.get(id(y))
+        # The weak reference tells a live array from a new one that reused its id
+        if entry is not None and entry[0]() is y:
+            return entry[1]
+        digest = audio_content_hash(y)
+        self._hashes[id(y)] = (weakref.ref(y, lambda _, key=id(y): self._hashes.pop(key, None)), digest)
+        return digest
+
+    @property
+    def nbytes(self):
+        """int: Memory held by all cached features and resampled signals."""
+        return sum(features.nbytes for features in self._entries.values()) + sum(y.nbytes for y in self._resampled.values())
+
+    def clear(self):
+        self._entries.clear()
+        self._resampled.clear()
+        self._hashes.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, keep):
+        # Resampled signals go first: features derived from them are cached anyway
+        total = self.nbytes
+        for key in list(self._resampled):
+            if total <= self.max_bytes:
+                return
+            if key != keep:
+                total -= self._resampled.pop(key).nbytes
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._entries.pop(key).nbytes
+
+
+def get_spectral_features(y, n_fft=2048, hop_length=512, window='hann', cache=None, block_frames=None):
+    """
+    Return the spectral features of a signal, through `cache` when one is given.
+
+    Parameters:
+    y (ndarray): Audio signal.
+    n_fft (int): Size of the FFT window for STFT and RMS frames.
+    hop_length (int): Hop length for STFT and RMS frames.
+    window (str): Window function for STFT.
+    cache (FeatureCache): Optional cache shared between scorers.
+    block_frames (int): Compute the magnitude this many frames at a time (low-memory mode).
+
+    Returns:
+    SpectralFeatures: Features of the signal.
+    """
+    if cache is None:
+        return SpectralFeatures(y, n_fft=n_fft, hop_length=hop_length, window=window, block_frames=block_frames)
+    return cache.get(y, n_fft=n_fft, hop_length=hop_length, window=window, block_frames=block_frames)
+
+
+# Frames per block in low-memory mode when the budget allows the whole magnitude in memory
+BLOCK_FRAMES = 256
+
+
+def stft_shape(n_samples, n_fft=2048, hop_length=512):
+    """
+    Return the (n_bins, n_frames) shape of the centred STFT of a signal.
+    """
+    return 1 + n_fft // 2, 1 + n_samples // hop_length
+
+
+def frames_per_block(n_bins, max_memory, bytes_per_cell):
+    """
+    Return how many STFT frames can be processed at once within a memory budget.
+
+    Parameters:
+    n_bins (int): Frequency bins per frame.
+    max_memory (int): Memory budget in bytes.
+    bytes_per_cell (int): Working memory per time-frequency cell of the caller.
+
+    Returns:
+    int: Frames per block, at least 1.
+    """
+    return max(int(max_memory // (n_bins * bytes_per_cell)), 1)
+
+
+def spectral_blocks(y, n_fft=2048, hop_length=512, window='hann', block_frames=BLOCK_FRAMES, n_frames=None, rms=False):
+    """
+    Compute the STFT magnitude (and frame RMS) of a signal one block of frames at a time.
+
+    The frames are the ones SpectralFeatures computes on the whole signal (centred and zero
+    padded), and each block is transformed from the samples it covers only. The complex64
+    STFT and the float32 magnitude of a block are written into buffers reused for every
+    block, so a yielded magnitude is only valid until the next block is taken.
+
+    Parameters:
+    y (ndarray): Mono audio signal.
+    n_fft (int): Size of the FFT window for STFT and RMS frames.
+    hop_length (int): Hop length for STFT and RMS frames.
+    window (str): Window function for STFT.
+    block_frames (int): Frames per block.
+    n_frames (int): Stop after this many frames (None for all).
+    rms (bool): If True, also compute the RMS of the frames.
+
+    Yields:
+    tuple: (first frame, magnitude of shape (n_bins, n), RMS of shape (n,) or None).
+    """
+    y = np.asarray(y, dtype=np.float32)
+    n_bins, total_frames = stft_shape(len(y), n_fft, hop_length)
+    n_frames = total_frames if n_frames is None else min(n_frames, total_frames)
+    block_frames = max(min(block_frames, n_frames), 1)
+    stft_buffer = np.empty((n_bins, block_frames), dtype=np.complex64, order='F')
+    magnitude_buffer = np.empty((n_bins, block_frames), dtype=np.float32, order='F')
+    for start in range(0, n_frames, block_frames):
+        count = min(block_frames, n_frames - start)
+        segment = _block_samples(y, start, count, n_fft, hop_length)
+        stft = librosa.stft(segment, n_fft=n_fft, hop_length=hop_length, window=window, center=False, out=stft_buffer)
+        magnitude = np.abs(stft, out=magnitude_buffer[:, :count])
+        block_rms = librosa.feature.rms(y=segment, frame_length=n_fft, hop_length=hop_length, center=False)[0] if rms else None
+        yield start, magnitude, block_rms
+
+
+def _block_samples(y, start, count, n_fft, hop_length):
+    # Samples under frames [start, start + count) of the centred STFT, zero padded at the edges
+    begin = start * hop_length - n_fft // 2
+    segment = np.zeros((count - 1) * hop_length + n_fft, dtype=np.float32)
+    low, high = max(begin, 0), min(begin + len(segment), len(y))
+    if high > low:
+        segment[low - begin:high - begin] = y[low:high]
+    return segment
+
+
+def spectral_flux(magnitude, previous=None, block_frames=BLOCK_FRAMES):
+    """
+    Sum the squared magnitude differences between consecutive frames, one block of frames
+    at a time, instead of building the whole difference matrix.
+
+    Parameters:
+    magnitude (ndarray): Magnitude spectrogram, shape (n_bins, n_frames).
+    previous (ndarray): Magnitude of the frame before the first one, shape (n_bins,), or None.
+    block_frames (int): Frames differenced at once.
+
+    Returns:
+    ndarray: Flux per frame transition, shape (n_frames - 1,), or (n_frames,) with `previous`.
+    """
+    n_frames = magnitude.shape[1]
+    flux = np.empty(max(n_frames - 1, 0), dtype=magnitude.dtype)
+    for start in range(0, n_frames - 1, block_frames):
+        stop = min(start + block_frames, n_frames - 1)
+        difference = np.subtract(magnitude[:, start + 1:stop + 1], magnitude[:, start:stop])
+        np.square(difference, out=difference)
+        np.sum(difference, axis=0, out=flux[start:stop])
+    if previous is None:
+        return flux
+    first = np.subtract(magnitude[:, 0], previous)
+    np.square(first, out=first)
+    return np.concatenate([[np.sum(first)], flux]).astype(magnitude.dtype, copy=False)
+
+
+# Analysis rates per score and stem type for analysis_sr='auto'; stems not listed are
+# scored at their native rate. Chosen with Code/Analysis/analysis_rate_report.py on
+# 44.1 kHz material (95th-percentile drift under one score point). The drums DSS stays
+# native: its spectral flux comes largely from the top octave.
+STEM_ANALYSIS_SR = {
+    'fis': {'vocals': 22050, 'drums': 22050, 'bass': 22050, 'other': 22050},
+    'dss': {'vocals': 22050, 'bass': 11025, 'other': 22050},
+}
+
+
+def analysis_rate(score, stem, analysis_sr):
+    """
+    Resolve the analysis sample rate of one score of one stem.
+
+    Parameters:
+    score (str): 'fis' or 'dss'.
+    stem (str): Stem type, e.g. 'bass'.
+    analysis_sr (int or str): A rate in Hz, 'auto' for STEM_ANALYSIS_SR, or None for the native rate.
+
+    Returns:
+    int: Analysis rate in Hz, or None for the native rate.
+    """
+    if analysis_sr == 'auto':
+        return STEM_ANALYSIS_SR[score].get(stem)
+    return analysis_sr
+
+
+def resample_audio(y, orig_sr, target_sr, cache=None):
+    """
+    Resample a signal with a polyphase filter, through `cache` when one is given.
+
+    Parameters:
+    y (ndarray): Audio signal, samples on the last axis.
+    orig_sr (int): Sample rate of `y`.
+    target_sr (int): Sample rate to resample to.
+    cache (FeatureCache): Optional cache, so a reference shared by several estimates is
+        resampled once.
+
+    Returns:
+    ndarray: float32 signal at `target_sr` (`y` itself when the rates are equal).
+    """
+    if orig_sr == target_sr:
+        return y
+    if cache is not None:
+        return cache.resampled(y, orig_sr, target_sr)
+    return _resample_poly(y, orig_sr, target_sr)
+
+
+def _resample_poly(y, orig_sr, target_sr):
+    # scipy is imported here: only resampled scoring needs it
+    from scipy.signal import resample_poly
+    divisor = math.gcd(int(orig_sr), int(target_sr))
+    return resample_poly(np.asarray(y, dtype=np.float32), int(target_sr) // divisor, int(orig_sr) // divisor, axis=-1).astype(np.float32, copy=False)
+
+
+def scale_frames(n_fft, hop_length, orig_sr, target_sr):
+    """
+    Scale an FFT window and hop to another sample rate, keeping their durations in seconds.
+
+    The window is rounded to the nearest even length with no prime factor above 5, so
+    rates such as 32 kHz do not end up with a slow prime-sized FFT.
+
+    Returns:
+    tuple: (n_fft, hop_length) at `target_sr`.
+    """
+    ratio = target_sr / orig_sr
+    return _fast_fft_size(n_fft * ratio), max(int(round(hop_length * ratio)), 1)
+
+
+def _fast_fft_size(length):
+    # Even 5-smooth size closest to `length` (ties go to the larger size)
+    best = 2
+    power2 = 2
+    while power2 <= 2 * length:
+        power3 = power2
+        while power3 <= 2 * length:
+            size = power3
+            while size <= 2 * length:
+                if abs(size - length) < abs(best - length) or (abs(size - length) == abs(best - length) and size > best):
+                    best = size
+                size *= 5
+            power3 *= 3
+        power2 *= 2
+    return best
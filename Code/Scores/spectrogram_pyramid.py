@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+
+import numpy as np
+
+from spectral_features import spectral_blocks
+
+# Levels stop shrinking at this many frames / bands
+MIN_FRAMES = 256
+MIN_BANDS = 64
+# Same floor as librosa.amplitude_to_db (amin=1e-5 on amplitude) and its default top_db
+POWER_FLOOR = 1e-10
+TOP_DB = 80.0
+
+
+class SpectrogramPyramid:
+    """
+    dB spectrogram on log-spaced frequency bands, stored at several resolutions for plotting.
+
+    Level 0 holds the mean power of every STFT frame in `n_bands` bands spaced
+    logarithmically from `fmin` to Nyquist. Each further level averages 2 x 2 cells of
+    the previous one (time only, once the bands are down to MIN_BANDS) until it is
+    MIN_FRAMES frames long. Levels are stored as float16 dB relative to the loudest cell
+    and clipped at -TOP_DB, like librosa.amplitude_to_db(ref=np.max). A plot only draws
+    the coarsest level that still has a column per pixel, so redraws take milliseconds
+    whatever the length of the recording.
+
+    Parameters:
+    levels (list): dB arrays of shape (bands, frames), finest first.
+    sr (int): Sample rate of the audio.
+    hop_length (int): Hop length of the level-0 frames.
+    fmin (float): Lower edge of the lowest band in Hz.
+    """
+
+    def __init__(self, levels, sr, hop_length, fmin=20.0):
+        self.levels = levels
+        self.sr = sr
+        self.hop_length = hop_length
+        self.fmin = fmin
+
+    @classmethod
+    def from_audio(cls, y, sr, n_fft=8192, hop_length=2048, n_bands=512, fmin=20.0, block_frames=256):
+        """
+        Build the pyramid of a mono signal, computing the STFT block by block.
+
+        Parameters:
+        y (ndarray): Mono audio signal.
+        sr (int): Sample rate of the audio.
+        n_fft (int): Size of the FFT window.
+        hop_length (int): Hop length of the level-0 frames.
+        n_bands (int): Number of log-frequency bands of level 0.
+        fmin (float): Lower edge of the lowest band in Hz.
+        block_frames (int): STFT frames computed at once.
+
+        Returns:
+        SpectrogramPyramid: The pyramid.
+        """
+        low, high = _band_bins(sr, n_fft, n_bands, fmin)
+        blocks = [_band_power(magnitude, low, high) for _, magnitude, _ in spectral_blocks(y, n_fft, hop_length, 'hann', block_frames)]
+        return cls(_build_levels(np.concatenate(blocks, axis=1)), sr, hop_length, fmin)
+
+    @classmethod
+    def from_magnitude(cls, magnitude, sr, n_fft, hop_length, n_bands=512, fmin=20.0):
+        """
+        Build the pyramid of an STFT magnitude already in memory, e.g. in a scorer's plot.
+        """
+        low, high = _band_bins(sr, n_fft, n_bands, fmin)
+        return cls(_build_levels(_band_power(magnitude, low, high)), sr, hop_length, fmin)
+
+    @property
+    def duration(self):
+        """float: Length of the level-0 frames in seconds."""
+        return self.levels[0].shape[1] * self.hop_length / self.sr
+
+    def save(self, path):
+        """
+        Write the pyramid to an .npz file.
+        """
+        meta = {'sr': self.sr, 'hop_length': self.hop_length, 'fmin': self.fmin, 'levels': len(self.levels)}
+        arrays = {f'level_{i}': level for i, level in enumerate(self.levels)}
+        with open(path, 'wb') as file:
+            np.savez(file, meta=np.array(json.dumps(meta)), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a pyramid written by `save`.
+        """
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            levels = [data[f'level_{i}'] for i in range(meta['levels'])]
+        return cls(levels, meta['sr'], meta['hop_length'], meta['fmin'])
+
+    def level_for(self, start, end, width, height=None):
+        """
+        Pick the coarsest level with at least one column per pixel over a time range.
+
+        Parameters:
+        start (float): Start of the range in seconds.
+        end (float): End of the range in seconds.
+        width (int): Width of the plot in pixels.
+        height (int): Height of the plot in pixels, to also keep one band per pixel.
+
+        Returns:
+        int: Level index (0 when even level 0 is coarser than the pixels).
+        """
+        frame_seconds = self.hop_length / self.sr
+        for level in range(len(self.levels) - 1, 0, -1):
+            bands, frames = self.levels[level].shape
+            columns = (end - start) / (frame_seconds * (self.levels[0].shape[1] / frames))
+            if columns >= width and (height is None or bands >= height):
+                return level
+        return 0
+
+    def view(self, start=None, end=None, width=2000, height=None):
+        """
+        Return the cells of the chosen level covering a time range.
+
+        Returns:
+        tuple: (dB array of shape (bands, columns), (first time, last time) of its column edges in seconds).
+        """
+        start = 0.0 if start is None else max(start, 0.0)
+        end = self.duration if end is None else min(end, self.duration)
+        level = self.levels[self.level_for(start, end, width, height)]
+        column_seconds = self.duration / level.shape[1]
+        first = int(np.floor(start / column_seconds))
+        last = max(int(np.ceil(end / column_seconds)), first + 1)
+        return level[:, first:last], (first * column_seconds, last * column_seconds)
+
+    def plot(self, ax=None, start=None, end=None, cmap='magma', follow=True):
+        """
+        Draw the spectrogram on a log-frequency axis.
+
+        Parameters:
+        ax (matplotlib.axes.Axes): Axes to draw on (defaults to the current axes).
+        start (float): Start of the time range in seconds (defaults to 0).
+        end (float): End of the time range in seconds (defaults to the whole signal).
+        cmap (str): Colour map.
+        follow (bool): If True, redraw from the matching level whenever the time axis is
+            zoomed or panned.
+
+        Returns:
+        matplotlib.image.AxesImage: The image, e.g. for plt.colorbar.
+        """
+        import matplotlib.pyplot as plt
+        from matplotlib.ticker import FuncFormatter
+        ax = ax if ax is not None else plt.gca()
+        n_bands = self.levels[0].shape[0]
+        nyquist = self.sr / 2
+
+        def pixels():
+            extent = ax.get_window_extent()
+            return max(int(extent.width), 1), max(int(extent.height), 1)
+
+        data, (first, last) = self.view(start, end, *pixels())
+        image = ax.imshow(data, aspect='auto', origin='lower', cmap=cmap, interpolation='nearest',
+                          extent=(first, last, 0, n_bands), vmin=-TOP_DB, vmax=0)
+        # Image rows are log-spaced bands; label them in Hz
+        ax.yaxis.set_major_formatter(FuncFormatter(lambda y, _: f"{self.fmin * (nyquist / self.fmin) ** (y / n_bands):.0f}"))
+        ax.set_xlim(start or 0.0, end if end is not None else self.duration)
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel('Frequency (Hz)')
+
+        if follow:
+            def redraw(axes):
+                data, (first, last) = self.view(*axes.get_xlim(), *pixels())
+                image.set_data(data)
+                image.set_extent((first, last, 0, n_bands))
+            ax.callbacks.connect('xlim_changed', redraw)
+        return image
+
+
+def _band_bins(sr, n_fft, n_bands, fmin):
+    # First and past-the-end STFT bin of every log-spaced band; a band narrower than one bin
+    # takes the bin nearest to its centre
+    edges = np.geomspace(fmin, sr / 2, n_bands + 1) * n_fft / sr
+    low = np.ceil(edges[:-1]).astype(np.int64)
+    high = np.ceil(edges[1:]).astype(np.int64)
+    empty = high <= low
+    low[empty] = np.minimum(np.round(np.sqrt(edges[:-1] * edges[1:]))[empty].astype(np.int64), n_fft // 2)
+    high[empty] = low[empty] + 1
+    high[-1] = n_fft // 2 + 1
+    return low, np.minimum(high, n_fft // 2 + 1)
+
+
+def _band_power(magnitude, low, high):
+    # Mean power of the bins of every band, from cumulative sums over the bins
+    power = np.square(magnitude, dtype=np.float64)
+    cumulative = np.zeros((power.shape[0] + 1, power.shape[1]))
+    np.cumsum(power, axis=0, out=cumulative[1:])
+    return ((cumulative[high] - cumulative[low]) / (high - low)[:, np.newaxis]).astype(np.float32)
+
+
+def _pool(power, axis):
+    # Average pairs of cells along an axis; an odd last cell is kept on its own
+    n = power.shape[axis]
+    even = np.take(power, np.arange(0, n - 1, 2), axis=axis) + np.take(power, np.arange(1, n, 2), axis=axis)
+    pooled = even / 2
+    if n % 2:
+        pooled = np.concatenate([pooled, np.take(power, [n - 1], axis=axis)], axis=axis)
+    return pooled
+
+
+def _build_levels(power):
+    # Halve time (and frequency, down to MIN_BANDS) until the level is MIN_FRAMES long,
+    # then convert every level to dB relative to the loudest level-0 cell
+    levels = [power]
+    while levels[-1].shape[1] > MIN_FRAMES:
+        level = _pool(levels[-1], axis=1)
+        if level.shape[0] > MIN_BANDS:
+            level = _pool(level, axis=0)
+        levels.append(level)
+    reference = max(float(np.max(power)), POWER_FLOOR)
+    return [np.maximum(10 * np.log10(np.maximum(level, POWER_FLOOR) / reference), -TOP_DB).astype(np.float16) for level in levels]
+
+
+def load_pyramid(path, cache_dir=None, n_fft=8192, hop_length=2048, n_bands=512, fmin=20.0):
+    """
+    Return the spectrogram pyramid of an audio file, computed once and kept in `cache_dir`.
+
+    Entries are keyed by the absolute path, mtime and size of the file and the pyramid
+    parameters, so an edited file is analysed again.
+
+    Parameters:
+    path (str): Audio file (downmixed to mono at its native sample rate).
+    cache_dir (str): Folder of cached pyramids, or None to compute without caching.
+    n_fft (int): Size of the FFT window.
+    hop_length (int): Hop length of the level-0 frames.
+    n_bands (int): Number of log-frequency bands of level 0.
+    fmin (float): Lower edge of the lowest band in Hz.
+
+    Returns:
+    SpectrogramPyramid: The pyramid.
+    """
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Analysis'))
+    from audio_cache import decode_audio
+
+    params = (n_fft, hop_length, n_bands, fmin)
+    if cache_dir is None:
+        y, sr = decode_audio(path, mono=True)
+        return SpectrogramPyramid.from_audio(y, sr, *params)
+
+    stat = os.stat(path)
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}|{params}".encode()).hexdigest()
+    pyramid_path = os.path.join(cache_dir, key + '.npz')
+    if os.path.exists(pyramid_path):
+        return SpectrogramPyramid.load(pyramid_path)
+    y, sr = decode_audio(path, mono=True)
+    pyramid = SpectrogramPyramid.from_audio(y, sr, *params)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written under a temporary name so a concurrent reader never sees a partial file
+    handle, temporary_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    os.close(handle)
+    try:
+        pyramid.save(temporary_path)
+        os.replace(temporary_path, pyramid_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    return pyramid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare spectrograms of audio files (e.g. a mix and its stems) with cached multi-resolution pyramids.")
+    parser.add_argument('files', nargs='+', help="Audio files, drawn one above the other on a shared time axis")
+    parser.add_argument('--cache', default=os.path.join(os.path.expanduser('~'), '.cache', 'stem_sap_spectrograms'), help="Folder of cached pyramids")
+    parser.add_argument('--start', type=float, default=None, help="Start of the time range in seconds")
+    parser.add_argument('--end', type=float, default=None, help="End of the time range in seconds")
+    parser.add_argument('--n-fft', type=int, default=8192)
+    parser.add_argument('--hop', type=int, default=2048)
+    parser.add_argument('--bands', type=int, default=512, help="Log-frequency bands of the finest level")
+    parser.add_argument('--save', default=None, help="Write the figure to this image file instead of showing it")
+    args = parser.parse_args(argv)
+
+    import matplotlib.pyplot as plt
+    pyramids = [load_pyramid(path, args.cache, n_fft=args.n_fft, hop_length=args.hop, n_bands=args.bands) for path in args.files]
+    figure, axes = plt.subplots(len(pyramids), 1, figsize=(14, 3 * len(pyramids)), sharex=True, squeeze=False)
+    for ax, path, pyramid in zip(axes[:, 0], args.files, pyramids):
+        image = pyramid.plot(ax, start=args.start, end=args.end)
+        ax.set_title(path)
+        figure.colorbar(image, ax=ax, format='%+2.0f dB')
+    figure.tight_layout()
+    if args.save:
+        figure.savefig(args.save)
+    else:
+        plt.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,441 @@
+import numpy as np
+import librosa
+import soundfile as sf
+
+from Frequency_Isolation_Score import _fundamental_bin_indices, _harmonic_statistics, isolation_score_from_statistics
+from Dynamic_Stability_Score import dynamic_score_from_statistics
+from spectral_features import spectral_flux
+
+
+class FrameBuffer:
+    """
+    Cut a stream of sample blocks into overlapping frames.
+
+    Framing matches librosa's center=True with zero padding, so the frames of a stream
+    are exactly the frames librosa.stft and librosa.feature.rms see on the whole signal.
+    Only the samples of one partial frame are kept between blocks.
+    """
+
+    def __init__(self, frame_length, hop_length):
+        self.frame_length = frame_length
+        self.hop_length = hop_length
+        self.n_samples = 0
+        self._buffer = np.zeros(frame_length // 2, dtype=np.float32)
+
+    def push(self, block):
+        """
+        Add samples and return every frame that is now complete.
+
+        Parameters:
+        block (ndarray): Mono samples.
+
+        Returns:
+        ndarray: Complete frames, shape (n_frames, frame_length).
+        """
+        self.n_samples += len(block)
+        self._buffer = np.concatenate([self._buffer, np.asarray(block, dtype=np.float32)])
+        if len(self._buffer) < self.frame_length:
+            return np.empty((0, self.frame_length), dtype=np.float32)
+        n_frames = (len(self._buffer) - self.frame_length) // self.hop_length + 1
+        itemsize = self._buffer.itemsize
+        frames = np.lib.stride_tricks.as_strided(self._buffer, (n_frames, self.frame_length), (self.hop_length * itemsize, itemsize)).copy()
+        self._buffer = self._buffer[n_frames * self.hop_length:]
+        return frames
+
+    def flush(self):
+        """
+        Pad the end of the stream and return the remaining frames.
+
+        Returns:
+        ndarray: Remaining frames, shape (n_frames, frame_length).
+        """
+        return self.push(np.zeros(self.frame_length // 2, dtype=np.float32))
+
+
+class FrameRing:
+    """
+    Bounded first-in first-out queue of frames in a preallocated ring.
+
+    Frames are copied in once when pushed, and popped frames are a view of the ring unless
+    they wrap around its end, so queued frames are never copied again as the queue moves.
+
+    Parameters:
+    frame_length (int): Samples per frame.
+    capacity (int): Largest number of frames queued at once.
+    """
+
+    def __init__(self, frame_length, capacity):
+        self._frames = np.empty((capacity, frame_length), dtype=np.float32)
+        self._start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, frames):
+        """
+        Queue frames behind the ones already queued.
+
+        Parameters:
+        frames (ndarray): Frames, shape (n_frames, frame_length).
+        """
+        capacity = len(self._frames)
+        if self.size + len(frames) > capacity:
+            raise ValueError(f"{self.size + len(frames)} frames pending, more than the capacity of {capacity}")
+        end = (self._start + self.size) % capacity
+        head = min(len(frames), capacity - end)
+        self._frames[end:end + head] = frames[:head]
+        self._frames[:len(frames) - head] = frames[head:]
+        self.size += len(frames)
+
+    def pop(self, n_frames):
+        """
+        Dequeue the oldest frames.
+
+        Parameters:
+        n_frames (int): Number of frames, at most `size`.
+
+        Returns:
+        ndarray: Frames, shape (n_frames, frame_length); only valid until the next push.
+        """
+        capacity = len(self._frames)
+        start = self._start
+        self._start = (start + n_frames) % capacity
+        self.size -= n_frames
+        if start + n_frames <= capacity:
+            return self._frames[start:start + n_frames]
+        return np.concatenate([self._frames[start:], self._frames[:start + n_frames - capacity]])
+
+    def clear(self):
+        self._start = 0
+        self.size = 0
+
+
+class _Welford:
+    # Running mean and population variance, merged one block at a time (Chan et al.)
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        block_mean = np.mean(values)
+        block_m2 = np.sum((values - block_mean) ** 2)
+        count = self.count + len(values)
+        delta = block_mean - self.mean
+        self.mean += delta * len(values) / count
+        self.m2 += block_m2 + delta ** 2 * self.count * len(values) / count
+        self.count = count
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count) if self.count > 0 else 0.0
+
+
+# Buckets of the single-pass DSS histogram: 1/64 octave wide, covering frame RMS from 2**-40 to 2**8
+RMS_BUCKETS_PER_OCTAVE = 64
+RMS_OCTAVES = (-40, 8)
+
+
+class _RmsHistogram:
+    # Sums of (frames, RMS, squared RMS, flux, frames with a flux) per log-spaced RMS bucket,
+    # so the statistics above any threshold are known at the end in a fixed amount of memory
+    def __init__(self):
+        self.sums = np.zeros(((RMS_OCTAVES[1] - RMS_OCTAVES[0]) * RMS_BUCKETS_PER_OCTAVE, 5))
+
+    def _position(self, rms):
+        return (np.log2(np.maximum(rms, 2.0 ** RMS_OCTAVES[0])) - RMS_OCTAVES[0]) * RMS_BUCKETS_PER_OCTAVE
+
+    def update(self, rms, flux):
+        rms = np.asarray(rms, dtype=np.float64)
+        n_buckets = len(self.sums)
+        buckets = np.minimum(self._position(rms).astype(np.int64), n_buckets - 1)
+        has_flux = ~np.isnan(flux)
+        for column, values in enumerate((np.ones(len(rms)), rms, rms ** 2, np.where(has_flux, flux, 0), has_flux)):
+            self.sums[:, column] += np.bincount(buckets, weights=values, minlength=n_buckets)
+
+    def above(self, threshold):
+        # Sums over the frames above the threshold; the frames of the bucket holding it are
+        # split in proportion to the part of the bucket's log width above the threshold
+        if threshold <= 0:
+            return self.sums.sum(axis=0) - self.sums[0]
+        position = float(self._position(threshold))
+        bucket = min(int(position), len(self.sums) - 1)
+        fraction = max(1 - (position - bucket), 0.0)
+        return self.sums[bucket + 1:].sum(axis=0) + fraction * self.sums[bucket]
+
+
+def _frame_rms(frames):
+    # Same as librosa.feature.rms on the frames
+    return np.sqrt(np.mean(np.abs(frames) ** 2, axis=1))
+
+
+def _frame_magnitudes(frames, window):
+    # |STFT| of a batch of frames, transposed to librosa's (n_bins, n_frames) layout
+    return np.abs(np.fft.rfft(frames * window, axis=1)).astype(np.float32).T
+
+
+class StreamingDSS:
+    """
+    Dynamic Stability Score computed block by block.
+
+    The active-frame threshold of the DSS is 0.1 * max(RMS), which is only known at the end
+    of the stream. With `presence_threshold` given (for example from the RMS-only first pass
+    of stream_dynamic_stability), frame RMS and flux are accumulated with Welford
+    updates in constant memory and the score is exact. Without it, frame count, RMS,
+    squared RMS and flux are summed into a fixed histogram of 1/64-octave RMS buckets, and
+    the buckets above the final threshold give the score. Only the frames within about 1%
+    of the threshold are apportioned rather than tested one by one, so the single-pass
+    score is close to, but not always exactly, the two-pass one.
+
+    Parameters:
+    sr (int): Sample rate of the audio.
+    fft_window_size (int): Size of the FFT window for STFT.
+    hop_length (int): Hop length for STFT.
+    instrument_type (str): Type of instrument ('drums', 'bass', 'other').
+    dss_normalizer (float): RMS mean/std ratio that maps to a stability score of 100.
+    presence_threshold (float): Absolute RMS threshold for active frames, if known in advance.
+    """
+
+    def __init__(self, sr, fft_window_size=2048, hop_length=512, instrument_type=None, dss_normalizer=3.0, presence_threshold=None):
+        self.sr = sr
+        self.instrument_type = instrument_type
+        self.dss_normalizer = dss_normalizer
+        self.presence_threshold = presence_threshold
+        self.max_rms = 0.0
+        self.n_frames = 0
+        self._framer = FrameBuffer(fft_window_size, hop_length)
+        self._window = librosa.filters.get_window('hann', fft_window_size, fftbins=True).astype(np.float32)
+        self._previous_magnitude = None
+        self._rms_stats = _Welford()
+        self._flux_sum = 0.0
+        self._flux_count = 0
+        self._histogram = _RmsHistogram()
+
+    def update(self, block):
+        """
+        Consume the next block of mono samples.
+        """
+        self._process(self._framer.push(block))
+
+    def result(self):
+        """
+        Finish the stream and return the dynamic stability score.
+
+        Returns:
+        float: The dynamic stability score, as evaluate_dynamic_stability computes it.
+        """
+        self._process(self._framer.flush())
+
+        if self.presence_threshold is None:
+            # Frame 0 has no flux, so it only contributes to the RMS statistics
+            rms_count, rms_sum, rms_square_sum, flux_sum, flux_count = self._histogram.above(0.1 * self.max_rms)
+            rms_mean = rms_sum / rms_count if rms_count > 0 else 0.0
+            rms_std = np.sqrt(max(rms_square_sum / rms_count - rms_mean ** 2, 0.0)) if rms_count > 0 else 0.0
+            flux_mean = flux_sum / flux_count if flux_count > 0 else None
+        else:
+            rms_count = self._rms_stats.count
+            rms_mean, rms_std = self._rms_stats.mean, self._rms_stats.std
+            flux_mean = self._flux_sum / self._flux_count if self._flux_count > 0 else None
+
+        return dynamic_score_from_statistics(rms_count, rms_mean, rms_std, flux_mean, self.instrument_type, self.dss_normalizer)
+
+    def _process(self, frames):
+        if len(frames) == 0:
+            return
+        rms = _frame_rms(frames)
+        magnitude = _frame_magnitudes(frames, self._window)
+
+        # Flux of each frame against the previous one, carried across blocks
+        if self._previous_magnitude is not None:
+            flux = spectral_flux(magnitude, previous=self._previous_magnitude[:, 0])
+        else:
+            flux = np.concatenate([[np.nan], spectral_flux(magnitude)])
+        self._previous_magnitude = magnitude[:, -1:]
+        self.n_frames += len(frames)
+        self.max_rms = max(self.max_rms, float(np.max(rms)))
+
+        if self.presence_threshold is None:
+            self._histogram.update(rms, flux)
+        else:
+            active = rms > self.presence_threshold
+            self._rms_stats.update(rms[active])
+            active_flux = flux[active & ~np.isnan(flux)]
+            self._flux_sum += float(np.sum(active_flux))
+            self._flux_count += len(active_flux)
+
+
+class StreamingFIS:
+    """
+    Frequency Isolation Score computed block by block from parallel mix and stem streams.
+
+    Per frame only the fundamental presence and harmonic pass counts are kept as running
+    totals, so memory does not grow with the stream length. Frames of one stream wait in a
+    bounded FrameRing until the other stream catches up. Once a stream has ended and all
+    of its frames are scored, the other stream's frames can never be paired, so they are
+    dropped instead of buffered.
+
+    Parameters:
+    sr (int): Sample rate of the audio.
+    fft_window_size (int): Size of the FFT window for STFT.
+    hop_length (int): Hop length for STFT.
+    weight_fundamental (float): Weight for the fundamental frequency.
+    max_pending_frames (int): Frames one stream may run ahead of the other; the blocks
+        passed to one update must stay within it.
+    """
+
+    def __init__(self, sr, fft_window_size=2048, hop_length=512, weight_fundamental=40.0, max_pending_frames=1024):
+        self.sr = sr
+        self.fft_window_size = fft_window_size
+        self.weight_fundamental = weight_fundamental
+        self.n_frames = 0
+        self._framers = [FrameBuffer(fft_window_size, hop_length), FrameBuffer(fft_window_size, hop_length)]
+        self._window = librosa.filters.get_window('hann', fft_window_size, fftbins=True).astype(np.float32)
+        self._pending = [FrameRing(fft_window_size, max_pending_frames), FrameRing(fft_window_size, max_pending_frames)]
+        self._ended = [False, False]
+        self._fundamental_present = False
+        self._harmonic_passes = 0
+        self._last_harmonic_count = 0
+
+    @property
+    def exhausted(self):
+        """
+        True once a stream has ended and all of its frames are scored, so further samples
+        of the other stream no longer change the score.
+        """
+        return any(ended and len(pending) == 0 for ended, pending in zip(self._ended, self._pending))
+
+    def update(self, mix_block, stem_block):
+        """
+        Consume the next blocks of mono mix and stem samples (they may differ in length).
+
+        Pass None for a stream that has ended; an ended stream accepts no more samples.
+        """
+        for stream, block in enumerate((mix_block, stem_block)):
+            if self._ended[stream]:
+                if block is not None:
+                    raise ValueError("samples passed after the end of the stream")
+                continue
+            frames = self._framers[stream].flush() if block is None else self._framers[stream].push(block)
+            if not self.exhausted:
+                self._pending[stream].push(frames)
+            self._ended[stream] = block is None
+        self._process()
+        if self.exhausted:
+            for pending in self._pending:
+                pending.clear()
+
+    def result(self):
+        """
+        Finish the streams and return the frequency isolation score.
+
+        Frames beyond the end of the shorter stream are ignored, like the min_frames
+        truncation of evaluate_frequency_isolation.
+
+        Returns:
+        float: The frequency isolation score.
+        """
+        self.update(None, None)
+
+        return isolation_score_from_statistics(self._fundamental_present, self._harmonic_passes, self.n_frames, self._last_harmonic_count, self.weight_fundamental)
+
+    def _process(self):
+        n_frames = min(len(pending) for pending in self._pending)
+        if n_frames == 0:
+            return
+        mag_mix = _frame_magnitudes(self._pending[0].pop(n_frames), self._window)
+        mag_stem = _frame_magnitudes(self._pending[1].pop(n_frames), self._window)
+
+        fundamental_freq_indices = _fundamental_bin_indices(mag_stem)
+        fundamental_present, harmonic_passes, harmonic_counts = _harmonic_statistics(mag_mix, mag_stem, fundamental_freq_indices, self.sr, self.fft_window_size)
+        self._fundamental_present = self._fundamental_present or bool(np.any(fundamental_present))
+        self._harmonic_passes += int(np.sum(harmonic_passes))
+        self._last_harmonic_count = int(harmonic_counts[-1])
+        self.n_frames += n_frames
+
+
+def audio_blocks(path, blocksize=65536):
+    """
+    Read an audio file block by block as mono float32, downmixing like librosa.load.
+
+    Parameters:
+    path (str): Audio file path.
+    blocksize (int): Samples per block.
+
+    Yields:
+    ndarray: Mono block of samples.
+    """
+    for block in sf.blocks(path, blocksize=blocksize, dtype='float32', always_2d=True):
+        yield block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+
+
+def stream_dynamic_stability(stem_path, fft_window_size=2048, hop_length=512, instrument_type=None, dss_normalizer=3.0, blocksize=65536, two_pass=True):
+    """
+    Compute the dynamic stability score of an audio file in constant memory.
+
+    Parameters:
+    stem_path (str): Stem audio file.
+    fft_window_size (int): Size of the FFT window for STFT.
+    hop_length (int): Hop length for STFT.
+    instrument_type (str): Type of instrument ('drums', 'bass', 'other').
+    dss_normalizer (float): RMS mean/std ratio that maps to a stability score of 100.
+    blocksize (int): Samples read per block.
+    two_pass (bool): If True, read the file twice: a cheap RMS-only pass finds the
+        active-frame threshold, then a Welford pass scores it. If False, read it once
+        into the RMS histogram of StreamingDSS, which is close to but not always exactly
+        the two-pass score.
+
+    Returns:
+    float: The dynamic stability score.
+    """
+    sr = sf.info(stem_path).samplerate
+    presence_threshold = None
+    if two_pass:
+        framer = FrameBuffer(fft_window_size, hop_length)
+        max_rms = np.float32(0)
+        for block in audio_blocks(stem_path, blocksize):
+            frames = framer.push(block)
+            if len(frames) > 0:
+                max_rms = max(max_rms, np.max(_frame_rms(frames)))
+        frames = framer.flush()
+        if len(frames) > 0:
+            max_rms = max(max_rms, np.max(_frame_rms(frames)))
+        presence_threshold = 0.1 * max_rms
+
+    scorer = StreamingDSS(sr, fft_window_size, hop_length, instrument_type=instrument_type, dss_normalizer=dss_normalizer, presence_threshold=presence_threshold)
+    for block in audio_blocks(stem_path, blocksize):
+        scorer.update(block)
+    return scorer.result()
+
+
+def stream_frequency_isolation(mix_path, stem_path, fft_window_size=2048, hop_length=512, weight_fundamental=40.0, blocksize=65536):
+    """
+    Compute the frequency isolation score of two audio files in constant memory.
+
+    Parameters:
+    mix_path (str): Mix audio file.
+    stem_path (str): Stem audio file.
+    fft_window_size (int): Size of the FFT window for STFT.
+    hop_length (int): Hop length for STFT.
+    weight_fundamental (float): Weight for the fundamental frequency.
+    blocksize (int): Samples read per block.
+
+    Returns:
+    float: The frequency isolation score.
+    """
+    sr = sf.info(stem_path).samplerate
+    # Both streams advance one block at a time, so neither runs ahead by more than two blocks
+    scorer = StreamingFIS(sr, fft_window_size, hop_length, weight_fundamental=weight_fundamental, max_pending_frames=2 * (blocksize // hop_length + 2))
+    mix_blocks = audio_blocks(mix_path, blocksize)
+    stem_blocks = audio_blocks(stem_path, blocksize)
+    mix_ended = stem_ended = False
+    # The rest of the longer file is not read once the shorter one is scored
+    while not scorer.exhausted and not (mix_ended and stem_ended):
+        mix_block = None if mix_ended else next(mix_blocks, None)
+        stem_block = None if stem_ended else next(stem_blocks, None)
+        scorer.update(mix_block, stem_block)
+        mix_ended, stem_ended = mix_block is None, stem_block is None
+    return scorer.result()
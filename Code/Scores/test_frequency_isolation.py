@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+import Frequency_Isolation_Score
+from Frequency_Isolation_Score import _fundamental_bin_indices, _harmonic_statistics, isolation_score_from_statistics
+
+SR = 22050
+N_FFT = 2048
+
+
+def loop_frequency_isolation(mag_mix, mag_stem, sr, fft_window_size, weight_fundamental=40.0):
+    # The per-frame loop of the original score, kept as the reference for the vectorized version
+    fundamental_score = 0
+    harmonics_score = 0
+    weight_harmonics = 60.0
+    count_valid_frames = 0
+    passes_per_frame, counts_per_frame = [], []
+
+    fundamental_freq_indices = np.array([np.flatnonzero(mag_stem[:, t] > 0)[0] if len(np.flatnonzero(mag_stem[:, t] > 0)) > 0 else 0 for t in range(mag_stem.shape[1])])
+    fundamental_freq_indices = np.clip(fundamental_freq_indices, 0, mag_mix.shape[0] - 1)
+
+    for t, f_idx in enumerate(fundamental_freq_indices):
+        count_valid_frames += 1
+        if mag_mix[f_idx, t] > 0:
+            fundamental_score = weight_fundamental
+        harmonic_indices = [f_idx * (n + 1) for n in range(1, int(20000 / (sr / fft_window_size))) if f_idx * (n + 1) < mag_mix.shape[0]]
+        passes = 0
+        for idx in harmonic_indices:
+            if mag_mix[idx, t] >= mag_stem[idx, t]:
+                passes += 1
+        harmonics_score += passes
+        passes_per_frame.append(passes)
+        counts_per_frame.append(len(harmonic_indices))
+
+    max_possible_harmonics_score = count_valid_frames * len(harmonic_indices)
+    if max_possible_harmonics_score > 0:
+        harmonics_score = (harmonics_score / max_possible_harmonics_score) * weight_harmonics
+    return fundamental_score + harmonics_score, np.array(passes_per_frame), np.array(counts_per_frame)
+
+
+def vectorized_frequency_isolation(mag_mix, mag_stem, sr, fft_window_size, weight_fundamental=40.0):
+    present, passes, counts = _harmonic_statistics(mag_mix, mag_stem, _fundamental_bin_indices(mag_stem), sr, fft_window_size)
+    score = isolation_score_from_statistics(bool(np.any(present)), int(np.sum(passes)), len(counts), counts[-1], weight_fundamental)
+    return score, passes, counts
+
+
+def random_spectrograms(rng, n_frames=60, zero_fraction=0.9):
+    # Sparse stems, so the fundamental (first non-zero bin) varies from frame to frame
+    n_bins = N_FFT // 2 + 1
+    mag_mix = rng.random((n_bins, n_frames)) * (rng.random((n_bins, n_frames)) > 0.3)
+    mag_stem = rng.random((n_bins, n_frames)) * (rng.random((n_bins, n_frames)) > zero_fraction)
+    return mag_mix, mag_stem
+
+
+def assert_matches_loop(mag_mix, mag_stem):
+    expected_score, expected_passes, expected_counts = loop_frequency_isolation(mag_mix, mag_stem, SR, N_FFT)
+    score, passes, counts = vectorized_frequency_isolation(mag_mix, mag_stem, SR, N_FFT)
+    np.testing.assert_array_equal(passes, expected_passes)
+    np.testing.assert_array_equal(counts, expected_counts)
+    assert np.allclose(score, expected_score)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_random_spectrograms_match_loop(seed):
+    assert_matches_loop(*random_spectrograms(np.random.default_rng(seed)))
+
+
+@pytest.mark.parametrize('zero_fraction', [0.5, 0.99, 0.999])
+def test_fundamental_spread_matches_loop(zero_fraction):
+    assert_matches_loop(*random_spectrograms(np.random.default_rng(7), zero_fraction=zero_fraction))
+
+
+def test_dc_and_silent_frames_match_loop():
+    # Silent stem frames and stems with DC energy both have bin 0 as their fundamental,
+    # where every harmonic is bin 0 itself
+    rng = np.random.default_rng(1)
+    mag_mix, mag_stem = random_spectrograms(rng)
+    mag_stem[:, ::3] = 0
+    mag_stem[0, 1::3] = 1.0
+    mag_mix[0, 1::6] = 0
+    assert_matches_loop(mag_mix, mag_stem)
+
+
+def test_silent_stem_and_mix_match_loop():
+    mag_mix, mag_stem = random_spectrograms(np.random.default_rng(2))
+    assert_matches_loop(np.zeros_like(mag_mix), np.zeros_like(mag_stem))
+
+
+@pytest.mark.parametrize('last_bin', [0, 3, 400, N_FFT // 2])
+def test_last_frame_normalizer_matches_loop(last_bin):
+    # The normalizer uses the harmonic count of the last frame only, whatever the other frames checked
+    rng = np.random.default_rng(3)
+    mag_mix, mag_stem = random_spectrograms(rng)
+    mag_stem[:, -1] = 0
+    mag_stem[last_bin, -1] = 1.0
+    assert_matches_loop(mag_mix, mag_stem)
+
+
+def test_blocked_grid_matches_loop(monkeypatch):
+    # Blocks of a few frames exercise the block loop over the harmonic grid
+    monkeypatch.setattr(Frequency_Isolation_Score, 'HARMONIC_BLOCK_ELEMENTS', 64)
+    assert_matches_loop(*random_spectrograms(np.random.default_rng(4), zero_fraction=0.5))
@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+# Scores ten minutes of synthetic audio in a fresh process, so the peak RSS it reports
+# belongs to the scorers only. The working memory above the resident inputs is the
+# growth of the peak RSS over the resident size measured just before scoring.
+SCRIPT = """
+import sys, json, resource
+import numpy as np
+from Frequency_Isolation_Score import evaluate_frequency_isolation
+from Dynamic_Stability_Score import evaluate_dynamic_stability
+
+def resident():
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * resource.getpagesize()
+
+def peak():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+sr, minutes, max_memory = (int(value) for value in sys.argv[1:])
+t = np.arange(minutes * 60 * sr, dtype=np.float32) / np.float32(sr)
+stem = (0.3 * np.sin(2 * np.pi * 220 * t) * (1 + 0.5 * np.sin(2 * np.pi * 0.5 * t))).astype(np.float32)
+del t
+mix = stem + 0.05 * np.random.default_rng(0).standard_normal(len(stem), dtype=np.float32)
+# Warm up imports and FFT plans on a few seconds, so only the scoring itself is measured
+evaluate_frequency_isolation(mix[:5 * sr], stem[:5 * sr], sr, max_memory=max_memory)
+evaluate_dynamic_stability(mix[:5 * sr], stem[:5 * sr], sr, verbose=False, max_memory=max_memory)
+
+start = resident()
+scores = [evaluate_frequency_isolation(mix, stem, sr, max_memory=max_memory),
+          evaluate_dynamic_stability(mix, stem, sr, verbose=False, max_memory=max_memory)]
+budgeted = peak() - start
+evaluate_frequency_isolation(mix, stem, sr)
+evaluate_dynamic_stability(mix, stem, sr, verbose=False)
+print(json.dumps({'budgeted': budgeted, 'unbudgeted': peak() - start, 'scores': [float(score) for score in scores]}))
+"""
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="reads the resident size from /proc")
+@pytest.mark.parametrize('max_memory', [16 << 20, 64 << 20])
+def test_ten_minutes_stay_within_max_memory(max_memory):
+    output = subprocess.run([sys.executable, '-c', SCRIPT, '22050', '10', str(max_memory)], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    measured = json.loads(output.splitlines()[-1])
+    assert measured['budgeted'] < max_memory
+    # The unbudgeted run holds whole spectrograms, so the measurement can tell the two apart
+    assert measured['unbudgeted'] > 2 * max_memory
+    assert all(0 <= score for score in measured['scores'])
@@ -0,0 +1,87 @@
+import numpy as np
+import librosa
+import pytest
+
+from online_monitor import OnlineQualityMonitor
+from Dynamic_Stability_Score import evaluate_dynamic_stability, dynamic_score_from_statistics
+from Frequency_Isolation_Score import evaluate_frequency_isolation
+
+SR = 22050
+
+
+def synthetic_pair(seconds, seed=0):
+    # A tone with a slow swell and a fade-in, so the active frames and the window maximum change over time
+    t = np.arange(int(seconds * SR)) / SR
+    stem = (0.3 * np.sin(2 * np.pi * 220 * t) * (1 + 0.5 * np.sin(2 * np.pi * 0.7 * t)) * np.minimum(t, 1)).astype(np.float32)
+    mix = stem + (0.05 * np.random.default_rng(seed).standard_normal(len(t))).astype(np.float32)
+    return mix, stem
+
+
+def push_blocks(monitor, stem, mix, blocksize):
+    for start in range(0, len(stem), blocksize):
+        mix_block = mix[start:start + blocksize] if mix is not None and start < len(mix) else None
+        monitor.push(stem[start:start + blocksize], mix_block)
+    return monitor.flush()
+
+
+@pytest.mark.parametrize('blocksize', [512, 3001])
+def test_flushed_monitor_matches_exact_scorers(blocksize):
+    mix, stem = synthetic_pair(6.1)
+    scores = push_blocks(OnlineQualityMonitor(SR, window_seconds=10), stem, mix, blocksize)
+
+    assert scores['dss'] == pytest.approx(evaluate_dynamic_stability(mix, stem, SR, verbose=False), rel=1e-5)
+    assert scores['fis'] == pytest.approx(evaluate_frequency_isolation(mix, stem, SR), rel=1e-9)
+
+
+def test_window_rolls_over():
+    _, stem = synthetic_pair(6)
+    monitor = OnlineQualityMonitor(SR, window_seconds=1.0)
+    window = int(round(SR / 512))
+    rms = librosa.feature.rms(y=stem, frame_length=2048, hop_length=512)[0]
+    magnitude = np.abs(librosa.stft(stem, n_fft=2048, hop_length=512))
+    flux = np.concatenate([[np.nan], np.sum(np.diff(magnitude, axis=1) ** 2, axis=0)])
+
+    for start in range(0, len(stem), 512):
+        scores = monitor.push(stem[start:start + 512])
+        if scores is None:
+            continue
+        end = monitor.n_frames
+        assert scores['frames'] == min(end, window)
+        window_rms = rms[max(end - window, 0):end]
+        window_flux = flux[max(end - window, 0):end]
+        active = window_rms > 0.1 * np.max(window_rms)
+        active_flux = window_flux[active & ~np.isnan(window_flux)]
+        expected = dynamic_score_from_statistics(np.sum(active), np.mean(window_rms[active]), np.std(window_rms[active]),
+                                                 np.mean(active_flux) if len(active_flux) > 0 else None)
+        assert scores['dss'] == pytest.approx(expected, rel=1e-5)
+    assert monitor.n_frames > 2 * window
+
+
+def test_fis_counts_only_frames_with_a_mix():
+    # The stem outlasts the mix, so its last frames are scored for the DSS only
+    mix, stem = synthetic_pair(6)
+    mix = mix[:4 * SR]
+    scores = push_blocks(OnlineQualityMonitor(SR, window_seconds=10), stem, mix, 1024)
+
+    assert scores['frames'] == len(librosa.feature.rms(y=stem, hop_length=512)[0])
+    assert scores['dss'] == pytest.approx(evaluate_dynamic_stability(mix, stem, SR, verbose=False), rel=1e-5)
+    assert scores['fis'] == pytest.approx(evaluate_frequency_isolation(mix, stem, SR), rel=1e-9)
+
+
+def test_stem_running_ahead_of_the_mix_is_bounded():
+    mix, stem = synthetic_pair(2)
+    monitor = OnlineQualityMonitor(SR, max_pending_frames=16)
+    monitor.push(stem[:512], mix[:512])
+    with pytest.raises(ValueError):
+        for start in range(512, len(stem), 512):
+            monitor.push(stem[start:start + 512])
+    assert len(monitor._pending_stem) <= 16
+
+
+def test_push_after_flush_raises():
+    mix, stem = synthetic_pair(1)
+    monitor = OnlineQualityMonitor(SR)
+    monitor.push(stem, mix)
+    monitor.flush()
+    with pytest.raises(ValueError):
+        monitor.push(stem, mix)
@@ -0,0 +1,40 @@
+import sys
+import threading
+from multiprocessing.connection import Client
+
+import numpy as np
+import soundfile as sf
+import pytest
+
+from scoring_daemon import ScoringDaemon, request
+
+SR = 22050
+
+
+@pytest.mark.skipif(sys.platform.startswith('win'), reason="serves on a Unix socket")
+def test_open_connection_does_not_block_other_clients(tmp_path):
+    address, key_file = str(tmp_path / 'daemon.sock'), str(tmp_path / 'key')
+    daemon = ScoringDaemon(address, key_file)
+    server = threading.Thread(target=daemon.serve, daemon=True)
+    server.start()
+    while not (tmp_path / 'daemon.sock').exists():
+        server.join(0.05)
+
+    t = np.arange(SR) / SR
+    stem = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    sf.write(str(tmp_path / 'mix.wav'), stem + 0.01 * np.cos(2 * np.pi * 330 * t).astype(np.float32), SR)
+    sf.write(str(tmp_path / 'stem.wav'), stem, SR)
+
+    with open(key_file, 'rb') as file:
+        authkey = file.read()
+    with Client(address, authkey=authkey) as idle:
+        idle.send({'command': 'ping'})
+        assert idle.recv()['requests'] == 1
+        # The first client keeps its connection open while others are served
+        scores = request({'command': 'score', 'mix': str(tmp_path / 'mix.wav'), 'stem': str(tmp_path / 'stem.wav')}, address, key_file)
+        assert set(scores) == {'fis', 'dss', 'seconds'}
+        assert request({'command': 'ping'}, address, key_file)['requests'] == 3
+
+        assert request({'command': 'shutdown'}, address, key_file) == {'stopped': True}
+        server.join(10)
+        assert not server.is_alive()
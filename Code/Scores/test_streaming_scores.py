@@ -0,0 +1,42 @@
+import numpy as np
+import soundfile as sf
+import pytest
+
+from streaming_scores import StreamingDSS, stream_dynamic_stability
+from Dynamic_Stability_Score import evaluate_dynamic_stability
+
+SR = 22050
+
+
+def synthetic_stem(kind, seconds=20):
+    t = np.arange(seconds * SR) / SR
+    rng = np.random.default_rng(0)
+    if kind == 'tone':
+        stem = 0.3 * np.sin(2 * np.pi * 220 * t) * (1 + 0.5 * np.sin(2 * np.pi * 0.7 * t)) * np.minimum(t, 1)
+    elif kind == 'noise':
+        stem = 0.2 * rng.standard_normal(len(t)) * np.sin(2 * np.pi * 0.1 * t) ** 2
+    else:
+        stem = np.zeros(len(t))
+    return stem.astype(np.float32)
+
+
+@pytest.mark.parametrize('kind', ['tone', 'noise', 'silence'])
+def test_single_pass_is_close_to_two_pass(tmp_path, kind):
+    stem = synthetic_stem(kind)
+    path = str(tmp_path / 'stem.wav')
+    sf.write(path, stem, SR, subtype='FLOAT')
+
+    exact = evaluate_dynamic_stability(stem, stem, SR, verbose=False)
+    assert stream_dynamic_stability(path) == pytest.approx(exact, rel=1e-5, abs=1e-6)
+    assert stream_dynamic_stability(path, two_pass=False) == pytest.approx(exact, rel=1e-2, abs=1e-6)
+
+
+def test_single_pass_memory_does_not_grow():
+    scorer = StreamingDSS(SR)
+    histogram_shape = scorer._histogram.sums.shape
+    stem = synthetic_stem('noise', seconds=5)
+    for _ in range(4):
+        for start in range(0, len(stem), 4096):
+            scorer.update(stem[start:start + 4096])
+    assert scorer._histogram.sums.shape == histogram_shape
+    assert scorer._histogram.sums[:, 0].sum() == scorer.n_frames